@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.forms import ModelForm
 
 # Register your models here.
-from .models import BlogPost, EmailOrder
+from .models import BlogPost, EmailOrder, OutboxMessage, OutboxRecipient
 from members.models import MemberFlag
 
 class BlogPostAdminForm(ModelForm):
@@ -31,7 +31,25 @@ class EmailOrderAdmin(admin.ModelAdmin):
     model = EmailOrder
     inlines = [MemberFlagsInline]
     exclude = ('flags',)
+    list_display = ('__str__', 'email_sent', 'recipients_sent', 'recipients_failed', 'recipients_total')
+    readonly_fields = ('recipients_total', 'recipients_sent', 'recipients_failed')
+
+
+class OutboxRecipientInline(admin.TabularInline):
+    model = OutboxRecipient
+    fields = ('email_address', 'status', 'attempts', 'next_attempt', 'date_sent')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+class OutboxMessageAdmin(admin.ModelAdmin):
+    model = OutboxMessage
+    inlines = [OutboxRecipientInline]
+    list_display = ('subject', 'created', 'email_order')
+    readonly_fields = ('subject', 'body', 'html_body', 'created', 'email_order')
 
 
 admin.site.register(BlogPost, BlogPostAdmin)
-admin.site.register(EmailOrder, EmailOrderAdmin)
\ No newline at end of file
+admin.site.register(EmailOrder, EmailOrderAdmin)
+admin.site.register(OutboxMessage, OutboxMessageAdmin)
\ No newline at end of file
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class BlogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'blog'
+
+    def ready(self):
+        from phylactery.fragments import fragments_changed
+        from .models import BlogPost
+        # The most recent blog posts on the home page are cached
+        post_save.connect(fragments_changed, sender=BlogPost)
+        post_delete.connect(fragments_changed, sender=BlogPost)
@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from blog.models import BlogPost, EmailOrder
+from members.models import Member
+from members.tokens import email_preference_token
+from phylactery.tasks import compose_html_email, CompiledEmail
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a list of members and an email order, then reports the cost per recipient of composing the email '
+        'for every member, against composing it once and personalising it for each. Nothing is sent, '
+        'and everything is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=2000, help='Number of members to seed.')
+        parser.add_argument(
+            '--sample', type=int, default=200,
+            help='Number of members to compose the email for separately, as it is slow.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write('Seeding {0} members...'.format(options['members']))
+            Member.objects.bulk_create([
+                Member(
+                    first_name='Benchmark', last_name=str(number),
+                    email_address='benchmark{0}@example.com'.format(number), receive_emails=True
+                )
+                for number in range(options['members'])
+            ], batch_size=1000)
+            post = BlogPost.objects.create(
+                title='Benchmark', slug_title='benchmark-email-order', short_description='Benchmark',
+                author='Benchmark', publish_on=timezone.now(),
+                body='\n\n'.join('Paragraph **{0}** of the news, with a [link](/).'.format(i) for i in range(20))
+            )
+            order = EmailOrder.objects.create(post=post)
+            members = list(order.get_members_to_send_to())
+
+            sample = members[:options['sample']]
+            start = time.perf_counter()
+            for member in sample:
+                compose_html_email('blog/email_blog_post.html', {
+                    'blogpost': post,
+                    'uid': urlsafe_base64_encode(force_bytes(member.pk)),
+                    'token': email_preference_token.make_token(member),
+                })
+            separately = (time.perf_counter() - start) / len(sample)
+
+            start = time.perf_counter()
+            compiled_email = CompiledEmail('blog/email_blog_post.html', {'blogpost': post}, ['uid', 'token'])
+            compiling = time.perf_counter() - start
+            start = time.perf_counter()
+            for member in members:
+                compiled_email.personalise(
+                    uid=urlsafe_base64_encode(force_bytes(member.pk)),
+                    token=email_preference_token.make_token(member)
+                )
+            personalising = (time.perf_counter() - start) / len(members)
+
+            self.stdout.write('')
+            self.stdout.write('Composed for each member: {0:.3f}ms per recipient, {1:.1f}s for {2} members.'.format(
+                separately * 1000, separately * len(members), len(members)
+            ))
+            self.stdout.write(
+                'Composed once: {0:.3f}ms to compose, then {1:.3f}ms per recipient, {2:.1f}s in total.'.format(
+                    compiling * 1000, personalising * 1000, compiling + personalising * len(members)
+                )
+            )
+            transaction.set_rollback(True)
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_alter_emailorder_flags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailorder',
+            name='recipients_failed',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='emailorder',
+            name='recipients_sent',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='emailorder',
+            name='recipients_total',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
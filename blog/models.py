@@ -1,7 +1,9 @@
 from django.db import models
+from django.db.models import Count, Min, Q
 from django.utils import timezone
 from django.urls import reverse
 from members.models import Member, MemberFlag
+import datetime
 
 class BlogPost(models.Model):
     # Blog Post Title + Slug
@@ -84,19 +86,120 @@ class EmailOrder(models.Model):
     # Note: Members will not be sent emails unless they have the "receive emails" flag set to True on their account.
     flags = models.ManyToManyField(MemberFlag, related_name='emailorders')
 
+    # How far along sending the emails is. The batches of emails are sent by separate tasks,
+    # which each add to these as they go.
+    recipients_total = models.IntegerField(default=0, editable=False)
+    recipients_sent = models.IntegerField(default=0, editable=False)
+    recipients_failed = models.IntegerField(default=0, editable=False)
+
     @property
     def is_ready(self):
         # Returns true if the post is published and the emails have not been sent.
         return self.email_sent is False and self.post.is_published is True
 
+    @property
+    def progress(self):
+        # Returns the percentage of recipients that have been dealt with, either sent or given up on.
+        if self.recipients_total == 0:
+            return 100 if self.email_sent else 0
+        return round(100 * (self.recipients_sent + self.recipients_failed) / self.recipients_total)
+
     def get_members_to_send_to(self):
         qs = Member.objects.none()
         if self.flags.count() == 0:
             # All members that have the receive_email setting set to true.
             qs = Member.objects.filter(receive_emails=True)
         else:
-            qs = Member.objects.filter(flags__emailorders=self, receive_emails=True)
+            # Members with more than one of the flags would otherwise be sent the email more than once.
+            qs = Member.objects.filter(flags__emailorders=self, receive_emails=True).distinct()
         return qs
 
     def __str__(self):
-        return 'Email Order for: {0}'.format(self.post.title)
\ No newline at end of file
+        return 'Email Order for: {0}'.format(self.post.title)
+
+
+class OutboxMessage(models.Model):
+    # An email waiting in the outbox, which is sent by the dispatch_outbox_task.
+    # The message is stored once, however many recipients it has. Anything that differs between recipients
+    # (like the uid and token of the email preferences link) is left as a placeholder in the message,
+    # and filled in from each recipient's personal_context when it's sent (see phylactery.tasks.CompiledEmail).
+    subject = models.CharField(max_length=300)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    created = models.DateTimeField(default=timezone.now)
+
+    # The email order this message was sent for, whose progress is updated as it's sent.
+    email_order = models.ForeignKey(
+        EmailOrder, null=True, blank=True, on_delete=models.SET_NULL, related_name='outbox_messages'
+    )
+
+    @classmethod
+    def queue(cls, subject, body, html_body, recipients, email_order=None):
+        """
+            Adds an email to the outbox. Recipients is a list of email addresses,
+            or of (email address, personal context) pairs if the email has placeholders.
+        """
+        message = cls.objects.create(
+            subject=subject, body=body, html_body=html_body or '', email_order=email_order
+        )
+        # An address that's given more than once is only queued (and sent the email) once
+        OutboxRecipient.objects.bulk_create([
+            OutboxRecipient(message=message, email_address=recipient) if isinstance(recipient, str) else
+            OutboxRecipient(message=message, email_address=recipient[0], personal_context=recipient[1])
+            for recipient in recipients
+        ], ignore_conflicts=True)
+        return message
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.subject, self.created.strftime('%d/%m/%y %H:%M'))
+
+
+class OutboxRecipient(models.Model):
+    # One recipient of an OutboxMessage, which tracks whether the message has been sent to them.
+    PENDING = 'P'
+    SENT = 'S'
+    FAILED = 'F'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    message = models.ForeignKey(OutboxMessage, on_delete=models.CASCADE, related_name='recipients')
+    email_address = models.EmailField()
+    # The values of the placeholders in the message, for this recipient.
+    personal_context = models.JSONField(default=dict, blank=True)
+
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=PENDING)
+    # How many times sending has been tried, and when it can be tried next.
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    date_sent = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('message', 'email_address')
+        indexes = [
+            # The recipients the dispatcher still has to send to
+            models.Index(fields=['next_attempt'], condition=Q(status='P'), name='outboxrecipient_pending_idx'),
+        ]
+
+    @classmethod
+    def get_stats(cls):
+        """
+            Returns a dict of the number of emails waiting to be sent ('backlog'), how long the oldest
+            has been waiting ('lag', a timedelta, or None if there are none), how many were sent in
+            the last hour ('sent_last_hour'), and how many were given up on ('failed').
+        """
+        now = timezone.now()
+        stats = cls.objects.aggregate(
+            backlog=Count('pk', filter=Q(status=cls.PENDING)),
+            oldest=Min('message__created', filter=Q(status=cls.PENDING)),
+            sent_last_hour=Count('pk', filter=Q(status=cls.SENT, date_sent__gte=now - datetime.timedelta(hours=1))),
+            failed=Count('pk', filter=Q(status=cls.FAILED)),
+        )
+        oldest = stats.pop('oldest')
+        stats['lag'] = now - oldest if oldest is not None else None
+        return stats
+
+    def __str__(self):
+        return '{0} to {1} ({2})'.format(self.message.subject, self.email_address, self.get_status_display())
@@ -1,16 +1,39 @@
 from celery import shared_task
 from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 from django.template import loader
-from phylactery.tasks import send_single_email_task, send_mass_email_task, compose_html_email
+from phylactery.tasks import send_mass_email_task, compose_email_message, send_messages_over_connection, \
+    CompiledEmail
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
+from members.models import Member
 from members.tokens import email_preference_token
 import datetime
 
-from .models import EmailOrder
+from .models import EmailOrder, OutboxMessage, OutboxRecipient
 
 logger = get_task_logger(__name__)
 
+# How long a compiled email order is kept for, which only needs to cover its batches and their retries
+COMPILED_EMAIL_TIMEOUT = 60 * 60 * 6
+
+
+def get_compiled_email(order):
+    """
+        Returns the email of an email order, composed once and shared by all of its batches.
+        Only the uid and token in each member's email preferences link differ between recipients.
+    """
+    cache_key = 'blog:email_order:{0}:compiled'.format(order.pk)
+    compiled_email = cache.get(cache_key)
+    if compiled_email is None:
+        compiled_email = CompiledEmail('blog/email_blog_post.html', {'blogpost': order.post}, ['uid', 'token'])
+        cache.set(cache_key, compiled_email, COMPILED_EMAIL_TIMEOUT)
+    return compiled_email
+
 
 @shared_task(name='send_pending_email_orders_task')
 def send_pending_email_order_task():
@@ -30,22 +53,166 @@ def send_pending_email_order_task():
 
     for order in email_orders:
         if order.is_ready:
-            email_subject = '{0} - Unigames News'.format(order.post.title)
-            members_to_email_to = order.get_members_to_send_to()
-            context = {
-                'blogpost': order.post
-            }
-            for member in members_to_email_to:
-                context['uid'] = urlsafe_base64_encode(force_bytes(member.pk))
-                context['token'] = email_preference_token.make_token(member)
-                body, html_body = compose_html_email('blog/email_blog_post.html', context)
-                send_single_email_task.delay(
-                    member.email_address,
-                    email_subject,
-                    body,
-                    html_message=html_body,
-                    log=True
-                )
+            if settings.EMAIL_OUTBOX:
+                queue_email_order(order)
+                continue
+            member_pks = list(order.get_members_to_send_to().values_list('pk', flat=True))
             order.email_sent = True
+            order.recipients_total = len(member_pks)
             order.save()
+            # Each batch of members is sent to by its own task, over its own connection
+            for i in range(0, len(member_pks), settings.EMAIL_BATCH_SIZE):
+                send_email_order_batch_task.delay(order.pk, member_pks[i:i + settings.EMAIL_BATCH_SIZE])
     return
+
+
+def queue_email_order(order):
+    """
+        Puts the email of an email order in the outbox, stored once with the uid and token of each member.
+    """
+    compiled_email = get_compiled_email(order)
+    # Members can share an email address if it's written differently (e.g. in a different case),
+    # but each address is only sent the email once, with the preferences link of its first member
+    recipients = {}
+    for member in order.get_members_to_send_to().order_by('pk'):
+        recipients.setdefault(member.email_address.lower(), (member.email_address, {
+            'uid': urlsafe_base64_encode(force_bytes(member.pk)),
+            'token': email_preference_token.make_token(member),
+        }))
+    recipients = list(recipients.values())
+    with transaction.atomic():
+        OutboxMessage.queue(
+            '{0} - Unigames News'.format(order.post.title), compiled_email.plaintext_message,
+            compiled_email.html_message, recipients, email_order=order
+        )
+        order.email_sent = True
+        order.recipients_total = len(recipients)
+        order.save()
+
+
+@shared_task(name='send_email_order_batch_task', rate_limit=settings.EMAIL_BATCH_RATE_LIMIT)
+def send_email_order_batch_task(order_pk, member_pks, attempt=0):
+    """
+        Sends the email of an email order to a batch of members, over a single connection.
+        The members whose emails couldn't be sent are retried in a new batch after a backoff,
+        which doubles with every attempt. After EMAIL_MAX_RETRIES retries, they are given up on.
+    """
+    order = EmailOrder.objects.select_related('post').get(pk=order_pk)
+    email_subject = '{0} - Unigames News'.format(order.post.title)
+    members = list(Member.objects.filter(pk__in=member_pks))
+    compiled_email = get_compiled_email(order)
+    email_messages = []
+    for member in members:
+        body, html_body = compiled_email.personalise(
+            uid=urlsafe_base64_encode(force_bytes(member.pk)),
+            token=email_preference_token.make_token(member)
+        )
+        email_messages.append(compose_email_message(member.email_address, email_subject, body, html_body))
+
+    failed_messages = send_messages_over_connection(email_messages)
+    failed_pks = [member.pk for member, message in zip(members, email_messages) if message in failed_messages]
+    num_sent = len(members) - len(failed_pks)
+    # Members that have been deleted since the order was sent out can't be sent to at all
+    num_failed = len(member_pks) - len(members)
+    if failed_pks and attempt < settings.EMAIL_MAX_RETRIES:
+        send_email_order_batch_task.apply_async(
+            (order_pk, failed_pks), {'attempt': attempt + 1}, countdown=settings.EMAIL_RETRY_BACKOFF * 2 ** attempt
+        )
+    else:
+        num_failed += len(failed_pks)
+    EmailOrder.objects.filter(pk=order_pk).update(
+        recipients_sent=F('recipients_sent') + num_sent,
+        recipients_failed=F('recipients_failed') + num_failed
+    )
+    logger.info('Sent {0} emails for {1}, {2} failed.'.format(num_sent, order, len(failed_pks)))
+    return num_sent
+
+
+@shared_task(name='dispatch_outbox_task')
+def dispatch_outbox_task():
+    """
+        Scheduled task.
+        Sends the emails waiting in the outbox, in batches of EMAIL_BATCH_SIZE emails over a single connection,
+        up to EMAIL_OUTBOX_MAX_BATCHES batches per run. Intended to be run every minute or so.
+        Each batch is claimed with SELECT ... FOR UPDATE SKIP LOCKED and leased (see dispatch_outbox_batch),
+        so that more than one dispatcher can run at once without sending the same email twice.
+    """
+    stats = {'sent': 0, 'retrying': 0, 'failed': 0}
+    for batch in range(settings.EMAIL_OUTBOX_MAX_BATCHES):
+        batch_stats = dispatch_outbox_batch()
+        if batch_stats is None:
+            break
+        for key in stats:
+            stats[key] += batch_stats[key]
+    if any(stats.values()):
+        logger.info('Dispatched the outbox: {0} sent, {1} to be retried, {2} failed.'.format(
+            stats['sent'], stats['retrying'], stats['failed']
+        ))
+    return stats
+
+
+def dispatch_outbox_batch():
+    """
+        Claims a batch of recipients waiting in the outbox and sends them their emails.
+        The batch is claimed in a short transaction with SELECT ... FOR UPDATE SKIP LOCKED, which leases
+        the recipients by moving their next attempt EMAIL_OUTBOX_LEASE seconds ahead, so the emails are sent
+        without holding any locks, and are tried again if this dispatcher dies before recording the results.
+        The recipients whose emails couldn't be sent are tried again after a backoff, which doubles with
+        every attempt, until they have been tried EMAIL_MAX_RETRIES times.
+        Returns a dict of the number sent ('sent'), to be retried ('retrying') and given up on ('failed'),
+        or None if there was nothing to send.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        recipients = list(
+            OutboxRecipient.objects
+            .select_for_update(skip_locked=True, of=('self',))
+            .filter(status=OutboxRecipient.PENDING, next_attempt__lte=now)
+            .select_related('message')
+            .order_by('next_attempt', 'pk')[:settings.EMAIL_BATCH_SIZE]
+        )
+        if not recipients:
+            return None
+        for recipient in recipients:
+            recipient.attempts += 1
+            recipient.next_attempt = now + datetime.timedelta(seconds=settings.EMAIL_OUTBOX_LEASE)
+        OutboxRecipient.objects.bulk_update(recipients, ['attempts', 'next_attempt'])
+
+    email_messages = []
+    for recipient in recipients:
+        body, html_body = CompiledEmail.fill_placeholders(
+            recipient.message.body, recipient.message.html_body, recipient.personal_context
+        )
+        email_messages.append(compose_email_message(
+            recipient.email_address, recipient.message.subject, body, html_body or None
+        ))
+    failed_messages = send_messages_over_connection(email_messages)
+
+    now = timezone.now()
+    stats = {'sent': 0, 'retrying': 0, 'failed': 0}
+    order_progress = {}
+    for recipient, email_message in zip(recipients, email_messages):
+        if email_message not in failed_messages:
+            recipient.status = OutboxRecipient.SENT
+            recipient.date_sent = now
+            result = 'sent'
+        elif recipient.attempts > settings.EMAIL_MAX_RETRIES:
+            recipient.status = OutboxRecipient.FAILED
+            result = 'failed'
+        else:
+            recipient.next_attempt = now + datetime.timedelta(
+                seconds=settings.EMAIL_RETRY_BACKOFF * 2 ** (recipient.attempts - 1)
+            )
+            result = 'retrying'
+        stats[result] += 1
+        order_pk = recipient.message.email_order_id
+        if order_pk is not None and result != 'retrying':
+            order_progress.setdefault(order_pk, {'sent': 0, 'failed': 0})[result] += 1
+    with transaction.atomic():
+        OutboxRecipient.objects.bulk_update(recipients, ['status', 'date_sent', 'next_attempt'])
+        for order_pk, progress in order_progress.items():
+            EmailOrder.objects.filter(pk=order_pk).update(
+                recipients_sent=F('recipients_sent') + progress['sent'],
+                recipients_failed=F('recipients_failed') + progress['failed']
+            )
+    return stats
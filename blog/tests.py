@@ -1,3 +1,205 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from members.models import Member
+from members.tokens import email_preference_token
+from phylactery.tasks import compose_html_email, CompiledEmail
+from phylactery.inliner import inline_css, get_css_cache_stats
+from premailer import transform
+from smtplib import SMTPException
+from unittest import mock
+from .models import BlogPost, EmailOrder, OutboxMessage, OutboxRecipient
+from .tasks import send_pending_email_order_task, send_email_order_batch_task, dispatch_outbox_task, \
+    dispatch_outbox_batch
+from . import tasks
+import datetime
 
-# Create your tests here.
+
+class EmailOrderTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        post = BlogPost.objects.create(
+            title='News', slug_title='news', short_description='News', author='Unigames',
+            publish_on=timezone.now() - datetime.timedelta(hours=1), body='Some **news**.'
+        )
+        self.order = EmailOrder.objects.create(post=post)
+        self.members = [
+            Member.objects.create(
+                first_name='Member', last_name=str(number), email_address='member{0}@example.com'.format(number)
+            )
+            for number in range(5)
+        ]
+        Member.objects.create(
+            first_name='Quiet', last_name='Member', email_address='quiet@example.com', receive_emails=False
+        )
+
+    @override_settings(EMAIL_BATCH_SIZE=2)
+    def test_orders_are_sent_in_batches(self):
+        with mock.patch.object(send_email_order_batch_task, 'delay') as delay:
+            send_pending_email_order_task()
+        batches = [call.args[1] for call in delay.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(sorted(sum(batches, [])), sorted(member.pk for member in self.members))
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.email_sent)
+        self.assertEqual(self.order.recipients_total, 5)
+        self.assertEqual(self.order.progress, 0)
+
+        for batch in batches:
+            send_email_order_batch_task(self.order.pk, batch)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(len({message.alternatives[0][0] for message in mail.outbox}), 5)
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.recipients_sent, self.order.recipients_failed), (5, 0))
+        self.assertEqual(self.order.progress, 100)
+
+    # The tokens in the emails only change once a second, so the clock is frozen for them to match the expected ones
+    @mock.patch.object(email_preference_token, '_now', return_value=datetime.datetime(2023, 10, 1, 12))
+    def test_compiled_email_matches_composed_email(self, now):
+        member = self.members[0]
+        personal_context = {
+            'uid': urlsafe_base64_encode(force_bytes(member.pk)),
+            'token': email_preference_token.make_token(member),
+        }
+        compiled_email = CompiledEmail('blog/email_blog_post.html', {'blogpost': self.order.post}, ['uid', 'token'])
+        self.assertEqual(
+            compiled_email.personalise(**personal_context),
+            compose_html_email('blog/email_blog_post.html', dict(personal_context, blogpost=self.order.post))
+        )
+        # The email is only composed once for all of the batches of an order
+        send_email_order_batch_task(self.order.pk, [member.pk])
+        with mock.patch.object(CompiledEmail, '__init__', side_effect=AssertionError):
+            send_email_order_batch_task(self.order.pk, [member.pk for member in self.members[1:]])
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertIn(personal_context['token'], mail.outbox[0].alternatives[0][0])
+
+    @override_settings(EMAIL_MAX_RETRIES=1, EMAIL_RETRY_BACKOFF=10)
+    def test_failed_recipients_are_retried(self):
+        self.order.recipients_total = 2
+        self.order.save()
+        failing_address = self.members[1].email_address
+
+        def send_messages(backend, messages):
+            if messages[0].to == [failing_address]:
+                raise SMTPException
+            return real_send_messages(backend, messages)
+        real_send_messages = EmailBackend.send_messages
+
+        member_pks = [self.members[0].pk, self.members[1].pk]
+        with mock.patch.object(EmailBackend, 'send_messages', send_messages):
+            with mock.patch.object(send_email_order_batch_task, 'apply_async') as apply_async:
+                self.assertEqual(send_email_order_batch_task(self.order.pk, member_pks), 1)
+            apply_async.assert_called_once_with(
+                (self.order.pk, [self.members[1].pk]), {'attempt': 1}, countdown=10
+            )
+            self.order.refresh_from_db()
+            self.assertEqual((self.order.recipients_sent, self.order.recipients_failed), (1, 0))
+
+            # The last attempt gives up on the recipient
+            with mock.patch.object(send_email_order_batch_task, 'apply_async') as apply_async:
+                send_email_order_batch_task(self.order.pk, [self.members[1].pk], attempt=1)
+            apply_async.assert_not_called()
+        self.assertEqual([message.to for message in mail.outbox], [[self.members[0].email_address]])
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.recipients_sent, self.order.recipients_failed), (1, 1))
+        self.assertEqual(self.order.progress, 100)
+
+
+    @override_settings(EMAIL_OUTBOX=True, EMAIL_BATCH_SIZE=2, EMAIL_MAX_RETRIES=1)
+    @mock.patch.object(email_preference_token, '_now', return_value=datetime.datetime(2023, 10, 1, 12))
+    def test_orders_are_sent_through_the_outbox(self, now):
+        with mock.patch.object(send_email_order_batch_task, 'delay') as delay:
+            send_pending_email_order_task()
+        delay.assert_not_called()
+        self.assertEqual(OutboxMessage.objects.get().recipients.count(), 5)
+        self.assertEqual(OutboxRecipient.get_stats()['backlog'], 5)
+
+        failing_address = self.members[1].email_address
+
+        def send_messages(backend, messages):
+            if messages[0].to == [failing_address]:
+                raise SMTPException
+            return real_send_messages(backend, messages)
+        real_send_messages = EmailBackend.send_messages
+
+        with mock.patch.object(EmailBackend, 'send_messages', send_messages):
+            self.assertEqual(dispatch_outbox_task(), {'sent': 4, 'retrying': 1, 'failed': 0})
+            # The failed recipient waits for the backoff before it's tried again
+            self.assertEqual(dispatch_outbox_task(), {'sent': 0, 'retrying': 0, 'failed': 0})
+            OutboxRecipient.objects.update(next_attempt=timezone.now())
+            self.assertEqual(dispatch_outbox_task(), {'sent': 0, 'retrying': 0, 'failed': 1})
+        self.assertEqual(len(mail.outbox), 4)
+        # Each recipient gets their own email preferences link
+        member = self.members[0]
+        self.assertIn(
+            reverse('members:email-prefs-token', kwargs={
+                'uidb64': urlsafe_base64_encode(force_bytes(member.pk)),
+                'token': email_preference_token.make_token(member),
+            }),
+            mail.outbox[0].alternatives[0][0]
+        )
+
+        stats = OutboxRecipient.get_stats()
+        self.assertEqual((stats['backlog'], stats['sent_last_hour'], stats['failed']), (0, 4, 1))
+        self.assertIsNone(stats['lag'])
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.recipients_sent, self.order.recipients_failed), (4, 1))
+
+    @override_settings(EMAIL_OUTBOX=True)
+    def test_shared_addresses_are_only_sent_once(self):
+        Member.objects.create(
+            first_name='Shared', last_name='Address', email_address=self.members[0].email_address.upper()
+        )
+        with mock.patch.object(send_email_order_batch_task, 'delay'):
+            send_pending_email_order_task()
+        self.assertEqual(OutboxMessage.objects.get().recipients.count(), 5)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.recipients_total, 5)
+        self.assertEqual(dispatch_outbox_task(), {'sent': 5, 'retrying': 0, 'failed': 0})
+        self.assertEqual(len(mail.outbox), 5)
+
+    @override_settings(EMAIL_OUTBOX=True)
+    def test_claimed_recipients_are_leased(self):
+        with mock.patch.object(send_email_order_batch_task, 'delay'):
+            send_pending_email_order_task()
+        real_send_messages = tasks.send_messages_over_connection
+        other_dispatcher_results = []
+
+        def send_messages(email_messages):
+            # The batch is claimed, but not sent yet, so another dispatcher has nothing to send
+            other_dispatcher_results.append(dispatch_outbox_batch())
+            return real_send_messages(email_messages)
+
+        with mock.patch.object(tasks, 'send_messages_over_connection', send_messages):
+            self.assertEqual(dispatch_outbox_batch(), {'sent': 5, 'retrying': 0, 'failed': 0})
+        self.assertEqual(other_dispatcher_results, [None])
+
+        # If a dispatcher dies before recording the results, the batch is claimed again once the lease is over
+        OutboxRecipient.objects.update(status=OutboxRecipient.PENDING, next_attempt=timezone.now())
+        with mock.patch.object(tasks, 'send_messages_over_connection', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                dispatch_outbox_batch()
+        self.assertIsNone(dispatch_outbox_batch())
+        OutboxRecipient.objects.update(next_attempt=timezone.now())
+        self.assertEqual(dispatch_outbox_batch(), {'sent': 5, 'retrying': 0, 'failed': 0})
+
+
+class CSSInliningTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_inlining_matches_premailer(self):
+        post = BlogPost(title='News', slug_title='news', body='Some **news**, and a [link](/).')
+        html = render_to_string('blog/email_blog_post.html', {'blogpost': post, 'uid': 'uid', 'token': 'token'})
+        self.assertEqual(inline_css(html, 'blog/email_blog_post.html'), transform(html))
+        self.assertEqual(get_css_cache_stats(), {'hits': 0, 'misses': 1})
+        self.assertEqual(inline_css(html, 'blog/email_blog_post.html'), transform(html))
+        self.assertEqual(get_css_cache_stats(), {'hits': 1, 'misses': 1})
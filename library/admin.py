@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.conf import settings
 
 # Register your models here.
 from .models import Item, BorrowRecord, ExternalBorrowingForm, ExternalBorrowingItemRecord, \
@@ -51,7 +52,16 @@ class TagParentAdmin(admin.ModelAdmin):
 
     def save_related(self, request, form, formsets, change):
         super().save_related(request, form, formsets, change)
-        form.instance.save()
+        if settings.LIBRARY_DEFER_TAG_COMPUTATION:
+            form.instance.save()
+            self.message_user(request, 'The tags of affected items will be recomputed shortly.')
+            return
+        stats = form.instance.compute_descendant_tags()
+        self.message_user(
+            request,
+            'Recomputed the tags of {items} item(s) in {seconds:.2f}s ({added} rows added, {removed} removed).'
+            .format(**stats)
+        )
 
 
 class ExternalBorrowingItemRecordAdmin(admin.TabularInline):
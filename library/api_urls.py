@@ -3,9 +3,9 @@ from . import api_viewsets
 app_name = 'library'
 
 urlpatterns = [
-	#path('all', api_viewsets.ItemViewSet.as_view({'get': 'all_items'})),
-	path('random/any', api_viewsets.ItemViewSet.as_view({'get': 'random_item'})),
-	path('random/book', api_viewsets.ItemViewSet.as_view({'get': 'random_book'})),
-	path('random/boardgame', api_viewsets.ItemViewSet.as_view({'get': 'random_boardgame'})),
-	path('random/cardgame', api_viewsets.ItemViewSet.as_view({'get': 'random_cardgame'})),
+	path('all', api_viewsets.ItemViewSet.as_view({'get': 'all_items'}), name='all'),
+	path('random/any', api_viewsets.ItemViewSet.as_view({'get': 'random_item'}), name='random-any'),
+	path('random/book', api_viewsets.ItemViewSet.as_view({'get': 'random_book'}), name='random-book'),
+	path('random/boardgame', api_viewsets.ItemViewSet.as_view({'get': 'random_boardgame'}), name='random-boardgame'),
+	path('random/cardgame', api_viewsets.ItemViewSet.as_view({'get': 'random_cardgame'}), name='random-cardgame'),
 ]
\ No newline at end of file
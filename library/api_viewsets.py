@@ -1,52 +1,136 @@
-from .models import Item
+from .models import Item, BOOK, BOARD_GAME, CARD_GAME
+from .random_picks import pick_random_items
 from .serializers import ItemSerialiser
+from .conditional import catalogue_condition
 from rest_framework import viewsets
 from rest_framework.decorators import action
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404
-import random
+from rest_framework.pagination import CursorPagination
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+import json
 
 
-def get_random_pk(qs):
-	pks = qs.values_list('pk', flat=True)
-	chosen_pk = random.choice(pks)
-	return chosen_pk
+class ItemCursorPagination(CursorPagination):
+	# Cursor pagination stays fast however deep the page is, and items added or removed
+	# while a client is paging through don't make it skip or repeat any.
+	ordering = 'pk'
+	page_size = settings.LIBRARY_API_PAGE_SIZE
+	page_size_query_param = 'page_size'
+	max_page_size = settings.LIBRARY_API_MAX_PAGE_SIZE
 
 
 class ItemViewSet(viewsets.GenericViewSet):
 	queryset = Item.objects.all()
 	serializer_class = ItemSerialiser
+	pagination_class = ItemCursorPagination
+
+	selected_fields = None
+
+	def select_fields(self, request):
+		"""
+			Reads which fields to include from ?fields= (a comma separated list, or the default fields if not given),
+			plus any expandable fields, like availability, asked for with ?expand=.
+			Raises ValueError if any of them aren't fields of the serialiser.
+		"""
+		serialiser_class = self.get_serializer_class()
+		fields = [field for field in request.query_params.get('fields', '').split(',') if field]
+		expand = [field for field in request.query_params.get('expand', '').split(',') if field]
+		for field in fields:
+			if field not in serialiser_class.Meta.fields:
+				raise ValueError('{0} is not a field of items.'.format(field))
+		for field in expand:
+			if field not in serialiser_class.expandable_fields:
+				raise ValueError('{0} can\'t be expanded.'.format(field))
+		self.selected_fields = (fields or serialiser_class.get_default_fields()) + \
+			[field for field in expand if field not in fields]
+
+	def get_queryset(self):
+		# Only the columns needed for the selected fields are loaded,
+		# and availability is only computed if it was asked for
+		qs = super().get_queryset()
+		if self.selected_fields is not None:
+			qs = qs.only(*self.get_serializer_class().get_model_fields(self.selected_fields))
+			if 'availability' in self.selected_fields:
+				qs = qs.with_availability()
+		return qs
+
+	def get_serializer(self, *args, **kwargs):
+		kwargs.setdefault('fields', self.selected_fields)
+		return super().get_serializer(*args, **kwargs)
 
 	@action(detail=False)
+	@method_decorator(catalogue_condition)
 	def all_items(self, request):
+		# Returns a list of every item, as it always has.
+		# With ?page_size= (or a ?cursor= from a previous page), returns a page of items instead,
+		# with links to the next and previous pages.
+		# With ?stream=true, every item is streamed instead, as one JSON object per line (NDJSON).
+		try:
+			self.select_fields(request)
+		except ValueError as error:
+			return JsonResponse({'detail': str(error)}, status=400)
 		qs = self.get_queryset()
-		serialiser = self.get_serializer(qs, many=True)
+		if request.query_params.get('stream') in ('true', '1'):
+			return StreamingHttpResponse(self.stream_items(qs), content_type='application/x-ndjson')
+		paginator = self.paginator
+		if paginator.cursor_query_param not in request.query_params \
+				and paginator.page_size_query_param not in request.query_params:
+			serialiser = self.get_serializer(qs.order_by('pk'), many=True)
+			return JsonResponse(serialiser.data, safe=False)
+		page = self.paginate_queryset(qs)
+		serialiser = self.get_serializer(page, many=True)
+		return JsonResponse({
+			'next': self.paginator.get_next_link(),
+			'previous': self.paginator.get_previous_link(),
+			'results': serialiser.data,
+		})
+
+	def stream_items(self, qs):
+		# The items are fetched and serialised a chunk at a time, so memory use doesn't grow with the catalogue
+		serialiser = self.get_serializer()
+		for item in qs.order_by('pk').iterator(chunk_size=settings.LIBRARY_API_STREAM_CHUNK_SIZE):
+			yield json.dumps(serialiser.to_representation(item), cls=DjangoJSONEncoder) + '\n'
+
+	def random_response(self, request, item_type=None):
+		# Returns a random item of the given type, or with ?count=, a list of that many distinct random items
+		try:
+			self.select_fields(request)
+		except ValueError as error:
+			return JsonResponse({'detail': str(error)}, status=400)
+		count = request.query_params.get('count')
+		if count is not None:
+			try:
+				count = int(count)
+			except ValueError:
+				count = 0
+			if not 1 <= count <= settings.LIBRARY_API_MAX_RANDOM_COUNT:
+				return JsonResponse(
+					{'detail': 'count must be between 1 and {0}.'.format(settings.LIBRARY_API_MAX_RANDOM_COUNT)},
+					status=400
+				)
+		items = pick_random_items(item_type, count or 1, self.get_queryset())
+		if count is not None:
+			serialiser = self.get_serializer(items, many=True)
+			return JsonResponse(serialiser.data, safe=False)
+		if not items:
+			return JsonResponse({'detail': 'There are no items to choose from.'}, status=404)
+		serialiser = self.get_serializer(items[0])
 		return JsonResponse(serialiser.data, safe=False)
 
 	@action(detail=True)
 	def random_item(self, request):
-		qs = self.get_queryset()
-		chosen_item = get_object_or_404(Item, pk=get_random_pk(qs))
-		serialiser = self.get_serializer(chosen_item)
-		return JsonResponse(serialiser.data, safe=False)
+		return self.random_response(request)
 
 	@action(detail=True)
 	def random_book(self, request):
-		qs = self.get_queryset().filter(type='BK')
-		chosen_item = get_object_or_404(Item, pk=get_random_pk(qs))
-		serialiser = self.get_serializer(chosen_item)
-		return JsonResponse(serialiser.data, safe=False)
+		return self.random_response(request, BOOK)
 
 	@action(detail=True)
 	def random_boardgame(self, request):
-		qs = self.get_queryset().filter(type='BG')
-		chosen_item = get_object_or_404(Item, pk=get_random_pk(qs))
-		serialiser = self.get_serializer(chosen_item)
-		return JsonResponse(serialiser.data, safe=False)
+		return self.random_response(request, BOARD_GAME)
 
 	@action(detail=True)
 	def random_cardgame(self, request):
-		qs = self.get_queryset().filter(type='CG')
-		chosen_item = get_object_or_404(Item, pk=get_random_pk(qs))
-		serialiser = self.get_serializer(chosen_item)
-		return JsonResponse(serialiser.data, safe=False)
+		return self.random_response(request, CARD_GAME)
@@ -1,5 +1,40 @@
 from django.apps import AppConfig
+from django.db.models.signals import m2m_changed, post_delete, pre_delete, post_save
 
 
 class LibraryConfig(AppConfig):
     name = 'library'
+
+    def ready(self):
+        from taggit.models import Tag, TaggedItem
+        from phylactery.fragments import fragments_changed
+        from .models import TagParent, Item, ItemBaseTags, ItemComputedTags, BorrowRecord, \
+            ExternalBorrowingItemRecord, ExternalBorrowingForm
+        from .signals import tag_parents_changed, tag_parent_deleted, tag_pre_delete, tag_post_delete, \
+            item_changed, borrow_record_changed, external_borrowing_form_changed, item_deleted, tag_renamed, \
+            base_tags_changed, catalogue_changed, computed_tags_changed, computed_tags_pre_delete, \
+            computed_tags_deleted, borrow_record_deleted
+        m2m_changed.connect(tag_parents_changed, sender=TagParent.parent_tag.through)
+        post_delete.connect(tag_parent_deleted, sender=TagParent)
+        pre_delete.connect(tag_pre_delete, sender=Tag)
+        post_delete.connect(tag_post_delete, sender=Tag)
+        post_save.connect(item_changed, sender=Item)
+        post_delete.connect(item_deleted, sender=Item)
+        post_save.connect(tag_renamed, sender=Tag)
+        m2m_changed.connect(computed_tags_changed, sender=TaggedItem)
+        pre_delete.connect(computed_tags_pre_delete, sender=ItemComputedTags)
+        post_delete.connect(computed_tags_deleted, sender=ItemComputedTags)
+        for record_model in (BorrowRecord, ExternalBorrowingItemRecord):
+            post_save.connect(borrow_record_changed, sender=record_model)
+            post_delete.connect(borrow_record_deleted, sender=record_model)
+        post_save.connect(external_borrowing_form_changed, sender=ExternalBorrowingForm)
+        # The featured items and item counts on the home pages are cached
+        for model in (Item, ItemBaseTags, Tag):
+            post_save.connect(fragments_changed, sender=model)
+            post_delete.connect(fragments_changed, sender=model)
+        m2m_changed.connect(base_tags_changed, sender=TaggedItem)
+        # The item list pages and the items API are cached by clients until the catalogue changes
+        for model in (Item, Tag, TagParent, BorrowRecord, ExternalBorrowingItemRecord, ExternalBorrowingForm):
+            post_save.connect(catalogue_changed, sender=model)
+            post_delete.connect(catalogue_changed, sender=model)
+        m2m_changed.connect(catalogue_changed, sender=TaggedItem)
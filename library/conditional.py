@@ -0,0 +1,37 @@
+from django.utils import timezone
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
+from .models import CatalogueVersion
+import hashlib
+
+
+def get_catalogue_version(request):
+    # Both the ETag and Last-Modified come from the same row, so it's only fetched once per request
+    if not hasattr(request, '_catalogue_version'):
+        request._catalogue_version = CatalogueVersion.get()
+    return request._catalogue_version
+
+
+def catalogue_etag(request, *args, **kwargs):
+    # The availability of items changes from day to day, and the pages differ for each user, so both are included,
+    # along with a hash of the query string, as each page or set of fields of the same URL is a different response
+    version = get_catalogue_version(request)
+    query_hash = hashlib.md5(request.GET.urlencode().encode()).hexdigest()[:12]
+    return '{0}-{1}-{2}-{3}'.format(
+        version.version, timezone.localdate().isoformat(), request.user.pk or 0, query_hash
+    )
+
+
+def catalogue_last_modified(request, *args, **kwargs):
+    version = get_catalogue_version(request)
+    start_of_today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(version.last_modified, start_of_today)
+
+
+def catalogue_condition(view):
+    """
+        Decorates a view that only shows the catalogue, so that it returns 304 Not Modified
+        if the client already has the current version.
+        The responses (including the 304s) vary on the session cookie, as the ETag includes the user.
+    """
+    return vary_on_cookie(condition(etag_func=catalogue_etag, last_modified_func=catalogue_last_modified)(view))
@@ -235,10 +235,16 @@ class MemberBorrowDetailsForm(forms.Form):
 
 class VerifyReturnForm(forms.Form):
     def __init__(self, *args, **kwargs):
+        # The records needing return can be passed in, if they have already been fetched
+        records = kwargs.pop('records', None)
         super().__init__(*args, **kwargs)
-        for record in BorrowRecord.objects.exclude(date_returned=None).exclude(verified_returned=True):
+        if records is None:
+            records = BorrowRecord.objects.exclude(date_returned=None).exclude(verified_returned=True)
+        self.records = dict()
+        for record in records:
             field_name = 'return_' + str(record.pk)
             self.fields[field_name] = forms.BooleanField(required=False)
+            self.records[field_name] = record
 
 
 class ReturnItemsForm(forms.Form):
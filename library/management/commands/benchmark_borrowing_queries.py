@@ -0,0 +1,164 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from library.models import Item, BorrowRecord, ExternalBorrowingForm, ExternalBorrowingItemRecord, \
+    UNAPPROVED, DENIED, APPROVED, COMPLETED
+from members.models import Member
+import datetime
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds years of synthetic borrowing history, then reports the query plans and timings of the '
+        'hot borrowing queries with and without their indexes. Everything is rolled back afterwards.'
+    )
+
+    # The indexes added for these queries, which get dropped for the "before" run
+    INDEXED_MODELS = (BorrowRecord, ExternalBorrowingForm, ExternalBorrowingItemRecord)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, default=5, help='Years of borrowing history to seed.')
+        parser.add_argument('--items', type=int, default=1000, help='Number of items to seed.')
+        parser.add_argument('--members', type=int, default=2000, help='Number of members to seed.')
+        parser.add_argument('--loans-per-day', type=int, default=20, help='Borrow records to seed per day.')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of times to run each query.')
+        parser.add_argument('--plans', action='store_true', help='Also print the query plans.')
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        with transaction.atomic():
+            self.seed(options)
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            after = self.run_queries(options, 'after')
+            self.drop_indexes()
+            before = self.run_queries(options, 'before')
+            transaction.set_rollback(True)
+
+        self.stdout.write('')
+        self.stdout.write('{0:<32} {1:>12} {2:>12} {3:>9}'.format('Query', 'Before (ms)', 'After (ms)', 'Speedup'))
+        for name in after:
+            before_time, before_plan = before[name]
+            after_time, after_plan = after[name]
+            self.stdout.write('{0:<32} {1:>12.3f} {2:>12.3f} {3:>8.1f}x'.format(
+                name, before_time * 1000, after_time * 1000, before_time / after_time if after_time else 0
+            ))
+            if options['plans']:
+                self.stdout.write('  Before:\n    ' + before_plan.replace('\n', '\n    '))
+                self.stdout.write('  After:\n    ' + after_plan.replace('\n', '\n    '))
+
+    def seed(self, options):
+        today = datetime.date.today()
+        days = options['years'] * 365
+        self.stdout.write('Seeding {0} items, {1} members and {2} days of borrowing history...'.format(
+            options['items'], options['members'], days
+        ))
+        items = Item.objects.bulk_create([
+            Item(name='Benchmark Item {0}'.format(number), slug='benchmark-item-{0}'.format(number), type=Item.BOOK)
+            for number in range(options['items'])
+        ])
+        members = Member.objects.bulk_create([
+            Member(
+                first_name='Benchmark', last_name=str(number), preferred_name='Benchmark',
+                email_address='benchmark{0}@example.com'.format(number)
+            )
+            for number in range(options['members'])
+        ])
+
+        records = []
+        for day in range(days, 0, -1):
+            date_borrowed = today - datetime.timedelta(days=day)
+            for loan in range(options['loans_per_day']):
+                due_date = date_borrowed + datetime.timedelta(weeks=2)
+                # Almost everything older than the loan period has been returned and verified
+                is_open = due_date >= today - datetime.timedelta(days=3) or random.random() < 0.001
+                records.append(BorrowRecord(
+                    borrowing_member=random.choice(members),
+                    item=random.choice(items),
+                    date_borrowed=date_borrowed,
+                    due_date=due_date,
+                    date_returned=None if is_open else due_date,
+                    verified_returned=not is_open and random.random() < 0.99,
+                ))
+        BorrowRecord.objects.bulk_create(records, batch_size=5000)
+
+        forms = []
+        for day in range(days, -30, -7):
+            requested_borrow_date = today - datetime.timedelta(days=day)
+            if day > 0:
+                status = random.choice([DENIED, COMPLETED, COMPLETED, COMPLETED])
+            else:
+                status = random.choice([UNAPPROVED, APPROVED])
+            forms.append(ExternalBorrowingForm(
+                applicant_name='Benchmark', event_details='Benchmark', contact_phone='0',
+                contact_email='benchmark@example.com', requested_borrow_date=requested_borrow_date,
+                due_date=requested_borrow_date + datetime.timedelta(days=2), form_status=status,
+            ))
+        forms = ExternalBorrowingForm.objects.bulk_create(forms)
+        ExternalBorrowingItemRecord.objects.bulk_create([
+            ExternalBorrowingItemRecord(
+                form=form, item=item,
+                date_borrowed=form.requested_borrow_date if form.form_status == COMPLETED else None,
+                date_returned=form.due_date if form.form_status == COMPLETED else None,
+            )
+            for form in forms
+            for item in random.sample(items, 5)
+        ], batch_size=5000)
+        self.stdout.write('Seeded {0} borrow records and {1} external borrowing forms.'.format(
+            len(records), len(forms)
+        ))
+
+    def get_queries(self):
+        today = datetime.date.today()
+        tomorrow = today + datetime.timedelta(days=1)
+        # The same sample of items is used for both runs
+        item_pks = list(Item.objects.order_by('pk').values_list('pk', flat=True))
+        sample_items = random.Random(0).sample(item_pks, min(50, len(item_pks)))
+        return {
+            'open loans (availability)': BorrowRecord.objects.filter(
+                item__in=sample_items, date_borrowed__lte=today, date_returned=None
+            ),
+            'currently borrowed (overview)': BorrowRecord.objects.filter(date_returned=None).order_by('due_date'),
+            'overdue (overview)': BorrowRecord.objects.filter(date_returned=None, due_date__lt=today),
+            'needing return (overview)': BorrowRecord.objects.exclude(date_returned=None)
+                .exclude(verified_returned=True),
+            'recent records (overview)': BorrowRecord.objects.filter(
+                date_borrowed__gte=today - datetime.timedelta(weeks=3)
+            ),
+            'due tomorrow (reminders)': BorrowRecord.objects.filter(due_date=tomorrow, date_returned__isnull=True),
+            'approved external (availability)': ExternalBorrowingItemRecord.objects.filter(
+                item__in=sample_items
+            ).exclude(form__form_status__in=[UNAPPROVED, DENIED, COMPLETED]),
+            'upcoming forms': ExternalBorrowingForm.objects.filter(
+                form_status=APPROVED, requested_borrow_date__gte=today
+            ),
+            'unapproved forms (overview)': ExternalBorrowingForm.objects.filter(form_status=UNAPPROVED),
+        }
+
+    def run_queries(self, options, label):
+        results = {}
+        for name, qs in self.get_queries().items():
+            best = None
+            for repeat in range(options['repeat']):
+                start = time.perf_counter()
+                list(qs.all())
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = (best, self.explain(qs, label))
+        return results
+
+    def explain(self, qs, label):
+        # QuerySet.explain() can return a stale plan from SQLite's statement cache after the indexes are dropped,
+        # so the label is added as a comment to make each run's statement unique.
+        sql, params = qs.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('{0} {1} -- {2}'.format(connection.ops.explain_query_prefix(), sql, label), params)
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+    def drop_indexes(self):
+        schema_editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for model in self.INDEXED_MODELS:
+                for index in model._meta.indexes:
+                    cursor.execute(str(index.remove_sql(model, schema_editor)))
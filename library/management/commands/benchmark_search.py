@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from library.models import Item
+from library.search import BasicSearchBackend, PostgresSearchBackend, SQLiteSearchBackend
+import random
+import string
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a synthetic catalogue, then reports the timings of library searches with each search backend that '
+        'the database supports, against the unindexed BasicSearchBackend. Everything is rolled back afterwards.'
+    )
+
+    BACKENDS = {
+        'postgresql': [PostgresSearchBackend],
+        'sqlite': [SQLiteSearchBackend],
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=5000, help='Number of items to seed.')
+        parser.add_argument('--words', type=int, default=40, help='Number of words in each description.')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of times to run each search.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        vocabulary = [
+            ''.join(rng.choice(string.ascii_lowercase) for letter in range(rng.randint(4, 9)))
+            for word in range(2000)
+        ]
+        # Word frequencies roughly follow Zipf's law, like real text
+        weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+        backends = [BasicSearchBackend()] + [backend() for backend in self.BACKENDS.get(connection.vendor, [])]
+
+        with transaction.atomic():
+            self.stdout.write('Seeding {0} items...'.format(options['items']))
+            Item.objects.bulk_create([
+                Item(
+                    name='{0} {1}'.format(
+                        ' '.join(rng.choices(vocabulary, weights, k=rng.randint(1, 4))).title(), number
+                    ),
+                    slug='benchmark-item-{0}'.format(number), type=Item.BOOK,
+                    description=' '.join(rng.choices(vocabulary, weights, k=options['words'])),
+                )
+                for number in range(options['items'])
+            ], batch_size=1000)
+            for backend in backends:
+                start = time.perf_counter()
+                backend.rebuild()
+                self.stdout.write('Indexed with {0} in {1:.2f}s.'.format(
+                    type(backend).__name__, time.perf_counter() - start
+                ))
+
+            queries = {
+                'common word': vocabulary[0],
+                'uncommon word': vocabulary[100],
+                'rare word': vocabulary[1500],
+                'two words': '{0} {1}'.format(vocabulary[5], vocabulary[50]),
+                'no matches': 'zzzzzzzzzz',
+            }
+            self.stdout.write('')
+            self.stdout.write('{0:<16}'.format('Query') + ''.join(
+                '{0:>24}'.format(type(backend).__name__) for backend in backends
+            ))
+            for name, query in queries.items():
+                row = '{0:<16}'.format(name)
+                for backend in backends:
+                    best, count = None, 0
+                    for repeat in range(options['repeat']):
+                        start = time.perf_counter()
+                        # The search view shows the first page of results, along with the total
+                        count = backend.search(query).count()
+                        list(backend.search(query)[:24])
+                        elapsed = time.perf_counter() - start
+                        best = elapsed if best is None else min(best, elapsed)
+                    row += '{0:>24}'.format('{0:.3f}ms ({1})'.format(best * 1000, count))
+                self.stdout.write(row)
+            transaction.set_rollback(True)
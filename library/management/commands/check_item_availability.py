@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from library.models import Item, ItemAvailability
+import datetime
+
+
+class Command(BaseCommand):
+    help = 'Compares the ItemAvailability snapshots with the live availability of every item.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Refresh the snapshots of any items that are out of date.',
+        )
+
+    def handle(self, *args, **options):
+        today = datetime.date.today()
+        snapshots = {
+            snapshot.item_id: snapshot
+            for snapshot in ItemAvailability.objects.filter(computed_on=today)
+        }
+        mismatched = []
+        for item in Item.objects.all():
+            live_info = item.get_availability_info()
+            snapshot = snapshots.get(item.pk)
+            if snapshot is None:
+                self.stdout.write('{0}: no snapshot for today.'.format(item))
+                mismatched.append(item.pk)
+            elif snapshot.get_info() != live_info:
+                self.stdout.write('{0}: snapshot {1} does not match live {2}.'.format(
+                    item, snapshot.get_info(), live_info
+                ))
+                mismatched.append(item.pk)
+
+        if not mismatched:
+            self.stdout.write(self.style.SUCCESS('All snapshots match.'))
+            return
+        self.stdout.write(self.style.WARNING('{0} item{1} out of date.'.format(
+            len(mismatched), '' if len(mismatched) == 1 else 's'
+        )))
+        if options['fix']:
+            ItemAvailability.refresh(Item.objects.filter(pk__in=mismatched))
+            self.stdout.write('Refreshed {0} snapshot{1}.'.format(
+                len(mismatched), '' if len(mismatched) == 1 else 's'
+            ))
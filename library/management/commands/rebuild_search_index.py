@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from library.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Re-indexes every item in the library search backend.'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        count = backend.rebuild()
+        self.stdout.write('Re-indexed {0} item{1} with {2}.'.format(
+            count, '' if count == 1 else 's', type(backend).__name__
+        ))
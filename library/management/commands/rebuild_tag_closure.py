@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from library.models import TagClosure, TagUsage, Item
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the TagClosure table from the TagParent hierarchy, and recounts the items of every tag.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--items',
+            action='store_true',
+            help='Also recompute the computed tags of every item afterwards.',
+        )
+
+    def handle(self, *args, **options):
+        added, removed = TagClosure.refresh()
+        self.stdout.write('Tag closure rebuilt: {0} row{1} added, {2} row{3} removed.'.format(
+            added, '' if added == 1 else 's', removed, '' if removed == 1 else 's'
+        ))
+        if options['items']:
+            stats = Item.bulk_compute_tags(Item.objects.all())
+            self.stdout.write(
+                'Recomputed the tags of {items} items in {seconds:.2f}s ({added} rows added, {removed} removed).'
+                .format(**stats)
+            )
+        tags = TagUsage.refresh()
+        self.stdout.write('Recounted the items of {0} tag{1}.'.format(tags, '' if tags == 1 else 's'))
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_tag_closure(apps, schema_editor):
+    TagParent = apps.get_model('library', 'TagParent')
+    TagClosure = apps.get_model('library', 'TagClosure')
+
+    parents = {}
+    for child_pk, parent_pk in TagParent.parent_tag.through.objects.values_list('tagparent__child_tag', 'tag'):
+        parents.setdefault(child_pk, set()).add(parent_pk)
+
+    rows = []
+    for descendant_pk in parents:
+        already_searched = set()
+        to_search = set(parents[descendant_pk])
+        while to_search:
+            already_searched |= to_search
+            to_search = set().union(*(parents.get(pk, set()) for pk in to_search)) - already_searched
+        already_searched.discard(descendant_pk)
+        rows += [TagClosure(descendant_id=descendant_pk, ancestor_id=pk) for pk in already_searched]
+    TagClosure.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0005_auto_20220424_2025'),
+        ('library', '0040_auto_20220130_1920'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='taggit.tag')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='taggit.tag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ancestor', 'descendant'], name='library_tag_ancesto_fe09f1_idx')],
+                'unique_together': {('descendant', 'ancestor')},
+            },
+        ),
+        migrations.RunPython(populate_tag_closure, migrations.RunPython.noop),
+    ]
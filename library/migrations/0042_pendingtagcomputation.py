@@ -0,0 +1,26 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0005_auto_20220424_2025'),
+        ('library', '0041_tagclosure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingTagComputation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_marked', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_marked', models.DateTimeField(default=django.utils.timezone.now)),
+                ('item', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.item')),
+                ('tag', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='taggit.tag')),
+            ],
+        ),
+    ]
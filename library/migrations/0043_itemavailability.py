@@ -0,0 +1,25 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0042_pendingtagcomputation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemAvailability',
+            fields=[
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='availability_snapshot', serialize=False, to='library.item')),
+                ('in_clubroom', models.BooleanField()),
+                ('is_available', models.BooleanField()),
+                ('expected_availability_date', models.DateField(blank=True, null=True)),
+                ('max_due_date', models.DateField(blank=True, null=True)),
+                ('computed_on', models.DateField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0043_itemavailability'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='borrowrecord',
+            index=models.Index(condition=models.Q(('date_returned__isnull', True)), fields=['item', 'date_borrowed'], name='borrowrecord_open_item_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrecord',
+            index=models.Index(condition=models.Q(('date_returned__isnull', True)), fields=['due_date'], name='borrowrecord_open_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrecord',
+            index=models.Index(condition=models.Q(('date_returned__isnull', True)), fields=['borrowing_member'], name='borrowrecord_open_member_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrecord',
+            index=models.Index(condition=models.Q(('date_returned__isnull', False), ('verified_returned', False)), fields=['date_returned'], name='borrowrecord_unverified_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowrecord',
+            index=models.Index(fields=['date_borrowed'], name='borrowrecord_borrowed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='externalborrowingform',
+            index=models.Index(condition=models.Q(('form_status', 'A')), fields=['requested_borrow_date', 'due_date'], name='extform_approved_dates_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='externalborrowingform',
+            index=models.Index(fields=['form_status', 'requested_borrow_date'], name='extform_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='externalborrowingitemrecord',
+            index=models.Index(condition=models.Q(('date_returned__isnull', True)), fields=['item', 'date_borrowed'], name='extrecord_open_item_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.6 on 2026-10-18 18:52
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# Only PostgreSQL has tsvectors and GIN indexes, so the index and initial search vectors are skipped elsewhere.
+CREATE_INDEX_SQL = 'CREATE INDEX library_item_search_vector_idx ON library_item USING gin (search_vector)'
+DROP_INDEX_SQL = 'DROP INDEX IF EXISTS library_item_search_vector_idx'
+POPULATE_SQL = '''
+    UPDATE library_item SET search_vector =
+        setweight(to_tsvector(COALESCE(library_item.name, '')), 'A') ||
+        setweight(to_tsvector(COALESCE(library_item.description, '')), 'B') ||
+        setweight(to_tsvector(COALESCE((
+            SELECT string_agg(taggit_tag.name, ' ')
+            FROM library_itemcomputedtags
+            INNER JOIN taggit_taggeditem ON taggit_taggeditem.object_id = library_itemcomputedtags.id
+            INNER JOIN django_content_type ON django_content_type.id = taggit_taggeditem.content_type_id
+            INNER JOIN taggit_tag ON taggit_tag.id = taggit_taggeditem.tag_id
+            WHERE library_itemcomputedtags.item_id = library_item.id
+                AND django_content_type.app_label = 'library'
+                AND django_content_type.model = 'itemcomputedtags'
+        ), '')), 'B')
+'''
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_INDEX_SQL)
+        schema_editor.execute(POPULATE_SQL)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_INDEX_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0044_borrowing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,37 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+# The autocomplete views compare UPPER(name) with both LIKE and the pg_trgm operators, which these indexes serve.
+# Only PostgreSQL has pg_trgm, so the indexes are skipped elsewhere.
+INDEXES = (
+    ('library_item_name_trgm_idx', 'library_item', 'name'),
+    ('taggit_tag_name_trgm_idx', 'taggit_tag', 'name'),
+)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name, table, column in INDEXES:
+            schema_editor.execute('CREATE INDEX {0} ON {1} USING gin (UPPER({2}) gin_trgm_ops)'.format(
+                name, table, column
+            ))
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name, table, column in INDEXES:
+            schema_editor.execute('DROP INDEX IF EXISTS {0}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0045_item_search_vector'),
+        ('taggit', '0003_taggeditem_add_unique_index'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
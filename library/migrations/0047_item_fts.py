@@ -0,0 +1,44 @@
+from django.db import migrations
+
+
+# The full text search table of SQLiteSearchBackend in library/search.py. It is only used on SQLite.
+CREATE_TABLE_SQL = '''
+    CREATE VIRTUAL TABLE library_item_fts USING fts5(name, description, tags, tokenize = 'porter unicode61')
+'''
+DROP_TABLE_SQL = 'DROP TABLE IF EXISTS library_item_fts'
+POPULATE_SQL = '''
+    INSERT INTO library_item_fts (rowid, name, description, tags)
+    SELECT library_item.id, library_item.name, COALESCE(library_item.description, ''), COALESCE((
+        SELECT group_concat(taggit_tag.name, ' ')
+        FROM library_itemcomputedtags
+        INNER JOIN taggit_taggeditem ON taggit_taggeditem.object_id = library_itemcomputedtags.id
+        INNER JOIN django_content_type ON django_content_type.id = taggit_taggeditem.content_type_id
+        INNER JOIN taggit_tag ON taggit_tag.id = taggit_taggeditem.tag_id
+        WHERE library_itemcomputedtags.item_id = library_item.id
+            AND django_content_type.app_label = 'library'
+            AND django_content_type.model = 'itemcomputedtags'
+    ), '')
+    FROM library_item
+'''
+
+
+def create_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(CREATE_TABLE_SQL)
+        schema_editor.execute(POPULATE_SQL)
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(DROP_TABLE_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0046_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0047_item_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SentReminder',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('offset', models.IntegerField()),
+                ('date_sent', models.DateTimeField(default=django.utils.timezone.now)),
+                ('record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sent_reminders', to='library.borrowrecord')),
+            ],
+            options={
+                'unique_together': {('record', 'offset')},
+            },
+        ),
+    ]
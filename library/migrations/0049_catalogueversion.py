@@ -0,0 +1,27 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:28
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def create_catalogue_version(apps, schema_editor):
+    apps.get_model('library', 'CatalogueVersion').objects.create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0048_sentreminder'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogueVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('last_modified', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(create_catalogue_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_tag_usage(apps, schema_editor):
+    Tag = apps.get_model('taggit', 'Tag')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    TagUsage = apps.get_model('library', 'TagUsage')
+    counts = dict(
+        TaggedItem.objects.filter(content_type__app_label='library', content_type__model='itemcomputedtags')
+        .order_by().values_list('tag').annotate(count=models.Count('pk'))
+    )
+    TagUsage.objects.bulk_create([
+        TagUsage(tag_id=tag_pk, num_items=counts.get(tag_pk, 0), is_item_tag=name.startswith('Item: '))
+        for tag_pk, name in Tag.objects.values_list('pk', 'name')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0005_auto_20220424_2025'),
+        ('library', '0049_catalogueversion'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagUsage',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='usage', serialize=False, to='taggit.tag')),
+                ('num_items', models.PositiveIntegerField(default=0)),
+                ('is_item_tag', models.BooleanField(default=False)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['is_item_tag', '-num_items'], name='tagusage_list_idx')],
+            },
+        ),
+        migrations.RunPython(populate_tag_usage, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
+from django.contrib.postgres.search import SearchVectorField
 from django.urls import reverse
 from taggit.managers import TaggableManager
 from taggit.models import Tag
@@ -7,6 +8,13 @@ from members.models import Member
 import datetime
 from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist
+from django.contrib.contenttypes.models import ContentType
+from django.conf import settings
+import logging
+import time
+from itertools import islice
+
+logger = logging.getLogger(__name__)
 
 # External Borrowing Form Statuses
 UNAPPROVED = 'U'
@@ -29,18 +37,173 @@ class TagParent(models.Model):
         return 'Parents of '+str(self.child_tag)
 
     def compute_descendant_tags(self):
-        # We find all items with the child_tag in their base or computed tags, and re_save them
-        for item in Item.objects.filter(
-                Q(base_tags__base_tags__name__in=[self.child_tag.name]) |
-                Q(computed_tags__computed_tags__name__in=[self.child_tag.name])) \
-                .distinct() \
-                .order_by('name'):
-            item.compute_tags(recursion=False)
+        """
+            Finds all items with the child_tag (or any of its descendants) in their base tags,
+            and recomputes their tags in bulk.
+            Returns the stats dict from Item.bulk_compute_tags.
+        """
+        tag_pks = TagClosure.objects.filter(ancestor=self.child_tag).values('descendant')
+        items = Item.objects.filter(
+            Q(base_tags__base_tags__in=[self.child_tag]) |
+            Q(base_tags__base_tags__in=tag_pks))
+        return Item.bulk_compute_tags(items)
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        self.compute_descendant_tags()
+        if settings.LIBRARY_DEFER_TAG_COMPUTATION:
+            PendingTagComputation.mark(tag=self.child_tag)
+        else:
+            self.compute_descendant_tags()
+
+
+class TagClosure(models.Model):
+    """
+        Closure table for the TagParent hierarchy.
+        Stores a row for every (descendant, ancestor) pair of tags that are connected through TagParent links,
+        so that all ancestors of a tag can be found with a single indexed lookup.
+        Kept up to date by the signals in library/signals.py.
+    """
+    descendant = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='ancestor_links')
+    ancestor = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='descendant_links')
+
+    class Meta:
+        unique_together = ('descendant', 'ancestor')
+        indexes = [
+            models.Index(fields=['ancestor', 'descendant']),
+        ]
+
+    def __str__(self):
+        return str(self.ancestor)+' is an ancestor of '+str(self.descendant)
+
+    @staticmethod
+    def get_parent_graph(tag_pks=None):
+        """
+            Returns a dict mapping each tag pk (of the given tags, or of every tag if None)
+            to the set of its parent tag pks, in a single query.
+        """
+        parents = dict()
+        links = TagParent.parent_tag.through.objects.all()
+        if tag_pks is not None:
+            links = links.filter(tagparent__child_tag__in=tag_pks)
+        for child_pk, parent_pk in links.values_list('tagparent__child_tag', 'tag'):
+            parents.setdefault(child_pk, set()).add(parent_pk)
+        return parents
+
+    @classmethod
+    def refresh(cls, tag_pks=None):
+        """
+            Recomputes the closure rows of the given tags and all of their descendants,
+            only touching the rows that have actually changed.
+            Only the parents of those tags are loaded: the ancestors of any other parent
+            are read from its (unaffected) closure rows.
+            If tag_pks is None, the whole table is rebuilt.
+            Returns a tuple of (rows added, rows removed).
+        """
+        existing_rows = cls.objects.all()
+        outside_ancestors = dict()
+        if tag_pks is None:
+            parents = cls.get_parent_graph()
+            affected = set(parents)
+        else:
+            # Changing the parents of a tag doesn't change its descendants, so the current rows can be used to find them
+            tag_pks = set(tag_pks)
+            affected = tag_pks | set(cls.objects.filter(ancestor__in=tag_pks).values_list('descendant', flat=True))
+            parents = cls.get_parent_graph(affected)
+            outside = set().union(*parents.values()) - affected
+            for descendant_pk, ancestor_pk in cls.objects.filter(descendant__in=outside) \
+                    .values_list('descendant', 'ancestor'):
+                outside_ancestors.setdefault(descendant_pk, set()).add(ancestor_pk)
+            existing_rows = existing_rows.filter(descendant__in=affected)
+
+        wanted = set()
+        for descendant_pk in affected:
+            already_searched = set()
+            to_search = set(parents.get(descendant_pk, set()))
+            while to_search:
+                already_searched |= to_search
+                to_search = set().union(*(
+                    parents.get(pk, set()) if pk in affected else outside_ancestors.get(pk, set())
+                    for pk in to_search
+                )) - already_searched
+            already_searched.discard(descendant_pk)
+            wanted.update((descendant_pk, ancestor_pk) for ancestor_pk in already_searched)
+
+        existing = {
+            (descendant_pk, ancestor_pk): pk
+            for pk, descendant_pk, ancestor_pk in existing_rows.values_list('pk', 'descendant', 'ancestor')
+        }
+        to_add = wanted - set(existing)
+        to_remove = [existing[pair] for pair in set(existing) - wanted]
+        with transaction.atomic():
+            if to_remove:
+                cls.objects.filter(pk__in=to_remove).delete()
+            cls.objects.bulk_create(
+                [cls(descendant_id=descendant_pk, ancestor_id=ancestor_pk) for descendant_pk, ancestor_pk in to_add]
+            )
+        return len(to_add), len(to_remove)
+
+
+
+class ItemQuerySet(models.QuerySet):
+    """ QuerySet for items, which can compute the availability of every item it fetches at once. """
+    _with_availability = False
+    _availability_date = None
+
+    def with_availability(self, today=None):
+        """
+            Returns a copy of this QuerySet that computes the availability info of all the items it fetches
+            together, in a constant number of queries, rather than a few queries per item.
+            The results are stored on each item, and returned by item.availability.
+            If today is None, the current date at the time of evaluation is used.
+        """
+        clone = self._chain()
+        clone._with_availability = True
+        clone._availability_date = today
+        return clone
+
+    def featured(self, tag_name='Featured'):
+        """ Returns the items with the given base tag, for the featured items on the home pages. """
+        return self.filter(base_tags__base_tags__name__in=[tag_name]).distinct().order_by('name')
+
+    def iterator(self, chunk_size=None):
+        """
+            If with_availability() was used, the availability info is computed for each chunk of items
+            as it's fetched, so that iterating over every item doesn't need them all in memory at once.
+        """
+        items = super().iterator(chunk_size)
+        if not self._with_availability or self._iterable_class is not models.query.ModelIterable:
+            return items
+        return self._iterate_with_availability(items, chunk_size or 2000)
 
+    def _iterate_with_availability(self, items, chunk_size):
+        while True:
+            chunk = list(islice(items, chunk_size))
+            if not chunk:
+                return
+            availability = ItemAvailability.get_for_items(chunk, self._availability_date)
+            for item in chunk:
+                item._availability = availability[item.pk]
+                yield item
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._with_availability = self._with_availability
+        clone._availability_date = self._availability_date
+        return clone
+
+    def _fetch_all(self):
+        needs_availability = self._with_availability and self._result_cache is None
+        super()._fetch_all()
+        if needs_availability and self._iterable_class is models.query.ModelIterable:
+            availability = ItemAvailability.get_for_items(self._result_cache, self._availability_date)
+            for item in self._result_cache:
+                item._availability = availability[item.pk]
+
+
+class ItemManager(models.Manager.from_queryset(ItemQuerySet)):
+    def get_queryset(self):
+        # The search vector is only read by the database when searching, so it's never loaded into items
+        return super().get_queryset().defer('search_vector')
 
 
 class Item(models.Model):
@@ -80,6 +243,12 @@ class Item(models.Model):
 
     image = models.ImageField(upload_to=image_file_name, null=True)
 
+    # Full text search document of the name, description and computed tags, used by PostgresSearchBackend.
+    # Its GIN index is created in migration 0045, as it only exists on PostgreSQL.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ItemManager()
+
     class Meta:
         ordering = ['name']
 
@@ -102,21 +271,20 @@ class Item(models.Model):
         return computed_tags
 
     def compute_tags(self, recursion=True):
-        """ Takes the base tags and computes all parent tags. """
+        """
+            Takes the base tags and computes all parent tags, using the TagClosure table.
+            Returns True if the computed tags changed.
+        """
         base_tags = self.get_base_tags
         computed_tags = self.get_computed_tags
 
-        tags_to_search = list(base_tags.all().values_list('pk', flat=True))
-        already_searched = list()
-        while True:
-            tags_to_search = list(set(tags_to_search) - set(already_searched))
-            if len(tags_to_search) == 0:
-                break
-            already_searched += tags_to_search
-            tags_to_search = list(Tag.objects.filter(children__child_tag__in=tags_to_search)
-                                  .values_list('pk', flat=True))
-        already_searched = Tag.objects.filter(pk__in=already_searched)
-        computed_tags.set(already_searched, clear=True)
+        base_tag_pks = base_tags.all().values('pk')
+        all_tags = list(
+            Tag.objects.filter(Q(pk__in=base_tag_pks) | Q(descendant_links__descendant__in=base_tag_pks)).distinct()
+        )
+        changed = set(computed_tags.values_list('pk', flat=True)) != set(tag.pk for tag in all_tags)
+        if changed:
+            computed_tags.set(all_tags, clear=True)
 
         try:
             tag = Tag.objects.get(name='Item: '+str(self.name))
@@ -128,9 +296,129 @@ class Item(models.Model):
         except ObjectDoesNotExist:
             tag_parents = TagParent.objects.create(child_tag=tag)
 
-        tag_parents.parent_tag.set(list(base_tags.all())+list(already_searched))
+        tag_parents.parent_tag.set(all_tags)
         if recursion:
             tag_parents.compute_descendant_tags()
+        return changed
+
+    @classmethod
+    def bulk_compute_tags(cls, items):
+        """
+            Recomputes the computed tags of many items at once.
+            Rather than calling compute_tags on every item, this reads the base tags and their ancestors
+            in a few queries, then only inserts and deletes the rows that differ, inside one transaction.
+            The parents of each item's 'Item: <name>' tag are kept in sync the same way.
+            Returns a dict containing the number of 'items' recomputed, the number of rows 'added'
+            and 'removed', and the number of 'seconds' it took.
+        """
+        start_time = time.monotonic()
+        with transaction.atomic():
+            items = list(cls.objects.filter(pk__in=items.values('pk')).values_list('pk', 'name'))
+            item_pks = [item_pk for item_pk, name in items]
+
+            # Find (or create) every item's base and computed tag objects
+            tag_objects = dict()
+            for tags_model in (ItemBaseTags, ItemComputedTags):
+                objects = dict(tags_model.objects.filter(item__in=item_pks).values_list('item', 'pk'))
+                missing = [item_pk for item_pk in item_pks if item_pk not in objects]
+                if missing:
+                    tags_model.objects.bulk_create([tags_model(item_id=item_pk) for item_pk in missing])
+                    objects = dict(tags_model.objects.filter(item__in=item_pks).values_list('item', 'pk'))
+                tag_objects[tags_model] = objects
+            base_objects = {object_pk: item_pk for item_pk, object_pk in tag_objects[ItemBaseTags].items()}
+            computed_objects = tag_objects[ItemComputedTags]
+
+            # Work out what each item's computed tags should be
+            tagged_item = ItemBaseTags.base_tags.through
+            base_tags = dict()
+            for object_pk, tag_pk in tagged_item.objects.filter(
+                    content_type=ContentType.objects.get_for_model(ItemBaseTags),
+                    object_id__in=base_objects) \
+                    .values_list('object_id', 'tag'):
+                base_tags.setdefault(base_objects[object_pk], set()).add(tag_pk)
+            ancestors = dict()
+            for descendant_pk, ancestor_pk in TagClosure.objects.filter(
+                    descendant__in=set().union(*base_tags.values())) \
+                    .values_list('descendant', 'ancestor'):
+                ancestors.setdefault(descendant_pk, set()).add(ancestor_pk)
+            wanted_tags = dict()
+            for item_pk in item_pks:
+                tag_pks = base_tags.get(item_pk, set())
+                wanted_tags[item_pk] = tag_pks.union(*(ancestors.get(tag_pk, set()) for tag_pk in tag_pks))
+
+            # Rewrite the computed tag rows
+            computed_content_type = ContentType.objects.get_for_model(ItemComputedTags)
+            wanted = set(
+                (computed_objects[item_pk], tag_pk) for item_pk in item_pks for tag_pk in wanted_tags[item_pk]
+            )
+            existing = {
+                (object_pk, tag_pk): pk
+                for pk, object_pk, tag_pk in tagged_item.objects.filter(
+                    content_type=computed_content_type,
+                    object_id__in=computed_objects.values()) \
+                    .values_list('pk', 'object_id', 'tag')
+            }
+            to_remove = [existing[row] for row in set(existing) - wanted]
+            to_add = [
+                tagged_item(content_type=computed_content_type, object_id=object_pk, tag_id=tag_pk)
+                for object_pk, tag_pk in wanted - set(existing)
+            ]
+            tagged_item.objects.filter(pk__in=to_remove).delete()
+            tagged_item.objects.bulk_create(to_add)
+            removed, added = len(to_remove), len(to_add)
+            changed_rows = wanted.symmetric_difference(existing)
+            changed_objects = set(object_pk for object_pk, tag_pk in changed_rows)
+            changed_items = [item_pk for item_pk in item_pks if computed_objects[item_pk] in changed_objects]
+            cls.update_search_index(changed_items)
+            if changed_items:
+                # The bulk queries don't send m2m_changed either
+                transaction.on_commit(CatalogueVersion.bump)
+                TagUsage.refresh(set(tag_pk for object_pk, tag_pk in changed_rows))
+
+            # Rewrite the parents of each item's 'Item: <name>' tag
+            item_tag_names = {'Item: '+str(name): item_pk for item_pk, name in items}
+            item_tags = dict(Tag.objects.filter(name__in=item_tag_names).values_list('name', 'pk'))
+            for tag_name in set(item_tag_names) - set(item_tags):
+                item_tags[tag_name] = Tag.objects.create(name=tag_name).pk
+            item_tags = {tag_pk: item_tag_names[tag_name] for tag_name, tag_pk in item_tags.items()}
+            tag_parents = dict(TagParent.objects.filter(child_tag__in=item_tags).values_list('pk', 'child_tag'))
+            missing = set(item_tags) - set(tag_parents.values())
+            if missing:
+                TagParent.objects.bulk_create([TagParent(child_tag_id=tag_pk) for tag_pk in missing])
+                tag_parents = dict(TagParent.objects.filter(child_tag__in=item_tags).values_list('pk', 'child_tag'))
+
+            parent_link = TagParent.parent_tag.through
+            wanted = set(
+                (tag_parent_pk, tag_pk)
+                for tag_parent_pk, child_tag_pk in tag_parents.items()
+                for tag_pk in wanted_tags[item_tags[child_tag_pk]]
+            )
+            existing = {
+                (tag_parent_pk, tag_pk): pk
+                for pk, tag_parent_pk, tag_pk in parent_link.objects.filter(tagparent__in=tag_parents)
+                .values_list('pk', 'tagparent', 'tag')
+            }
+            to_remove = [existing[row] for row in set(existing) - wanted]
+            to_add = [
+                parent_link(tagparent_id=tag_parent_pk, tag_id=tag_pk)
+                for tag_parent_pk, tag_pk in wanted - set(existing)
+            ]
+            parent_link.objects.filter(pk__in=to_remove).delete()
+            parent_link.objects.bulk_create(to_add)
+            removed, added = removed + len(to_remove), added + len(to_add)
+            if to_remove or to_add:
+                # The bulk queries above don't send m2m_changed, so update the closure ourselves
+                TagClosure.refresh(item_tags.keys())
+
+        stats = {
+            'items': len(item_pks),
+            'added': added,
+            'removed': removed,
+            'seconds': time.monotonic() - start_time,
+        }
+        logger.info('Recomputed the tags of {items} items: {added} rows added, {removed} rows removed '
+                    'in {seconds:.3f}s.'.format(**stats))
+        return stats
 
     def compute_playtime(self):
         """ Function to compute the playtime of the item. Called when saving. """
@@ -139,10 +427,42 @@ class Item(models.Model):
             self.average_play_time = (self.min_play_time + self.max_play_time) // 2
 
     def save(self, *args, **kwargs):
-        """ Computes the playtime and tags upon saving. """
+        """
+            Computes the playtime and tags upon saving.
+            If LIBRARY_DEFER_TAG_COMPUTATION is set, the tags are computed later by a celery task instead.
+        """
         self.compute_playtime()
+        # The search index only needs updating if the item is new, or if its name, description or tags changed
+        index_changed = self._state.adding or self.get_indexed_values() != getattr(self, '_indexed_values', None)
         super(Item, self).save(*args, **kwargs)
-        self.compute_tags()
+        self._indexed_values = self.get_indexed_values()
+        if settings.LIBRARY_DEFER_TAG_COMPUTATION:
+            # The tags are re-indexed when they're computed
+            PendingTagComputation.mark(item=self)
+        elif self.compute_tags():
+            index_changed = True
+        if index_changed:
+            Item.update_search_index([self.pk])
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember the indexed values the item was loaded with, so save() can tell if they changed
+        item = super().from_db(db, field_names, values)
+        item._indexed_values = item.get_indexed_values()
+        return item
+
+    def get_indexed_values(self):
+        # Deferred fields aren't loaded just for this, and count as None
+        return self.__dict__.get('name'), self.__dict__.get('description')
+
+    @classmethod
+    def update_search_index(cls, item_pks):
+        """
+            Re-indexes the given items in the library search backend, from their name, description and computed tags.
+        """
+        from .search import get_search_backend
+        if item_pks:
+            get_search_backend().update_items(item_pks)
 
     @property
     def url(self):
@@ -156,7 +476,12 @@ class Item(models.Model):
 
     @property
     def availability(self):
-        return self.get_availability_info()
+        # Use the availability computed by ItemQuerySet.with_availability() if there is one,
+        # otherwise read it from today's ItemAvailability snapshot
+        info = getattr(self, '_availability', None)
+        if info is None:
+            info = ItemAvailability.get_for_items([self])[self.pk]
+        return info
 
     def get_availability_info(self):
         """
@@ -248,6 +573,95 @@ class Item(models.Model):
 
         return info
 
+    @classmethod
+    def get_bulk_availability_info(cls, items, today=None):
+        """
+        Computes the same dicts as get_availability_info() for many items at once.
+        All the relevant borrow records are loaded in two queries, and the rest is worked out in memory.
+        Returns a dict mapping each item's pk to its availability info.
+        """
+        if today is None:
+            today = datetime.date.today()
+        next_day = datetime.timedelta(days=1)
+        borrowable = [item.pk for item in items if item.is_borrowable]
+
+        borrowed_due_dates = dict()
+        for item_pk, due_date in BorrowRecord.objects \
+                .filter(item__in=borrowable, date_borrowed__lte=today, date_returned=None) \
+                .values_list('item', 'due_date'):
+            borrowed_due_dates.setdefault(item_pk, []).append(due_date)
+
+        # (date_borrowed, date_returned, requested_borrow_date, due_date) of every approved external record
+        ext_records = dict()
+        for item_pk, *record in ExternalBorrowingItemRecord.objects \
+                .filter(item__in=borrowable) \
+                .exclude(form__form_status__in=[UNAPPROVED, DENIED, COMPLETED]) \
+                .values_list('item', 'date_borrowed', 'date_returned', 'form__requested_borrow_date', 'form__due_date'):
+            ext_records.setdefault(item_pk, []).append(record)
+
+        def latest_due_record(records):
+            # Equivalent to .order_by('-form__due_date').first(), where nulls come first
+            return max(records, key=lambda r: (r[3] is None, r[3] or datetime.date.min))
+
+        results = dict()
+        for item in items:
+            info = {
+                'in_clubroom': True,
+                'is_available': True,
+                'expected_availability_date': None,
+                'max_due_date': None,
+            }
+            results[item.pk] = info
+            if item.is_borrowable is False:
+                info['is_available'] = False
+                continue
+            records = ext_records.get(item.pk, [])
+
+            if item.pk in borrowed_due_dates:
+                info['in_clubroom'] = False
+                info['is_available'] = False
+                info['expected_availability_date'] = max(borrowed_due_dates[item.pk])
+            if info['is_available'] is True:
+                borrowed = [r for r in records if r[0] is not None and r[0] <= today and r[1] is None]
+                if borrowed:
+                    info['in_clubroom'] = False
+                    info['is_available'] = False
+                    info['expected_availability_date'] = latest_due_record(borrowed)[3]
+            if info['is_available'] is True:
+                tomorrow_records = [r for r in records if r[2] == today+next_day]
+                if tomorrow_records:
+                    info['is_available'] = False
+                    info['expected_availability_date'] = latest_due_record(tomorrow_records)[3]
+
+            if info['is_available'] is False:
+                # Follow the chain of external borrowing forms, stopping if it ever loops back on itself
+                seen_dates = set()
+                while info['expected_availability_date'] not in seen_dates:
+                    seen_dates.add(info['expected_availability_date'])
+                    chained = [
+                        r for r in records
+                        if r[2] in (info['expected_availability_date'], info['expected_availability_date'] + next_day)
+                    ]
+                    if not chained:
+                        break
+                    info['expected_availability_date'] = latest_due_record(chained)[3]
+                    if info['expected_availability_date'] is None:
+                        break
+
+            if info['is_available'] is True:
+                due_dates = [today+datetime.timedelta(weeks=2)]
+                if item.high_demand:
+                    if today.weekday() in [4, 5, 6]:
+                        due_dates.append(today+datetime.timedelta(days=7-today.weekday()))
+                    else:
+                        due_dates.append(today+next_day)
+                upcoming = [r for r in records if r[2] >= today]
+                if upcoming:
+                    due_dates.append(latest_due_record(upcoming)[2]+datetime.timedelta(days=-1))
+                info['max_due_date'] = min(due_dates)
+
+        return results
+
     @property
     def is_available(self):
         """
@@ -345,6 +759,218 @@ class ItemComputedTags(models.Model):
         return 'Computed tags for '+self.item.name
 
 
+class TagUsage(models.Model):
+    """
+        The number of items with each tag in their computed tags, so that the tag list can be read
+        in one indexed query, rather than counting the items of every tag on each request.
+        Also marks the 'Item: <name>' tags made for each item, so they can be filtered out without matching names.
+        Kept up to date by Item.bulk_compute_tags and the signals in library/signals.py.
+    """
+    tag = models.OneToOneField(Tag, on_delete=models.CASCADE, primary_key=True, related_name='usage')
+    num_items = models.PositiveIntegerField(default=0)
+    is_item_tag = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_item_tag', '-num_items'], name='tagusage_list_idx'),
+        ]
+
+    def __str__(self):
+        return '{0} ({1} items)'.format(self.tag, self.num_items)
+
+    @classmethod
+    def refresh(cls, tag_pks=None):
+        """
+            Recounts the items of the given tags (or of every tag, if None), and saves them.
+            Only the given tags are counted, so this stays cheap when a few tags change.
+            Returns the number of tags refreshed.
+        """
+        tags = Tag.objects.all() if tag_pks is None else Tag.objects.filter(pk__in=list(tag_pks))
+        tags = list(tags.values_list('pk', 'name'))
+        counts = dict(
+            ItemComputedTags.computed_tags.through.objects.filter(
+                content_type=ContentType.objects.get_for_model(ItemComputedTags),
+                tag__in=[tag_pk for tag_pk, name in tags])
+            .order_by().values_list('tag').annotate(count=models.Count('pk'))
+        )
+        cls.objects.bulk_create(
+            [
+                cls(tag_id=tag_pk, num_items=counts.get(tag_pk, 0), is_item_tag=name.startswith('Item: '))
+                for tag_pk, name in tags
+            ],
+            update_conflicts=True,
+            unique_fields=['tag'],
+            update_fields=['num_items', 'is_item_tag'],
+        )
+        return len(tags)
+
+
+class ItemAvailability(models.Model):
+    """
+        A snapshot of the result of Item.get_availability_info(), so that it can be read in one query.
+        Refreshed by the signals in library/signals.py whenever a borrow record or external borrowing form changes,
+        and every night by refresh_item_availability_task, as max_due_date depends on the current date.
+        Snapshots from a previous day are ignored and recomputed.
+    """
+    item = models.OneToOneField(Item, on_delete=models.CASCADE, primary_key=True, related_name='availability_snapshot')
+    in_clubroom = models.BooleanField()
+    is_available = models.BooleanField()
+    expected_availability_date = models.DateField(blank=True, null=True)
+    max_due_date = models.DateField(blank=True, null=True)
+    computed_on = models.DateField()
+
+    def __str__(self):
+        return 'Availability of '+str(self.item)
+
+    def get_info(self):
+        return {
+            'in_clubroom': self.in_clubroom,
+            'is_available': self.is_available,
+            'expected_availability_date': self.expected_availability_date,
+            'max_due_date': self.max_due_date,
+        }
+
+    @classmethod
+    def get_for_items(cls, items, today=None):
+        """
+            Returns a dict mapping each item's pk to its availability info.
+            Today's snapshots are used where they exist, and the rest are computed in bulk (and saved, if for today).
+        """
+        if today is None:
+            today = datetime.date.today()
+        info = {
+            snapshot.item_id: snapshot.get_info()
+            for snapshot in cls.objects.filter(item__in=[item.pk for item in items], computed_on=today)
+        }
+        missing = [item for item in items if item.pk not in info]
+        if missing:
+            computed = Item.get_bulk_availability_info(missing, today)
+            if today == datetime.date.today():
+                cls.save_snapshots(computed, today)
+            info.update(computed)
+        return info
+
+    @classmethod
+    def save_snapshots(cls, availability, today):
+        # Creates or updates the snapshots from a dict of item pks to availability info
+        cls.objects.bulk_create(
+            [cls(item_id=item_pk, computed_on=today, **info) for item_pk, info in availability.items()],
+            update_conflicts=True,
+            unique_fields=['item'],
+            update_fields=['in_clubroom', 'is_available', 'expected_availability_date', 'max_due_date', 'computed_on'],
+        )
+
+    @classmethod
+    def refresh(cls, items=None):
+        """
+            Recomputes and saves the snapshots of the given items (a QuerySet), or of every item if None.
+            Returns the number of snapshots refreshed.
+        """
+        if items is None:
+            items = Item.objects.all()
+        items = list(items)
+        today = datetime.date.today()
+        cls.save_snapshots(Item.get_bulk_availability_info(items, today), today)
+        return len(items)
+
+
+class CatalogueVersion(models.Model):
+    """
+        A single row, whose version is bumped whenever anything shown in the catalogue changes:
+        items, tags or borrowing records (see the signals in library/signals.py).
+        The version is used as the ETag of the item list pages and the items API,
+        so clients polling them get a 304 Not Modified when nothing has changed.
+    """
+    version = models.PositiveIntegerField(default=0)
+    last_modified = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def get(cls):
+        version, created = cls.objects.get_or_create(pk=1)
+        return version
+
+    @classmethod
+    def bump(cls):
+        if not cls.objects.filter(pk=1).update(version=models.F('version') + 1, last_modified=timezone.now()):
+            cls.objects.get_or_create(pk=1)
+
+    def __str__(self):
+        return 'Catalogue version {0}'.format(self.version)
+
+
+class PendingTagComputation(models.Model):
+    """
+        Marks an item or tag whose computed tags are out of date.
+        Used when LIBRARY_DEFER_TAG_COMPUTATION is set: saves only mark things here,
+        and recompute_pending_tags_task in library/tasks.py recomputes them all at once later.
+        Each item or tag has at most one row, so repeated edits are coalesced.
+    """
+    item = models.OneToOneField(Item, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    tag = models.OneToOneField(Tag, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    # When this item or tag was first marked, and when it was most recently marked
+    first_marked = models.DateTimeField(default=timezone.now)
+    last_marked = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        if self.item_id is not None:
+            return 'Pending tag computation for '+str(self.item)
+        return 'Pending tag computation for items tagged with '+str(self.tag)
+
+    @classmethod
+    def mark(cls, item=None, tag=None):
+        """ Marks an item or tag as needing recomputation, and schedules the task to do it. """
+        from .tasks import recompute_pending_tags_task
+        if item is not None:
+            cls.objects.update_or_create(item=item, defaults={'last_marked': timezone.now()})
+        if tag is not None:
+            cls.objects.update_or_create(tag=tag, defaults={'last_marked': timezone.now()})
+        transaction.on_commit(lambda: recompute_pending_tags_task.apply_async(
+            countdown=settings.LIBRARY_TAG_COMPUTATION_COUNTDOWN
+        ))
+
+    @classmethod
+    def get_queue_status(cls):
+        """
+            Returns a dict containing the number of pending rows ('depth'),
+            and how long the oldest one has been waiting ('lag', a timedelta, or None if the queue is empty).
+        """
+        oldest = cls.objects.aggregate(oldest=models.Min('first_marked'))['oldest']
+        return {
+            'depth': cls.objects.count(),
+            'lag': timezone.now() - oldest if oldest is not None else None,
+        }
+
+    @classmethod
+    def recompute_pending(cls):
+        """
+            Recomputes the tags of every pending item, and of every item tagged with a pending tag,
+            then removes the rows that were handled.
+            Tags that are descendants of another pending tag are skipped, as their items are covered by it.
+            Returns the stats dicts of the two Item.bulk_compute_tags calls.
+        """
+        started = timezone.now()
+        pending = list(cls.objects.filter(last_marked__lte=started).values_list('pk', 'item', 'tag'))
+        item_pks = set(item_pk for pk, item_pk, tag_pk in pending if item_pk is not None)
+        tag_pks = set(tag_pk for pk, item_pk, tag_pk in pending if tag_pk is not None)
+
+        # Recompute the marked items first, which also updates their 'Item: <name>' tags
+        item_stats = Item.bulk_compute_tags(Item.objects.filter(pk__in=item_pks))
+        tag_pks |= set(Tag.objects.filter(
+            name__in=['Item: '+name for name in Item.objects.filter(pk__in=item_pks).values_list('name', flat=True)]
+        ).values_list('pk', flat=True))
+
+        # Then everything that inherits from a marked tag, covering each tag subtree only once
+        tag_pks -= set(TagClosure.objects.filter(descendant__in=tag_pks, ancestor__in=tag_pks)
+                       .values_list('descendant', flat=True))
+        tag_stats = Item.bulk_compute_tags(Item.objects.filter(
+            Q(base_tags__base_tags__in=tag_pks) |
+            Q(base_tags__base_tags__in=TagClosure.objects.filter(ancestor__in=tag_pks).values('descendant'))
+        ))
+
+        cls.objects.filter(pk__in=[pk for pk, item_pk, tag_pk in pending], last_marked__lte=started).delete()
+        return item_stats, tag_stats
+
+
 class BorrowRecord(models.Model):
     # These fields are set upon the item being borrowed
     borrowing_member = models.ForeignKey(
@@ -385,6 +1011,30 @@ class BorrowRecord(models.Model):
     # Finally, the librarian verifies that it was returned
     verified_returned = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Items currently out on loan: availability checks, the overview, overdue items and due date reminders
+            models.Index(
+                fields=['item', 'date_borrowed'], condition=Q(date_returned__isnull=True),
+                name='borrowrecord_open_item_idx',
+            ),
+            models.Index(
+                fields=['due_date'], condition=Q(date_returned__isnull=True),
+                name='borrowrecord_open_due_idx',
+            ),
+            models.Index(
+                fields=['borrowing_member'], condition=Q(date_returned__isnull=True),
+                name='borrowrecord_open_member_idx',
+            ),
+            # Returned items waiting to be verified by the librarian
+            models.Index(
+                fields=['date_returned'], condition=Q(date_returned__isnull=False, verified_returned=False),
+                name='borrowrecord_unverified_idx',
+            ),
+            # Recent borrowing history
+            models.Index(fields=['date_borrowed'], name='borrowrecord_borrowed_idx'),
+        ]
+
     def __str__(self):
         if self.verified_returned:
             return '(RETURNED)'+str(self.borrowing_member)+' - '+str(self.item)
@@ -400,6 +1050,24 @@ class BorrowRecord(models.Model):
         self.save()
 
 
+class SentReminder(models.Model):
+    """
+        A ledger of the due date reminders that have been sent, with one row per borrow record and offset.
+        The reminder task skips the records that already have a row, so running it again
+        (or retrying it after a failure) never sends the same reminder twice.
+    """
+    record = models.ForeignKey(BorrowRecord, on_delete=models.CASCADE, related_name='sent_reminders')
+    # How many days after the due date the reminder was for (negative if it was before the due date)
+    offset = models.IntegerField()
+    date_sent = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('record', 'offset')
+
+    def __str__(self):
+        return 'Reminder for {0} ({1:+d} days)'.format(self.record, self.offset)
+
+
 class ExternalBorrowingForm(models.Model):
     UNAPPROVED = UNAPPROVED
     DENIED = DENIED
@@ -425,6 +1093,17 @@ class ExternalBorrowingForm(models.Model):
     due_date = models.DateField(blank=True, null=True, default=None)
     librarian_comments = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            # Approved forms by date: availability checks look up forms starting on or after a given date
+            models.Index(
+                fields=['requested_borrow_date', 'due_date'], condition=Q(form_status=APPROVED),
+                name='extform_approved_dates_idx',
+            ),
+            # The overview groups forms by status
+            models.Index(fields=['form_status', 'requested_borrow_date'], name='extform_status_idx'),
+        ]
+
 
 class ExternalBorrowingItemRecord(models.Model):
     form = models.ForeignKey(ExternalBorrowingForm, on_delete=models.CASCADE, related_name='requested_items')
@@ -453,3 +1132,12 @@ class ExternalBorrowingItemRecord(models.Model):
         default=None,
     )
     date_returned = models.DateField(blank=True, null=True, default=None)
+
+    class Meta:
+        indexes = [
+            # Items currently borrowed by external borrowers
+            models.Index(
+                fields=['item', 'date_borrowed'], condition=Q(date_returned__isnull=True),
+                name='extrecord_open_item_idx',
+            ),
+        ]
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .models import Item
+import random
+
+RANDOM_PKS_KEY = 'library:random_pks:{0}'
+# The item types that have their own list of pks, where None is every item
+RANDOM_PICK_TYPES = [None] + [item_type for item_type, name in Item.ITEM_TYPE_CHOICES]
+
+
+def get_item_pks(item_type=None, refresh=False):
+    """
+        Returns the pks of every item of the given type (or of every item, if None).
+        The lists are cached, so picking an item doesn't need to fetch every pk from the database.
+        Saving or deleting an item clears them, but only in the cache of the process that did it,
+        so they also expire after LIBRARY_RANDOM_PICK_CACHE_TIMEOUT seconds.
+        If refresh is True, the list is fetched from the database again.
+    """
+    key = RANDOM_PKS_KEY.format(item_type or 'all')
+    pks = None if refresh else cache.get(key)
+    if pks is None:
+        qs = Item.objects.all() if item_type is None else Item.objects.filter(type=item_type)
+        pks = list(qs.order_by('pk').values_list('pk', flat=True))
+        cache.set(key, pks, settings.LIBRARY_RANDOM_PICK_CACHE_TIMEOUT)
+    return pks
+
+
+def invalidate_item_pks():
+    # Called by the signals whenever an item is saved or deleted, once the transaction has committed
+    transaction.on_commit(
+        lambda: cache.delete_many([RANDOM_PKS_KEY.format(item_type or 'all') for item_type in RANDOM_PICK_TYPES])
+    )
+
+
+def pick_random_items(item_type=None, count=1, queryset=None):
+    """
+        Returns a list of up to count distinct random items of the given type (or of any type, if None),
+        fetched in one query from the given queryset (by default, the items with their availability).
+        If any of the chosen items were deleted or changed type since the list of pks was cached,
+        the list is fetched again and new items are chosen.
+    """
+    if queryset is None:
+        queryset = Item.objects.with_availability()
+    if item_type is not None:
+        queryset = queryset.filter(type=item_type)
+    for refresh in (False, True):
+        pks = get_item_pks(item_type, refresh)
+        chosen_pks = random.sample(pks, min(count, len(pks)))
+        items = queryset.in_bulk(chosen_pks)
+        if len(items) == len(chosen_pks):
+            break
+    return [items[pk] for pk in chosen_pks if pk in items]
@@ -0,0 +1,61 @@
+from django.conf import settings
+from phylactery.tasks import compose_html_email, compose_email_message, send_messages_over_connection
+from .models import BorrowRecord, SentReminder
+from itertools import groupby
+import datetime
+
+
+def get_reminder_subject(offset):
+    if offset > 0:
+        return 'Unigames - Library Items Overdue'
+    elif offset == 0:
+        return 'Unigames - Items Due Today'
+    elif offset == -1:
+        return 'Unigames - Items Due Tomorrow'
+    return 'Unigames - Items Due in {0} Days'.format(-offset)
+
+
+def send_due_date_reminders(offset, today=None):
+    """
+        Sends a reminder to every member with items that were due `offset` days before today,
+        i.e. a negative offset reminds them before the due date, and a positive one once the items are overdue.
+        Each member gets one email for all of their items, and the emails are sent in batches of EMAIL_BATCH_SIZE,
+        each over a single connection.
+        Records that were already reminded at this offset are skipped, and a record is only added to
+        the SentReminder ledger once its email has been sent, so this can be run again if some emails fail.
+        Returns a dict of the number of members reminded ('sent') and the number of emails that failed ('failed').
+    """
+    today = today or datetime.date.today()
+    due_date = today - datetime.timedelta(days=offset)
+    subject = get_reminder_subject(offset)
+    records = BorrowRecord.objects \
+        .filter(due_date=due_date, date_returned=None, borrowing_member__isnull=False) \
+        .exclude(sent_reminders__offset=offset) \
+        .select_related('borrowing_member', 'item') \
+        .order_by('borrowing_member', 'pk')
+
+    reminders = []
+    for member_pk, member_records in groupby(records, key=lambda record: record.borrowing_member_id):
+        member_records = list(member_records)
+        member = member_records[0].borrowing_member
+        body, html_body = compose_html_email('library/email_reminder.html', {
+            'member': member,
+            'due_date': due_date,
+            'offset': offset,
+            'subject': subject,
+            'record_list': member_records,
+        })
+        reminders.append((compose_email_message(member.email_address, subject, body, html_body), member_records))
+
+    stats = {'sent': 0, 'failed': 0}
+    for i in range(0, len(reminders), settings.EMAIL_BATCH_SIZE):
+        batch = reminders[i:i + settings.EMAIL_BATCH_SIZE]
+        failed_messages = send_messages_over_connection([message for message, member_records in batch])
+        SentReminder.objects.bulk_create([
+            SentReminder(record=record, offset=offset)
+            for message, member_records in batch if message not in failed_messages
+            for record in member_records
+        ], ignore_conflicts=True)
+        stats['sent'] += len(batch) - len(failed_messages)
+        stats['failed'] += len(failed_messages)
+    return stats
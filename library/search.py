@@ -0,0 +1,207 @@
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, FloatField, OuterRef, Q, Subquery, Value
+from django.utils.module_loading import import_string
+from .models import Item, ItemComputedTags
+import re
+
+
+class SearchBackend:
+    """
+        The interface of a library search backend.
+        A backend keeps its own index of each item's name, description and computed tags,
+        which Item updates through update_items() and remove_items() whenever those change.
+    """
+    # How many items are written to the index at once
+    batch_size = 500
+
+    def search(self, query, queryset=None):
+        """
+            Returns the items of the queryset that match the query, annotated with a rank
+            (where higher is more relevant) and ordered from the most to the least relevant.
+        """
+        raise NotImplementedError
+
+    def update_items(self, item_pks):
+        """
+            Re-indexes the given items.
+        """
+        raise NotImplementedError
+
+    def remove_items(self, item_pks):
+        """
+            Removes the given items from the index.
+        """
+        raise NotImplementedError
+
+    def rebuild(self):
+        """
+            Re-indexes every item, and returns how many there were.
+        """
+        item_pks = list(Item.objects.values_list('pk', flat=True))
+        self.update_items(item_pks)
+        return len(item_pks)
+
+    def get_documents(self, item_pks):
+        """
+            Yields (pk, name, description, tags) for each of the given items, where tags is the
+            space separated names of their computed tags. Uses two queries per batch.
+        """
+        item_pks = list(item_pks)
+        for start in range(0, len(item_pks), self.batch_size):
+            batch = item_pks[start:start+self.batch_size]
+            tag_names = dict()
+            for item_pk, tag_name in ItemComputedTags.objects.filter(item__in=batch) \
+                    .exclude(computed_tags__name=None) \
+                    .values_list('item', 'computed_tags__name'):
+                tag_names.setdefault(item_pk, []).append(tag_name)
+            for item_pk, name, description in Item.objects.filter(pk__in=batch) \
+                    .values_list('pk', 'name', 'description'):
+                yield item_pk, name, description or '', ' '.join(sorted(tag_names.get(item_pk, [])))
+
+
+class BasicSearchBackend(SearchBackend):
+    """
+        Searches with icontains, so it works on any database but has no index and no ranking.
+        Every word in the query has to appear in the name, description or a computed tag.
+    """
+
+    def search(self, query, queryset=None):
+        if queryset is None:
+            queryset = Item.objects.all()
+        matches = Item.objects.all()
+        for word in query.split():
+            matches = matches.filter(
+                Q(name__icontains=word)
+                | Q(description__icontains=word)
+                | Q(computed_tags__computed_tags__name__icontains=word)
+            )
+        return queryset \
+            .filter(pk__in=matches.values('pk')) \
+            .annotate(rank=Value(1.0, output_field=FloatField())) \
+            .order_by('-rank', 'name')
+
+    def update_items(self, item_pks):
+        pass
+
+    def remove_items(self, item_pks):
+        pass
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+        Full text search on the GIN indexed Item.search_vector column.
+        The name has weight A, and the description and tags have weight B.
+    """
+    weights = [0.5, 0.7, 0.9, 1.0]
+    min_rank = 0.2
+
+    def search(self, query, queryset=None):
+        if queryset is None:
+            queryset = Item.objects.all()
+        search_query = SearchQuery(query)
+        return queryset \
+            .filter(search_vector=search_query) \
+            .annotate(rank=SearchRank(F('search_vector'), search_query, weights=self.weights)) \
+            .filter(rank__gte=self.min_rank) \
+            .order_by('-rank', 'name')
+
+    def get_search_vector(self):
+        # The computed tag names of each item are aggregated in a subquery, so a whole batch is updated at once
+        tags = ItemComputedTags.objects \
+            .filter(item=OuterRef('pk')) \
+            .values('item') \
+            .annotate(names=StringAgg('computed_tags__name', delimiter=' ', ordering='computed_tags__name')) \
+            .values('names')
+        return SearchVector('name', weight='A') + \
+            SearchVector('description', weight='B') + \
+            SearchVector(Subquery(tags), weight='B')
+
+    def update_items(self, item_pks):
+        item_pks = list(item_pks)
+        for start in range(0, len(item_pks), self.batch_size):
+            Item.objects.filter(pk__in=item_pks[start:start+self.batch_size]).update(
+                search_vector=self.get_search_vector()
+            )
+
+    def remove_items(self, item_pks):
+        # The search vector is deleted along with its item
+        pass
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """
+        Full text search on an SQLite FTS5 virtual table, created in migration 0047,
+        with one row per item whose rowid is the item's primary key.
+        Matches are ranked by bm25(), with name matches weighted above description and tag matches.
+    """
+    table = 'library_item_fts'
+    # bm25() weights of the name, description and tags columns
+    weights = (10.0, 1.0, 2.0)
+
+    def get_match_expression(self, query):
+        # Each word is quoted, so that the words in the query are all required
+        # and any FTS5 query syntax in it (AND, OR, NEAR, *, ", ...) is treated as plain text
+        words = re.findall(r'\w+', query)
+        return ' '.join('"{0}"'.format(word) for word in words)
+
+    def search(self, query, queryset=None):
+        if queryset is None:
+            queryset = Item.objects.all()
+        match = self.get_match_expression(query)
+        if not match:
+            return queryset.none()
+        # The table is joined rather than used in a subquery, so that the full text query and bm25() are only
+        # evaluated once. bm25() is lower for better matches, so it is negated to match the other backends.
+        return queryset \
+            .extra(
+                tables=[self.table],
+                where=['{0}.rowid = {1}.id'.format(self.table, Item._meta.db_table), '{0} MATCH %s'.format(self.table)],
+                params=[match],
+                select={'rank': '-bm25({0}, {1})'.format(self.table, ', '.join(str(w) for w in self.weights))},
+            ) \
+            .order_by('-rank', 'name')
+
+    def update_items(self, item_pks):
+        item_pks = list(item_pks)
+        documents = list(self.get_documents(item_pks))
+        with connection.cursor() as cursor:
+            self.delete_rows(cursor, item_pks)
+            cursor.executemany(
+                'INSERT INTO {0} (rowid, name, description, tags) VALUES (%s, %s, %s, %s)'.format(self.table),
+                documents
+            )
+
+    def remove_items(self, item_pks):
+        with connection.cursor() as cursor:
+            self.delete_rows(cursor, list(item_pks))
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {0}'.format(self.table))
+        return super().rebuild()
+
+    def delete_rows(self, cursor, item_pks):
+        for start in range(0, len(item_pks), self.batch_size):
+            batch = item_pks[start:start+self.batch_size]
+            cursor.execute('DELETE FROM {0} WHERE rowid IN ({1})'.format(
+                self.table, ', '.join(['%s'] * len(batch))
+            ), batch)
+
+
+SEARCH_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_search_backend():
+    """
+        Returns the search backend named by the LIBRARY_SEARCH_BACKEND setting,
+        or the one for the database in use if that isn't set.
+    """
+    if settings.LIBRARY_SEARCH_BACKEND:
+        return import_string(settings.LIBRARY_SEARCH_BACKEND)()
+    return SEARCH_BACKENDS.get(connection.vendor, BasicSearchBackend)()
@@ -3,6 +3,36 @@ from library.models import Item
 
 
 class ItemSerialiser(serializers.ModelSerializer):
+	# Fields that are only included when they're asked for, as they're expensive to compute
+	expandable_fields = ['availability']
+	# The model fields that each serialiser field needs to be loaded, where they aren't just the field itself
+	model_fields = {
+		'id': [],
+		'url': ['slug'],
+		'availability': ['is_borrowable', 'high_demand'],
+	}
+
 	class Meta:
 		model = Item
 		fields = ['id', 'name', 'description', 'url', 'type', 'is_borrowable', 'image', 'availability']
+
+	def __init__(self, *args, fields=None, **kwargs):
+		# Only the given fields are included, or if None, every field except the expandable ones
+		super().__init__(*args, **kwargs)
+		if fields is None:
+			fields = self.get_default_fields()
+		for name in list(self.fields):
+			if name not in fields:
+				self.fields.pop(name)
+
+	@classmethod
+	def get_default_fields(cls):
+		return [name for name in cls.Meta.fields if name not in cls.expandable_fields]
+
+	@classmethod
+	def get_model_fields(cls, fields):
+		# Returns the model fields to load (with .only()) for the given serialiser fields
+		model_fields = ['pk']
+		for name in fields:
+			model_fields += cls.model_fields.get(name, [name])
+		return model_fields
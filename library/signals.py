@@ -0,0 +1,136 @@
+# Signal handlers that keep the TagClosure table in sync with the TagParent hierarchy,
+# the ItemAvailability snapshots in sync with borrowing records, and the search index in sync with items and tags.
+# The cached fragments of the public pages (see phylactery.fragments) are also invalidated here,
+# the CatalogueVersion is bumped whenever anything shown in the catalogue changes,
+# and the TagUsage counts are kept in sync with the computed tags.
+# These are connected in LibraryConfig.ready()
+
+
+def tag_parents_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Called whenever TagParent.parent_tag links are added, removed or cleared.
+    from .models import TagClosure, TagParent
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action != 'post_clear' and not pk_set:
+        # set() sends an add even when none of the parents were new
+        return
+    if not reverse:
+        # instance is the TagParent whose parents changed
+        TagClosure.refresh([instance.child_tag_id])
+    elif pk_set:
+        # instance is a parent Tag, and pk_set holds the TagParents that were linked to it
+        TagClosure.refresh(TagParent.objects.filter(pk__in=pk_set).values_list('child_tag', flat=True))
+    else:
+        # A reverse clear doesn't tell us which tags were affected, so rebuild everything
+        TagClosure.refresh()
+
+
+def tag_parent_deleted(sender, instance, **kwargs):
+    # Removing a TagParent removes all parents of its child tag
+    from .models import TagClosure
+    TagClosure.refresh([instance.child_tag_id])
+
+
+def tag_pre_delete(sender, instance, **kwargs):
+    # Remember the descendants of a tag before it (and its closure rows) are deleted
+    from .models import TagClosure
+    instance._closure_descendants = list(
+        TagClosure.objects.filter(ancestor=instance).values_list('descendant', flat=True)
+    )
+
+
+def tag_post_delete(sender, instance, **kwargs):
+    # The deleted tag's descendants may have lost ancestors that were only reachable through it
+    from .models import TagClosure
+    descendants = getattr(instance, '_closure_descendants', None)
+    if descendants:
+        TagClosure.refresh(descendants)
+
+
+def item_changed(sender, instance, **kwargs):
+    # An item's borrowable or high demand status affects its availability,
+    # and a new item or a change of type affects the lists of items to pick randomly from
+    from .models import ItemAvailability, Item
+    from .random_picks import invalidate_item_pks
+    ItemAvailability.refresh(Item.objects.filter(pk=instance.pk))
+    invalidate_item_pks()
+
+
+def borrow_record_changed(sender, instance, **kwargs):
+    # Called when a BorrowRecord or ExternalBorrowingItemRecord is saved
+    from .models import ItemAvailability, Item
+    ItemAvailability.refresh(Item.objects.filter(pk=instance.item_id))
+
+
+def borrow_record_deleted(sender, instance, **kwargs):
+    # Called when a BorrowRecord or ExternalBorrowingItemRecord is deleted.
+    # The record may be deleted along with its item, so the snapshot is only refreshed once the deletion
+    # has committed, and only if the item still exists.
+    from .models import ItemAvailability, Item
+    from django.db import transaction
+    item_pk = instance.item_id
+    transaction.on_commit(lambda: ItemAvailability.refresh(Item.objects.filter(pk=item_pk)))
+
+
+def external_borrowing_form_changed(sender, instance, **kwargs):
+    # A change to the form's status or dates affects every item on the form
+    from .models import ItemAvailability, Item
+    ItemAvailability.refresh(Item.objects.filter(ext_borrow_records__form=instance).distinct())
+
+
+def item_deleted(sender, instance, **kwargs):
+    from .search import get_search_backend
+    from .random_picks import invalidate_item_pks
+    get_search_backend().remove_items([instance.pk])
+    invalidate_item_pks()
+
+
+def tag_renamed(sender, instance, created, **kwargs):
+    # The search index holds the names of each item's computed tags,
+    # and whether a tag is an 'Item: <name>' tag depends on its name
+    from .models import Item, TagUsage
+    TagUsage.refresh([instance.pk])
+    if not created:
+        Item.update_search_index(list(
+            Item.objects.filter(computed_tags__computed_tags=instance).values_list('pk', flat=True)
+        ))
+
+
+def base_tags_changed(sender, instance, action, **kwargs):
+    # Taggit sends this for every model's tags, but only base tags decide which items are featured
+    from .models import ItemBaseTags
+    from phylactery.fragments import invalidate_fragments
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, ItemBaseTags):
+        invalidate_fragments()
+
+
+def catalogue_changed(sender, action=None, **kwargs):
+    # Connected to the signals of every model shown in the catalogue. m2m_changed is also sent before changes.
+    from .models import CatalogueVersion
+    from django.db import transaction
+    if action is None or action.startswith('post_'):
+        transaction.on_commit(CatalogueVersion.bump)
+
+
+def computed_tags_changed(sender, instance, action, pk_set, **kwargs):
+    # Taggit sends this for every model's tags, but only computed tags are counted in TagUsage.
+    # A clear doesn't say which tags were removed, so they're remembered beforehand.
+    from .models import ItemComputedTags, TagUsage
+    if not isinstance(instance, ItemComputedTags):
+        return
+    if action == 'pre_clear':
+        instance._cleared_tags = list(instance.computed_tags.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        TagUsage.refresh(getattr(instance, '_cleared_tags', []))
+    elif action in ('post_add', 'post_remove') and pk_set:
+        TagUsage.refresh(pk_set)
+
+
+def computed_tags_pre_delete(sender, instance, **kwargs):
+    # The tagged item rows are deleted along with an item's computed tags, without sending m2m_changed
+    instance._deleted_tags = list(instance.computed_tags.values_list('pk', flat=True))
+
+
+def computed_tags_deleted(sender, instance, **kwargs):
+    from .models import TagUsage
+    TagUsage.refresh(getattr(instance, '_deleted_tags', []))
@@ -1,55 +1,50 @@
 from celery import shared_task
 from celery.utils.log import get_task_logger
+from django.conf import settings
 from django.template import loader
-from phylactery.tasks import send_single_email_task, compose_html_email
 import datetime
 
-from .models import BorrowRecord
+from .models import PendingTagComputation, ItemAvailability
+from .reminders import send_due_date_reminders
 
 logger = get_task_logger(__name__)
 
 
-@shared_task(name="send_due_date_tomorrow_reminder_task")
-def send_due_date_tomorrow_reminder_task():
+@shared_task(bind=True, name="send_due_date_reminders_task", max_retries=settings.EMAIL_MAX_RETRIES)
+def send_due_date_reminders_task(self, offsets=None, today=None):
     """
         Scheduled task.
-        Sends a reminder to all borrowers of items due the next day.
+        Sends the due date reminders for each of the offsets in LIBRARY_REMINDER_OFFSETS (or the given offsets).
         Intended to be run every day.
+        If any of the emails couldn't be sent, the task is retried after a backoff, which only sends
+        the reminders that haven't been sent yet.
     """
-    tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+    if offsets is None:
+        offsets = settings.LIBRARY_REMINDER_OFFSETS
+    # Retries keep the original date, so that they send the same reminders
+    today = datetime.date.fromisoformat(today) if today is not None else datetime.date.today()
+    failed = 0
+    for offset in offsets:
+        stats = send_due_date_reminders(offset, today=today)
+        failed += stats['failed']
+        logger.info('Sent {0:+d} day due date reminders to {1} member{2}, {3} failed.'.format(
+            offset, stats['sent'], '' if stats['sent'] == 1 else 's', stats['failed']
+        ))
+    if failed:
+        raise self.retry(
+            kwargs={'offsets': offsets, 'today': today.isoformat()},
+            countdown=settings.EMAIL_RETRY_BACKOFF * 2 ** self.request.retries
+        )
 
-    # Find all members with items due tomorrow.
-    due_tomorrow = BorrowRecord.objects.filter(
-        due_date=tomorrow,
-        date_returned__isnull=True,
-    )
-    if len(due_tomorrow) == 0:
-        # No items due, we can stop
-        logger.info('No items due, sending no reminders')
-        return False
 
-    members_with_items = {}
-
-    for record in due_tomorrow:
-        if members_with_items.get(record.borrowing_member, None) is None:
-            members_with_items[record.borrowing_member] = []
-        members_with_items[record.borrowing_member].append(record)
-
-    for member in members_with_items:
-        email_subject = 'Unigames - Items Due Tomorrow'
-        context = {
-            'member': member,
-            'due_date': tomorrow,
-            'record_list': members_with_items[member]
-        }
-        body, html_body = compose_html_email('library/email_reminder_tomorrow.html', context)
-        email_address = member.email_address
-        send_single_email_task.delay(email_address, email_subject, body, html_message=html_body)
-    number_of_emails = len(members_with_items)
-    logger.info(
-        'Sent "due-tomorrow" reminders to {0} member{1}.'.format(number_of_emails, "" if number_of_emails == 1 else "s")
-    )
-    return
+@shared_task(name="send_due_date_tomorrow_reminder_task")
+def send_due_date_tomorrow_reminder_task():
+    """
+        Scheduled task.
+        Sends a reminder to all borrowers of items due the next day.
+        Kept for existing schedules, send_due_date_reminders_task covers it.
+    """
+    send_due_date_reminders_task.delay(offsets=[-1])
 
 
 @shared_task(name="send_due_date_today_reminder_task")
@@ -57,39 +52,43 @@ def send_due_date_today_reminder_task():
     """
         Scheduled task.
         Sends a reminder to all borrowers of items due today.
-        Intended to be run every day.
+        Kept for existing schedules, send_due_date_reminders_task covers it.
     """
-    today = datetime.date.today()
-
-    # Find all members with items due tomorrow.
-    due_today = BorrowRecord.objects.filter(
-        due_date=today,
-        date_returned__isnull=True,
-    )
-    if len(due_today) == 0:
-        # No items due, we can stop
-        logger.info('No items due, sending no reminders')
-        return False
-
-    members_with_items = {}
+    send_due_date_reminders_task.delay(offsets=[0])
 
-    for record in due_today:
-        if members_with_items.get(record.borrowing_member, None) is None:
-            members_with_items[record.borrowing_member] = []
-        members_with_items[record.borrowing_member].append(record)
 
-    for member in members_with_items:
-        email_subject = 'Unigames - Items Due Today'
-        context = {
-            'member': member,
-            'due_date': today,
-            'record_list': members_with_items[member]
-        }
-        body, html_body = compose_html_email('library/email_reminder_today.html', context)
-        email_address = member.email_address
-        send_single_email_task.delay(email_address, email_subject, body, html_message=html_body)
-    number_of_emails = len(members_with_items)
+@shared_task(name="recompute_pending_tags_task")
+def recompute_pending_tags_task():
+    """
+        Recomputes the tags of all items and tags marked as pending.
+        Scheduled after saves when LIBRARY_DEFER_TAG_COMPUTATION is set,
+        but can also be run periodically to catch anything that was missed.
+        Returns the queue depth and lag (in seconds) from before the run.
+    """
+    status = PendingTagComputation.get_queue_status()
+    if status['depth'] == 0:
+        logger.info('No pending tag computations.')
+        return {'depth': 0, 'lag': 0}
+    item_stats, tag_stats = PendingTagComputation.recompute_pending()
+    lag = status['lag'].total_seconds()
     logger.info(
-        'Sent "due-today" reminders to {0} member{1}.'.format(number_of_emails, "" if number_of_emails == 1 else "s")
+        'Processed {0} pending tag computation{1} (oldest waited {2:.1f}s). '
+        'Recomputed {3} items in {4:.2f}s.'.format(
+            status['depth'], '' if status['depth'] == 1 else 's', lag,
+            item_stats['items'] + tag_stats['items'], item_stats['seconds'] + tag_stats['seconds']
+        )
     )
-    return
+    return {'depth': status['depth'], 'lag': lag}
+
+
+@shared_task(name="refresh_item_availability_task")
+def refresh_item_availability_task():
+    """
+        Scheduled task.
+        Refreshes the availability snapshots of every item, as they depend on the current date.
+        Intended to be run every day, just after midnight.
+    """
+    number_of_items = ItemAvailability.refresh()
+    logger.info('Refreshed the availability of {0} item{1}.'.format(
+        number_of_items, '' if number_of_items == 1 else 's'
+    ))
@@ -1,7 +1,22 @@
-from django.test import TestCase
-from .models import Item, BorrowRecord, ExternalBorrowingForm
-from members.models import Member
-from django.utils import timezone
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.cache import cache, caches
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.urls import reverse
+from .models import Item, BorrowRecord, ExternalBorrowingForm, TagParent, TagClosure, PendingTagComputation, \
+    ItemAvailability, SentReminder, TagUsage
+from .tasks import recompute_pending_tags_task
+from .reminders import send_due_date_reminders
+from .search import PostgresSearchBackend, SQLiteSearchBackend
+from taggit.models import Tag
+from members.models import Member, Membership
+from phylactery.tasks import send_templated_email_task
+from django.contrib.auth.models import User
+from django.utils import timezone, dateformat
+from unittest import skipUnless, mock
+import json
 import datetime
 from freezegun import freeze_time
 
@@ -109,9 +124,181 @@ def create_ext_borrow_record(
     return form
 
 
+def create_tag_parents(child_name, parent_names):
+    child_tag = Tag.objects.get_or_create(name=child_name)[0]
+    tag_parent = TagParent.objects.get_or_create(child_tag=child_tag)[0]
+    tag_parent.parent_tag.set([Tag.objects.get_or_create(name=name)[0] for name in parent_names])
+    tag_parent.save()
+    return tag_parent
+
+
+def get_computed_tag_names(item):
+    return set(item.get_computed_tags.all().values_list('name', flat=True))
+
+
+class TagHierarchyTests(TestCase):
+
+    def test_hierarchical_tags_on_item_save(self):
+        create_tag_parents('D&D 5e', ['D&D'])
+        create_tag_parents('D&D', ['Roleplaying'])
+        dnd = create_item()
+        dnd.get_base_tags.add('D&D 5e')
+        dnd.save()
+        self.assertEqual(get_computed_tag_names(dnd), {'D&D 5e', 'D&D', 'Roleplaying'})
+
+    def test_closure_updates_when_parents_change(self):
+        create_tag_parents('D&D 5e', ['D&D'])
+        dnd_parents = create_tag_parents('D&D', ['Roleplaying'])
+        dnd = create_item()
+        dnd.get_base_tags.add('D&D 5e')
+        dnd.save()
+
+        dnd_parents.parent_tag.set([Tag.objects.get_or_create(name='Fantasy')[0]])
+        dnd_parents.save()
+        self.assertEqual(get_computed_tag_names(dnd), {'D&D 5e', 'D&D', 'Fantasy'})
+        self.assertFalse(TagClosure.objects.filter(ancestor__name='Roleplaying').exists())
+
+        Tag.objects.get(name='D&D').delete()
+        self.assertFalse(TagClosure.objects.filter(descendant__name='D&D 5e', ancestor__name='Fantasy').exists())
+
+    def test_closure_handles_cycles(self):
+        create_tag_parents('A', ['B'])
+        create_tag_parents('B', ['A'])
+        pairs = set(TagClosure.objects.values_list('descendant__name', 'ancestor__name'))
+        self.assertEqual(pairs, {('A', 'B'), ('B', 'A')})
+
+    def test_rebuild_matches_incremental(self):
+        create_tag_parents('D&D 5e', ['D&D', 'Books'])
+        create_tag_parents('D&D', ['Roleplaying'])
+        before = set(TagClosure.objects.values_list('descendant', 'ancestor'))
+        TagClosure.objects.all().delete()
+        self.assertEqual(TagClosure.refresh(), (len(before), 0))
+        self.assertEqual(set(TagClosure.objects.values_list('descendant', 'ancestor')), before)
+
+    def test_incremental_refresh_matches_rebuild(self):
+        create_tag_parents('D&D 5e', ['D&D', 'Books'])
+        create_tag_parents('D&D', ['Roleplaying'])
+        create_tag_parents('Roleplaying', ['Games'])
+        create_tag_parents('Books', ['Games', 'D&D 5e'])
+        create_tag_parents('Pathfinder', ['Roleplaying'])
+        create_tag_parents('D&D', ['Roleplaying', 'Fantasy'])
+        create_tag_parents('Roleplaying', ['Tabletop'])
+        incremental = set(TagClosure.objects.values_list('descendant', 'ancestor'))
+        TagClosure.refresh()
+        self.assertEqual(set(TagClosure.objects.values_list('descendant', 'ancestor')), incremental)
+
+    def test_saving_an_item_only_loads_its_own_tags(self):
+        create_tag_parents('D&D 5e', ['D&D'])
+        create_tag_parents('Pathfinder', ['Roleplaying'])
+        dnd = create_item()
+        dnd.get_base_tags.add('D&D 5e')
+        dnd.save()
+        with mock.patch.object(TagClosure, 'get_parent_graph', wraps=TagClosure.get_parent_graph) as get_parent_graph:
+            dnd.save()
+        get_parent_graph.assert_not_called()
+        dnd.get_base_tags.add('Pathfinder')
+        with mock.patch.object(TagClosure, 'get_parent_graph', wraps=TagClosure.get_parent_graph) as get_parent_graph:
+            dnd.save()
+        self.assertEqual([call.args for call in get_parent_graph.call_args_list], [({
+            Tag.objects.get(name='Item: D&D 5e PHB').pk
+        },)])
+        self.assertEqual(get_computed_tag_names(dnd), {'D&D 5e', 'D&D', 'Pathfinder', 'Roleplaying'})
+
+    def test_bulk_compute_tags_matches_compute_tags(self):
+        create_tag_parents('D&D 5e', ['D&D'])
+        create_tag_parents('D&D', ['Roleplaying'])
+        phb = create_item()
+        phb.get_base_tags.add('D&D 5e')
+        phb.save()
+        dmg = create_item(name="D&D 5e DMG")
+        dmg.get_base_tags.add('Item: D&D 5e PHB')
+        dmg.save()
+
+        create_tag_parents('Roleplaying', ['Games'])
+        self.assertEqual(get_computed_tag_names(phb), {'D&D 5e', 'D&D', 'Roleplaying', 'Games'})
+        self.assertIn('Games', get_computed_tag_names(dmg))
+
+        expected = {item.pk: get_computed_tag_names(item) for item in Item.objects.all()}
+        stats = Item.bulk_compute_tags(Item.objects.all())
+        self.assertEqual(stats['items'], 2)
+        self.assertEqual(stats['added'], 0)
+        self.assertEqual(stats['removed'], 0)
+        self.assertEqual({item.pk: get_computed_tag_names(item) for item in Item.objects.all()}, expected)
+
+    def test_bulk_compute_tags_query_count(self):
+        # The number of queries shouldn't depend on the number of items
+        create_tag_parents('D&D 5e', ['D&D'])
+        for number in range(10):
+            item = create_item(name='Item {0}'.format(number))
+            item.get_base_tags.add('D&D 5e')
+            item.save()
+        create_tag_parents('D&D', ['Roleplaying'])
+        with CaptureQueriesContext(connection) as few_items:
+            Item.bulk_compute_tags(Item.objects.filter(name__in=['Item 0', 'Item 1']))
+        with CaptureQueriesContext(connection) as many_items:
+            stats = Item.bulk_compute_tags(Item.objects.all())
+        self.assertEqual(stats['items'], 10)
+        self.assertEqual(len(few_items), len(many_items))
+
+    @override_settings(LIBRARY_DEFER_TAG_COMPUTATION=True)
+    def test_deferred_tag_computation(self):
+        create_tag_parents('D&D 5e', ['D&D'])
+        phb = create_item()
+        phb.get_base_tags.add('D&D 5e')
+        phb.save()
+        phb.save()
+        create_tag_parents('D&D', ['Roleplaying'])
+        create_tag_parents('D&D', ['Roleplaying', 'Fantasy'])
+        self.assertEqual(get_computed_tag_names(phb), set())
+        self.assertEqual(PendingTagComputation.get_queue_status()['depth'], 3)
+
+        result = recompute_pending_tags_task()
+        self.assertEqual(result['depth'], 3)
+        self.assertEqual(get_computed_tag_names(phb), {'D&D 5e', 'D&D', 'Roleplaying', 'Fantasy'})
+        self.assertEqual(PendingTagComputation.get_queue_status(), {'depth': 0, 'lag': None})
+
+    def test_tag_usage_counts(self):
+        def get_counts():
+            return dict(TagUsage.objects.filter(num_items__gt=0).values_list('tag__name', 'num_items'))
+
+        create_tag_parents('D&D 5e', ['D&D'])
+        phb = create_item()
+        phb.get_base_tags.add('D&D 5e')
+        phb.save()
+        dmg = create_item(name='D&D 5e DMG')
+        dmg.get_base_tags.add('D&D 5e')
+        dmg.save()
+        self.assertEqual(get_counts(), {'D&D 5e': 2, 'D&D': 2})
+        self.assertTrue(TagUsage.objects.get(tag__name='Item: D&D 5e PHB').is_item_tag)
+
+        # Through the bulk recomputation, which doesn't send m2m_changed
+        create_tag_parents('D&D', ['Roleplaying'])
+        self.assertEqual(get_counts(), {'D&D 5e': 2, 'D&D': 2, 'Roleplaying': 2})
+        dmg.get_base_tags.clear()
+        Item.bulk_compute_tags(Item.objects.filter(pk=dmg.pk))
+        self.assertEqual(get_counts(), {'D&D 5e': 1, 'D&D': 1, 'Roleplaying': 1})
+        phb.delete()
+        self.assertEqual(get_counts(), {})
+        self.assertEqual(TagUsage.refresh(), Tag.objects.count())
+        self.assertEqual(get_counts(), {})
+
+        response = self.client.get(reverse('library:all-tags'))
+        self.assertEqual(
+            [tag.name for tag in response.context['tags_list']], ['D&D', 'D&D 5e', 'Roleplaying']
+        )
+
 
 class LibraryModelTests(TestCase):
 
+    def test_search_vector_is_not_loaded(self):
+        dnd = create_item()
+        self.assertNotIn('search_vector', str(Item.objects.all().query))
+        dnd = Item.objects.get(pk=dnd.pk)
+        dnd.description = 'Changed'
+        with CaptureQueriesContext(connection) as queries:
+            dnd.save()
+        self.assertNotIn('"search_vector" = ', queries[0]['sql'])
+
     def test_availability_info(self):
         member1 = create_member()
         dnd = create_item()
@@ -160,3 +347,602 @@ class LibraryModelTests(TestCase):
             self.assertEqual(info['in_clubroom'], True)
             self.assertEqual(info['is_available'], False)
             self.assertEqual(info['expected_availability_date'], datetime.date(2020, 10, 8))
+
+
+class BulkAvailabilityTests(TestCase):
+
+    def assertAvailabilityMatches(self, items):
+        bulk_info = Item.get_bulk_availability_info(items)
+        for item in items:
+            self.assertEqual(bulk_info[item.pk], item.get_availability_info(), item.name)
+
+    def test_bulk_availability_matches_per_item(self):
+        member1 = create_member()
+        borrowed = create_item(name='Borrowed')
+        create_borrow_record(member1, borrowed, member1,
+                             date_borrowed=datetime.date(2020, 9, 30), due_date=datetime.date(2020, 10, 3))
+        chained = create_item(name='Chained')
+        create_ext_borrow_record(
+            [chained], auth_gatekeeper_borrow=member1, auth_gatekeeper_return=member1,
+            requested_borrow_date=datetime.date(2020, 10, 2), due_date=datetime.date(2020, 10, 5),
+            date_borrowed=None, date_returned=None, form_status='A'
+        )
+        create_ext_borrow_record(
+            [chained], auth_gatekeeper_borrow=member1, auth_gatekeeper_return=member1,
+            requested_borrow_date=datetime.date(2020, 10, 6), due_date=datetime.date(2020, 10, 8),
+            date_borrowed=None, date_returned=None, form_status='A'
+        )
+        reserved = create_item(name='Reserved Later')
+        create_ext_borrow_record(
+            [reserved], auth_gatekeeper_borrow=member1, auth_gatekeeper_return=member1,
+            requested_borrow_date=datetime.date(2020, 10, 9), due_date=datetime.date(2020, 10, 10),
+            date_borrowed=None, date_returned=None, form_status='A'
+        )
+        unapproved = create_item(name='Unapproved')
+        create_ext_borrow_record(
+            [unapproved], auth_gatekeeper_borrow=member1, auth_gatekeeper_return=member1,
+            requested_borrow_date=datetime.date(2020, 10, 2), due_date=datetime.date(2020, 10, 5),
+            date_borrowed=None, date_returned=None, form_status='U'
+        )
+        high_demand = create_item(name='High Demand')
+        high_demand.high_demand = True
+        high_demand.save()
+        not_borrowable = create_item(name='Not Borrowable')
+        not_borrowable.is_borrowable = False
+        not_borrowable.save()
+
+        items = list(Item.objects.all())
+        for date in ['1st October 2020', '2nd October 2020', '3rd October 2020', '6th October 2020']:
+            with freeze_time(date):
+                self.assertAvailabilityMatches(items)
+
+    def test_with_availability_query_count(self):
+        member1 = create_member()
+        for number in range(5):
+            item = create_item(name='Item {0}'.format(number))
+            create_borrow_record(member1, item, member1)
+        ItemAvailability.objects.all().delete()
+        with self.assertNumQueries(5):
+            # Items, snapshots, the two borrow record queries, then saving the new snapshots
+            items = list(Item.objects.with_availability())
+            for item in items:
+                self.assertFalse(item.availability['is_available'])
+        with self.assertNumQueries(2):
+            # Now only the items and their snapshots
+            items = list(Item.objects.with_availability())
+            for item in items:
+                self.assertFalse(item.availability['is_available'])
+
+
+class AvailabilitySnapshotTests(TestCase):
+
+    def test_snapshot_follows_borrowing(self):
+        member1 = create_member()
+        dnd = create_item()
+        with freeze_time('1st October 2020'):
+            self.assertTrue(dnd.availability['is_available'])
+            record = create_borrow_record(member1, dnd, member1,
+                                          date_borrowed=datetime.date(2020, 9, 30),
+                                          due_date=datetime.date(2020, 10, 3))
+            snapshot = ItemAvailability.objects.get(item=dnd)
+            self.assertFalse(snapshot.is_available)
+            self.assertEqual(snapshot.expected_availability_date, datetime.date(2020, 10, 3))
+
+            record.date_returned = datetime.date(2020, 10, 1)
+            record.save()
+            self.assertTrue(Item.objects.get(pk=dnd.pk).availability['is_available'])
+
+            form = create_ext_borrow_record(
+                [dnd], auth_gatekeeper_borrow=member1, auth_gatekeeper_return=member1,
+                requested_borrow_date=datetime.date(2020, 10, 2), due_date=datetime.date(2020, 10, 5),
+                date_borrowed=None, date_returned=None, form_status='U'
+            )
+            self.assertTrue(Item.objects.get(pk=dnd.pk).availability['is_available'])
+            form.form_status = 'A'
+            form.save()
+            self.assertEqual(Item.objects.get(pk=dnd.pk).availability, dnd.get_availability_info())
+            self.assertFalse(dnd.get_availability_info()['is_available'])
+
+    def test_deleting_borrowed_item(self):
+        member = create_member()
+        dnd = create_item()
+        create_borrow_record(member, dnd, member)
+        create_ext_borrow_record([dnd], auth_gatekeeper_borrow=member, auth_gatekeeper_return=member)
+        with self.captureOnCommitCallbacks(execute=True):
+            dnd.delete()
+        self.assertFalse(Item.objects.filter(pk=dnd.pk).exists())
+        self.assertFalse(ItemAvailability.objects.filter(item=dnd.pk).exists())
+
+    def test_deleting_record_refreshes_snapshot(self):
+        member = create_member()
+        dnd = create_item()
+        record = create_borrow_record(member, dnd, member)
+        self.assertFalse(ItemAvailability.objects.get(item=dnd).is_available)
+        with self.captureOnCommitCallbacks(execute=True):
+            record.delete()
+        self.assertTrue(ItemAvailability.objects.get(item=dnd).is_available)
+
+    def test_stale_snapshot_is_recomputed(self):
+        dnd = create_item()
+        with freeze_time('1st October 2020'):
+            ItemAvailability.refresh()
+        with freeze_time('2nd October 2020'):
+            self.assertEqual(Item.objects.get(pk=dnd.pk).availability['max_due_date'], datetime.date(2020, 10, 16))
+            self.assertEqual(ItemAvailability.objects.get(item=dnd).computed_on, datetime.date(2020, 10, 2))
+
+
+@override_settings(AUTOCOMPLETE_MAX_RESULTS=3)
+class AutocompleteTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for name in ['Catan', 'Catan: Seafarers', 'Catan: Cities & Knights', 'Catan: Traders', 'Carcassonne']:
+            create_item(name=name)
+
+    def get_result_names(self, q):
+        response = self.client.get(reverse('library:item-autocomplete'), {'q': q})
+        return [result['text'] for result in response.json()['results']]
+
+    def test_results_are_capped(self):
+        self.assertEqual(self.get_result_names('catan'), ['Catan', 'Catan: Cities & Knights', 'Catan: Seafarers'])
+        self.assertEqual(self.get_result_names('carc'), ['Carcassonne'])
+
+    def test_recent_searches_are_cached(self):
+        names = self.get_result_names('catan')
+        Item.objects.filter(name='Catan').update(name='Settlers of Catan')
+        # The cached results are fetched again by primary key, so they are up to date but not searched again
+        with CaptureQueriesContext(connection) as queries:
+            cached_names = self.get_result_names('  Catan ')
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(cached_names, ['Settlers of Catan'] + names[1:])
+        cache.clear()
+        self.assertEqual(
+            self.get_result_names('catan'), ['Catan: Cities & Knights', 'Catan: Seafarers', 'Catan: Traders']
+        )
+
+
+    def test_restricted_visitors_dont_affect_cached_results(self):
+        Tag.objects.create(name='RevB')
+        # Anonymous visitors can't search tags, but that mustn't be cached as an empty result for everyone
+        response = self.client.get(reverse('library:select2_taggit'), {'q': 'revb'})
+        self.assertEqual(response.json()['results'], [])
+        user = User.objects.create_user('gatekeeper', 'gatekeeper@example.com', 'password')
+        self.client.force_login(user)
+        response = self.client.get(reverse('library:select2_taggit'), {'q': 'revb'})
+        self.assertEqual([result['text'] for result in response.json()['results']], ['RevB'])
+        # Nor can the cached results be seen by anonymous visitors
+        self.client.logout()
+        response = self.client.get(reverse('library:select2_taggit'), {'q': 'revb'})
+        self.assertEqual(response.json()['results'], [])
+
+
+class SearchBackendTestsMixin:
+    """
+        The relevance tests that every search backend has to pass.
+        Subclasses set backend_class, and are skipped on databases the backend doesn't support.
+    """
+    backend_class = None
+
+    def setUp(self):
+        self.backend = self.backend_class()
+        create_tag_parents('Wargame', ['Strategy'])
+        for name, description, tag in [
+            ('Dragon Quest', 'A card game about treasure.', None),
+            ('Dungeon Crawl', 'Fight the dragons hiding in the dungeon.', None),
+            ('Tank Battle', 'Tanks.', 'Wargame'),
+        ]:
+            item = create_item(name=name)
+            item.description = description
+            if tag:
+                item.get_base_tags.add(tag)
+            item.save()
+
+    def search(self, query):
+        return [item.name for item in self.backend.search(query)]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('dragon'), ['Dragon Quest', 'Dungeon Crawl'])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.search('dragon dungeon'), ['Dungeon Crawl'])
+
+    def test_computed_tags_are_searched(self):
+        self.assertEqual(self.search('strategy'), ['Tank Battle'])
+
+    def test_index_follows_changes(self):
+        item = Item.objects.get(name='Tank Battle')
+        item.name = 'Tank Duel'
+        item.save()
+        self.assertEqual(self.search('battle'), [])
+        self.assertEqual(self.search('duel'), ['Tank Duel'])
+
+        create_tag_parents('Wargame', ['Tactics'])
+        self.assertEqual(self.search('strategy'), [])
+        self.assertEqual(self.search('tactics'), ['Tank Duel'])
+
+        tag = Tag.objects.get(name='Wargame')
+        tag.name = 'Skirmish'
+        tag.save()
+        self.assertEqual(self.search('skirmish'), ['Tank Duel'])
+
+        item.delete()
+        self.assertEqual(self.search('duel'), [])
+
+    def test_items_are_indexed_in_batches(self):
+        item_pks = list(Item.objects.values_list('pk', flat=True))
+        with CaptureQueriesContext(connection) as one_item:
+            self.backend.update_items(item_pks[:1])
+        with CaptureQueriesContext(connection) as every_item:
+            self.backend.update_items(item_pks)
+        self.assertEqual(len(one_item), len(every_item))
+        self.assertEqual(self.search('strategy'), ['Tank Battle'])
+
+    def test_unchanged_items_are_not_reindexed(self):
+        item = Item.objects.get(name='Tank Battle')
+        with mock.patch.object(Item, 'update_search_index') as update_search_index:
+            item.notes = 'Missing a tank.'
+            item.save()
+        self.assertNotIn(mock.call([item.pk]), update_search_index.call_args_list)
+        with mock.patch.object(Item, 'update_search_index') as update_search_index:
+            item.description = 'Lots of tanks.'
+            item.save()
+        self.assertIn(mock.call([item.pk]), update_search_index.call_args_list)
+
+    def test_query_syntax_is_plain_text(self):
+        self.assertEqual(self.search('quest* -"'), ['Dragon Quest'])
+        self.assertEqual(self.search('"()'), [])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'PostgresSearchBackend needs PostgreSQL')
+class PostgresSearchBackendTests(SearchBackendTestsMixin, TestCase):
+    backend_class = PostgresSearchBackend
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLiteSearchBackend needs SQLite')
+class SQLiteSearchBackendTests(SearchBackendTestsMixin, TestCase):
+    backend_class = SQLiteSearchBackend
+
+
+class OverviewTests(TestCase):
+    # The most queries the overview page may make, however many records there are
+    QUERY_BUDGET = 8
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('librarian', 'librarian@example.com', 'password')
+        self.client.force_login(self.user)
+
+    def create_records(self, count):
+        for number in range(Member.objects.count(), Member.objects.count() + count):
+            member = create_member(
+                first_name='Member', last_name=str(number), email_address='member{0}@example.com'.format(number)
+            )
+            item = create_item(name='Overview Item {0}'.format(number))
+            create_borrow_record(member, item, member, date_borrowed=-20, due_date=-6)
+            create_borrow_record(member, item, member, date_borrowed=-3, due_date=10)
+            create_borrow_record(member, item, member, date_borrowed=-5, due_date=1, date_returned=-1,
+                                 auth_gatekeeper_return=member)
+            for status in 'UAC':
+                create_ext_borrow_record([item], form_status=status, auth_gatekeeper_borrow=member,
+                                         auth_gatekeeper_return=member)
+
+    def get_overview(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('library:overview'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_budget(self):
+        # The first request also caches the current Site
+        self.get_overview()
+        self.create_records(2)
+        response, few_queries = self.get_overview()
+        self.assertEqual(len(response.context['overdue']), 2)
+        self.assertEqual(len(response.context['needing_return']), 2)
+        self.assertEqual(len(response.context['members_borrowing']), 2)
+        self.assertEqual(response.context['members_borrowing'][0].num_borrowed, 2)
+
+        self.create_records(10)
+        response, many_queries = self.get_overview()
+        self.assertEqual(len(response.context['currently_borrowed']), 24)
+        self.assertEqual(len(response.context['unapproved_borrow_requests']), 12)
+        self.assertEqual(few_queries, many_queries)
+        self.assertLessEqual(many_queries, self.QUERY_BUDGET)
+
+    def test_verify_returns(self):
+        self.create_records(2)
+        record = BorrowRecord.objects.exclude(date_returned=None).first()
+        response = self.client.post(
+            reverse('library:overview'), {'form_type': 'return_items', 'return_{0}'.format(record.pk): 'on'}
+        )
+        self.assertTrue(BorrowRecord.objects.get(pk=record.pk).verified_returned)
+        self.assertEqual(len(response.context['needing_return']), 1)
+
+
+class HomeFragmentTests(TestCase):
+    def setUp(self):
+        caches['fragments'].clear()
+        for number in range(3):
+            create_item(name='Book {0}'.format(number), type='BK')
+        create_item(name='Board Game', type='BG')
+        # The featured items are shown with their images, but the files don't need to exist
+        Item.objects.update(image='test.png')
+        with self.captureOnCommitCallbacks(execute=True):
+            Item.objects.get(name='Book 1').base_tags.base_tags.add('Featured')
+
+    def get_home(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_library_home_is_cached(self):
+        response, first_queries = self.get_home(reverse('library:library-home'))
+        self.assertEqual([item.name for item in response.context['object_list']], ['Book 1'])
+        self.assertEqual(response.context['number_of_books'], 3)
+        self.assertEqual(response.context['number_of_boardgames'], 1)
+        self.assertEqual(response.context['number_of_cardgames'], 0)
+        response, second_queries = self.get_home(reverse('library:library-home'))
+        self.assertEqual(response.context['number_of_books'], 3)
+        self.assertLess(second_queries, first_queries)
+
+    def test_saving_invalidates_the_cache(self):
+        self.get_home(reverse('library:library-home'))
+        with self.captureOnCommitCallbacks(execute=True):
+            create_item(name='Card Game', type='CG')
+            Item.objects.filter(name='Book 2').update(image='test.png')
+            Item.objects.get(name='Book 2').base_tags.base_tags.add('Featured')
+        response, queries = self.get_home(reverse('library:library-home'))
+        self.assertEqual(response.context['number_of_cardgames'], 1)
+        self.assertEqual([item.name for item in response.context['object_list']], ['Book 1', 'Book 2'])
+
+    def test_home_shows_scheduled_posts_once_published(self):
+        from blog.models import BlogPost
+        with self.captureOnCommitCallbacks(execute=True):
+            BlogPost.objects.create(
+                title='Published', slug_title='published', short_description='', author='Someone',
+                publish_on=timezone.now() - datetime.timedelta(days=1)
+            )
+            BlogPost.objects.create(
+                title='Scheduled', slug_title='scheduled', short_description='', author='Someone',
+                publish_on=timezone.now() + datetime.timedelta(hours=1)
+            )
+        response, first_queries = self.get_home(reverse('home'))
+        self.assertEqual([post.title for post in response.context['recent_blogposts']], ['Published'])
+        self.assertEqual([item.name for item in response.context['featured_items']], ['Book 1'])
+        response, second_queries = self.get_home(reverse('home'))
+        self.assertLess(second_queries, first_queries)
+        with freeze_time(timezone.now() + datetime.timedelta(hours=2)):
+            response, queries = self.get_home(reverse('home'))
+        self.assertEqual([post.title for post in response.context['recent_blogposts']], ['Scheduled', 'Published'])
+
+
+class BorrowReceiptTests(TestCase):
+
+    def test_receipt_is_composed_by_the_task(self):
+        gatekeeper = User.objects.create_superuser('gatekeeper', 'gatekeeper@example.com', 'password')
+        Member.objects.create(first_name='Gate', last_name='Keeper', email_address='gatekeeper@example.com',
+                              user=gatekeeper)
+        member = create_member()
+        Membership.objects.create(member=member, guild_member=False, amount_paid=5)
+        item = create_item()
+        self.client.force_login(gatekeeper)
+        due_date = datetime.date.today() + datetime.timedelta(days=7)
+        with mock.patch.object(send_templated_email_task, 'delay') as delay, \
+                mock.patch('phylactery.tasks.compose_html_email') as compose_html_email, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('library:borrow-3'), {
+                'member': member.pk, 'address': '123 Blah Street', 'phone_number': '0123456789',
+                'form-TOTAL_FORMS': 1, 'form-INITIAL_FORMS': 0,
+                'form-0-item': item.pk, 'form-0-due_date': due_date.isoformat(),
+            })
+        self.assertEqual(response.status_code, 200)
+        compose_html_email.assert_not_called()
+
+        # The task gets everything it needs through the broker
+        email_address, subject, template_name, context = json.loads(json.dumps(delay.call_args.args))
+        send_templated_email_task(email_address, subject, template_name, context, **delay.call_args.kwargs)
+        self.assertEqual(mail.outbox[0].to, [member.email_address])
+        self.assertIn('Hi there {0}'.format(member.preferred_name), mail.outbox[0].body)
+        self.assertIn(dateformat.format(due_date, 'l jS F Y'), mail.outbox[0].body)
+
+
+class ReminderTests(TestCase):
+
+    def setUp(self):
+        self.members = [
+            create_member(
+                first_name='Member', last_name=str(number), email_address='member{0}@example.com'.format(number)
+            )
+            for number in range(3)
+        ]
+
+    def borrow(self, member, due_date, **kwargs):
+        item = create_item(name='Reminder Item {0}'.format(Item.objects.count()))
+        return create_borrow_record(member, item, member, date_borrowed=-7, due_date=due_date, **kwargs)
+
+    def test_reminders(self):
+        first, second, third = self.members
+        self.borrow(first, 1)
+        self.borrow(first, 1)
+        self.borrow(second, 1)
+        self.borrow(third, 1, date_returned=0)
+        self.borrow(third, 0)
+        self.borrow(third, -3)
+
+        # The first reminder also caches the current Site
+        send_due_date_reminders(0)
+        self.assertEqual([message.subject for message in mail.outbox], ['Unigames - Items Due Today'])
+        with self.assertNumQueries(2):
+            self.assertEqual(send_due_date_reminders(-1), {'sent': 2, 'failed': 0})
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox[1:]), [first.email_address, second.email_address]
+        )
+        first_email = [message for message in mail.outbox if message.to == [first.email_address]][0]
+        self.assertEqual(first_email.body.count('Reminder Item'), 2)
+        self.assertIn('due back tomorrow', first_email.body)
+
+        send_due_date_reminders(3)
+        self.assertEqual(mail.outbox[-1].to, [third.email_address])
+        self.assertIn('due back 3 days ago', mail.outbox[-1].body)
+
+        # Reminders that were already sent aren't sent again
+        mail.outbox = []
+        self.assertEqual(send_due_date_reminders(-1), {'sent': 0, 'failed': 0})
+        self.assertEqual(mail.outbox, [])
+
+    def test_failed_reminders_are_resent(self):
+        for member in self.members:
+            self.borrow(member, 0)
+        failing_address = self.members[1].email_address
+
+        def send_messages(backend, messages):
+            if messages[0].to == [failing_address]:
+                raise ConnectionError
+            return real_send_messages(backend, messages)
+        real_send_messages = EmailBackend.send_messages
+
+        with mock.patch.object(EmailBackend, 'send_messages', send_messages):
+            self.assertEqual(send_due_date_reminders(0), {'sent': 2, 'failed': 1})
+        self.assertEqual(SentReminder.objects.count(), 2)
+        self.assertEqual(send_due_date_reminders(0), {'sent': 1, 'failed': 0})
+        self.assertEqual([message.to for message in mail.outbox][-1], [failing_address])
+        self.assertEqual(SentReminder.objects.count(), 3)
+
+
+class ItemAPITests(TestCase):
+    def setUp(self):
+        self.items = [create_item(name='API Item {0}'.format(number)) for number in range(5)]
+        member = create_member()
+        create_borrow_record(member, self.items[0], member)
+
+    def test_all_items_are_paginated(self):
+        url = reverse('api-library:all') + '?page_size=2&expand=availability'
+        names = []
+        query_counts = []
+        while url is not None:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            names += [item['name'] for item in page['results']]
+            query_counts.append(len(queries))
+            url = page['next']
+        self.assertEqual(names, [item.name for item in self.items])
+        # Availability is computed for each page at once, so every page takes the same number of queries
+        self.assertEqual(len(set(query_counts[:-1])), 1)
+
+    def test_all_items_without_pagination(self):
+        # Without ?page_size= or ?cursor=, the response is still a plain list of every item
+        response = self.client.get(reverse('api-library:all') + '?expand=availability')
+        items = response.json()
+        self.assertEqual([item['name'] for item in items], [item.name for item in self.items])
+        self.assertFalse(items[0]['availability']['is_available'])
+
+    @override_settings(LIBRARY_API_STREAM_CHUNK_SIZE=2)
+    def test_all_items_can_be_streamed(self):
+        response = self.client.get(reverse('api-library:all') + '?stream=true&expand=availability')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        with mock.patch.object(
+                ItemAvailability, 'get_for_items', wraps=ItemAvailability.get_for_items) as get_for_items:
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        items = [json.loads(line) for line in lines]
+        self.assertEqual([item['name'] for item in items], [item.name for item in self.items])
+        self.assertFalse(items[0]['availability']['is_available'])
+        self.assertTrue(items[1]['availability']['is_available'])
+        # The availability is computed a chunk at a time
+        self.assertEqual(get_for_items.call_count, 3)
+
+    def test_random_items(self):
+        cache.clear()
+        board_game = create_item(name='API Board Game', type='BG')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api-library:random-boardgame'))
+        self.assertEqual(response.json()['name'], board_game.name)
+        # The pks are fetched once and cached, then the item is fetched with its availability
+        with CaptureQueriesContext(connection) as cached_queries:
+            self.client.get(reverse('api-library:random-boardgame'))
+        self.assertLess(len(cached_queries), len(queries))
+
+        response = self.client.get(reverse('api-library:random-book') + '?count=3')
+        names = [item['name'] for item in response.json()]
+        self.assertEqual(len(set(names)), 3)
+        self.assertTrue(all(name.startswith('API Item') for name in names))
+        response = self.client.get(reverse('api-library:random-any') + '?count=20')
+        self.assertEqual(len(response.json()), 6)
+        self.assertEqual(self.client.get(reverse('api-library:random-any') + '?count=none').status_code, 400)
+        self.assertEqual(self.client.get(reverse('api-library:random-cardgame')).status_code, 404)
+
+        # Saving or deleting an item refreshes the cached pks
+        with self.captureOnCommitCallbacks(execute=True):
+            card_game = create_item(name='API Card Game', type='CG')
+        self.assertEqual(self.client.get(reverse('api-library:random-cardgame')).json()['name'], card_game.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            card_game.delete()
+        self.assertEqual(self.client.get(reverse('api-library:random-cardgame')).status_code, 404)
+
+    def test_random_items_from_stale_lists(self):
+        cache.clear()
+        board_game = create_item(name='API Board Game', type='BG')
+        self.assertEqual(self.client.get(reverse('api-library:random-boardgame')).json()['name'], board_game.name)
+        # Without running the on commit callbacks, the cached lists are left stale, as in another process
+        Item.objects.filter(pk=board_game.pk).update(type='BK')
+        self.assertEqual(self.client.get(reverse('api-library:random-boardgame')).status_code, 404)
+        card_game = create_item(name='API Card Game', type='CG')
+        self.assertEqual(self.client.get(reverse('api-library:random-cardgame')).json()['name'], card_game.name)
+        card_game.delete()
+        other_card_game = create_item(name='Another Card Game', type='CG')
+        self.assertEqual(
+            self.client.get(reverse('api-library:random-cardgame')).json()['name'], other_card_game.name
+        )
+
+    def test_unchanged_polls_are_not_modified(self):
+        Item.objects.update(image='test.png')
+        for url in (reverse('api-library:all'), reverse('library:list')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            # Only the catalogue version is read
+            self.assertEqual(len(queries), 1)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                member = Member.objects.first()
+                create_borrow_record(member, self.items[1], member)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_etags_differ_between_queries_and_vary_on_cookie(self):
+        url = reverse('api-library:all')
+        response = self.client.get(url + '?page_size=2')
+        etag = response['ETag']
+        self.assertIn('Cookie', response['Vary'])
+        # Another page of the same URL doesn't match the first page's ETag
+        response = self.client.get(url + '?page_size=3', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        response = self.client.get(url + '?page_size=2', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_field_selection(self):
+        response = self.client.get(reverse('api-library:all'))
+        item = response.json()[0]
+        self.assertIn('description', item)
+        self.assertNotIn('availability', item)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api-library:all') + '?fields=name,url')
+        self.assertEqual(response.json()[0], {'name': self.items[0].name, 'url': self.items[0].url})
+        items_query = [query['sql'] for query in queries if 'FROM "library_item"' in query['sql']][0]
+        self.assertNotIn('description', items_query)
+        self.assertEqual(
+            [query['sql'] for query in queries if 'availability' in query['sql']], []
+        )
+
+        response = self.client.get(reverse('api-library:random-book') + '?fields=name&expand=availability')
+        self.assertEqual(set(response.json()), {'name', 'availability'})
+        self.assertEqual(self.client.get(reverse('api-library:all') + '?fields=notes').status_code, 400)
+        self.assertEqual(self.client.get(reverse('api-library:all') + '?expand=name').status_code, 400)
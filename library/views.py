@@ -1,5 +1,4 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
 from .models import Item, BorrowRecord, ExternalBorrowingForm, TagParent, \
     BOOK, BOARD_GAME, CARD_GAME, OTHER
 from members.models import switch_to_proxy
@@ -14,10 +13,16 @@ from dal import autocomplete
 from taggit.models import Tag
 from django.db.models import F, Q, Count
 from django.contrib import messages
+from django.utils.decorators import method_decorator
 from members.decorators import gatekeeper_required
 import datetime
 from django.core.exceptions import ObjectDoesNotExist
-from phylactery.tasks import compose_html_email, send_single_email_task
+from phylactery.tasks import send_templated_email
+from phylactery.autocomplete import TrigramAutocompleteMixin
+from phylactery.fragments import get_fragment
+from .search import get_search_backend
+from .overview import LibraryOverview
+from .conditional import catalogue_condition
 import random
 
 # Create your views here.
@@ -30,18 +35,25 @@ class LibraryHomeView(generic.ListView):
     featured_tag_name = 'Featured'
 
     def get_queryset(self):
-        return Item.objects.filter(
-            Q(base_tags__base_tags__name__in=[self.featured_tag_name])
-        ).distinct().order_by('name')
+        return get_fragment(
+            'featured_items:{0}'.format(self.featured_tag_name),
+            lambda: list(Item.objects.featured(self.featured_tag_name))
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['number_of_books'] = Item.objects.filter(type=BOOK).count()
-        context['number_of_cardgames'] = Item.objects.filter(type=CARD_GAME).count()
-        context['number_of_boardgames'] = Item.objects.filter(type=BOARD_GAME).count()
-        context['number_of_other'] = Item.objects.filter(type=OTHER).count()
+        counts = get_fragment('library:item_counts', self.count_items)
+        context['number_of_books'] = counts.get(BOOK, 0)
+        context['number_of_cardgames'] = counts.get(CARD_GAME, 0)
+        context['number_of_boardgames'] = counts.get(BOARD_GAME, 0)
+        context['number_of_other'] = counts.get(OTHER, 0)
         return context
 
+    @staticmethod
+    def count_items():
+        # The number of items of each type, counted in one query
+        return dict(Item.objects.order_by().values_list('type').annotate(count=Count('pk')))
+
 
 class AllTagsView(generic.ListView):
     template_name = 'library/tag_list_view.html'
@@ -49,13 +61,14 @@ class AllTagsView(generic.ListView):
     model = Tag
 
     def get_queryset(self):
-        qs = Tag.objects.all() \
-            .exclude(name__startswith="Item: ") \
-            .annotate(num_items=Count('itemcomputedtags')) \
-            .order_by('-num_items', 'name')
+        # The number of items with each tag is kept up to date in TagUsage
+        qs = Tag.objects.filter(usage__is_item_tag=False) \
+            .annotate(num_items=F('usage__num_items')) \
+            .order_by('-usage__num_items', 'name')
         return qs
 
 
+@method_decorator(catalogue_condition, name='dispatch')
 class AllItemsView(generic.ListView):
     template_name = 'library/item_list_view.html'
     context_object_name = 'items_list'
@@ -63,6 +76,7 @@ class AllItemsView(generic.ListView):
     paginate_by = 24
 
 
+@method_decorator(catalogue_condition, name='dispatch')
 class AllItemsByTag(generic.ListView):
     template_name = 'library/item_list_view.html'
     context_object_name = 'items_list'
@@ -81,8 +95,8 @@ class AllItemsByTag(generic.ListView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['page_title'] = "All items with the tag {0}".format(self.tag.name)
-        context['parent_tags'] = Tag.objects.filter(children__child_tag=self.tag).exclude(name__startswith="Item:")
-        context['child_tags'] = Tag.objects.filter(parents__parent_tag=self.tag).exclude(name__startswith="Item:")
+        context['parent_tags'] = Tag.objects.filter(children__child_tag=self.tag, usage__is_item_tag=False)
+        context['child_tags'] = Tag.objects.filter(parents__parent_tag=self.tag, usage__is_item_tag=False)
 
         return context
 
@@ -94,7 +108,7 @@ class ItemDetailView(generic.DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['item_info'] = self.object.get_availability_info()
+        context['item_info'] = self.object.availability
         today = datetime.date.today()
         tomorrow = today+datetime.timedelta(days=1)
         context['today'] = (today == context['item_info']['expected_availability_date'])
@@ -102,27 +116,18 @@ class ItemDetailView(generic.DetailView):
         return context
 
 
-class TagAutocomplete(autocomplete.Select2QuerySetView):
-    def get_queryset(self):
+class TagAutocomplete(TrigramAutocompleteMixin, autocomplete.Select2QuerySetView):
+    def get_base_queryset(self):
         # Don't forget to filter out results depending on the visitor !
         if not self.request.user.is_authenticated:
             return Tag.objects.none()
-
-        qs = Tag.objects.all()
-
-        if self.q:
-            qs = qs.filter(name__istartswith=self.q)
-
-        return qs
+        return Tag.objects.all()
 
 
-class LibraryItemAutocomplete(autocomplete.Select2QuerySetView):
-    def get_queryset(self):
+class LibraryItemAutocomplete(TrigramAutocompleteMixin, autocomplete.Select2QuerySetView):
+    def get_base_queryset(self):
         # We don't care if the user is authenticated here
-        qs = Item.objects.all().order_by('name')
-        if self.q:
-            qs = qs.filter(name__icontains=self.q)
-        return qs
+        return Item.objects.all()
 
 
 class SearchView(generic.ListView):
@@ -135,18 +140,7 @@ class SearchView(generic.ListView):
         q = self.request.GET.get('q', '')
         if not q:
             return redirect('library:library-home')
-        vector = \
-            SearchVector('name', weight='A') + \
-            SearchVector('description', weight='B') + \
-            SearchVector('base_tags__base_tags__name', weight='B') + \
-            SearchVector('computed_tags__computed_tags__name', weight='B')
-        search_query = SearchQuery(q)
-        qs = Item.objects \
-            .annotate(rank=SearchRank(vector, search_query, weights=[0.5, 0.7, 0.9, 1.0])) \
-            .filter(rank__gte=0.2) \
-            .order_by('pk', 'rank') \
-            .distinct('pk')
-        return qs
+        return get_search_backend().search(q)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -192,9 +186,9 @@ def borrow_view_2(request):
             formset_data = []
             rejected_items = []
             differing_due_date = []
-            for item in received_form.cleaned_data['items']:
+            for item in received_form.cleaned_data['items'].with_availability():
                 # Make a new form for each item
-                item_info = item.get_availability_info()
+                item_info = item.availability
                 if not item_info['is_available']:
                     rejected_items.append(item.name)
                 else:
@@ -276,13 +270,7 @@ def borrow_view_3(request):
             context['gatekeeper'] = str(auth_gatekeeper_borrow)
             context['today'] = datetime.date.today()
             subject = "Unigames Borrow Receipt"
-            message, html_message = compose_html_email('library/email_borrow_receipt.html', context)
-            send_single_email_task.delay(
-                borrowing_member.email_address,
-                subject,
-                message,
-                html_message=html_message
-            )
+            send_templated_email(borrowing_member.email_address, subject, 'library/email_borrow_receipt.html', context)
             return render(request, 'library/borrow_form_success.html', context)
         else:
             return render(request, 'library/borrow_form_2.html', {'formset': formset, 'borrow_form': borrow_form})
@@ -292,77 +280,26 @@ def borrow_view_3(request):
 
 @gatekeeper_required
 def overview_view(request):
-    today = datetime.date.today()
-    three_weeks_ago = today - datetime.timedelta(weeks=3)
-    external_forms = ExternalBorrowingForm.objects\
-        .annotate(
-            total_items=Count(
-                'requested_items',
-                distinct=True,
-            ),
-            borrowed_items=Count(
-                'requested_items',
-                filter=Q(
-                    requested_items__date_borrowed__isnull=False,
-                ),
-                distinct=True,
-            ),
-            returned_items=Count(
-                'requested_items',
-                filter=Q(
-                    requested_items__date_borrowed__isnull=False,
-                    requested_items__date_returned__isnull=False,
-                ),
-                distinct=True,
-            ),
-        )
-    context = {
-        'today': today,
-        'currently_borrowed': BorrowRecord.objects.filter(date_returned=None).order_by('due_date'),
-        'needing_return': BorrowRecord.objects.exclude(date_returned=None).exclude(verified_returned=True),
-        'unapproved_borrow_requests': external_forms.filter(
-            form_status=ExternalBorrowingForm.UNAPPROVED
-        ),
-        'approved_borrow_requests': external_forms.filter(
-            form_status=ExternalBorrowingForm.APPROVED,
-        ).exclude(
-            total_items=F('returned_items')
-        ),
-        'completed_borrow_requests': external_forms.filter(
-            Q(form_status=ExternalBorrowingForm.DENIED)
-            | Q(form_status=ExternalBorrowingForm.COMPLETED)
-            | Q(form_status=ExternalBorrowingForm.APPROVED, total_items=F('returned_items'))
-        ),
-        'members_borrowing': Member.objects.annotate(
-            num_borrowed=Count('borrowed', filter=Q(borrowed__date_returned=None))
-            ).filter(
-                num_borrowed__gt=0
-        ),
-        'overdue': BorrowRecord.objects.filter(date_returned=None, due_date__lt=today).order_by('due_date'),
-        'recent_records': BorrowRecord.objects.filter(date_borrowed__gte=three_weeks_ago).order_by('date_borrowed')
-    }
+    overview = LibraryOverview()
     u = switch_to_proxy(request.user)
     errors = False
     if request.method == 'POST' and u.is_committee:
         form_type = request.POST.get('form_type', None)
         form = None
         if form_type == 'return_items':
-            form = VerifyReturnForm(request.POST)
+            form = VerifyReturnForm(request.POST, records=overview.needing_return)
             if form.is_valid():
                 validated = []
                 for field_name in form.cleaned_data.keys():
                     if form.cleaned_data[field_name] is True:
-                        try:
-                            pk = field_name.split('return_')[1]
-                            record = BorrowRecord.objects.get(pk=pk)
-                        except (IndexError, ObjectDoesNotExist) as e:
-                            errors = True
-                            continue
+                        record = form.records[field_name]
                         if record.verified_returned is False and record.date_returned is not None:
                             record.verified_returned = True
                             record.save()
-                            validated.append(pk)
+                            validated.append(record.pk)
                 if validated:
+                    # Fetch the overview again, so that the verified records are no longer shown
+                    overview = LibraryOverview()
                     messages.success(
                         request,
                         "Successfully verified {0} item{1} as returned."
@@ -374,7 +311,7 @@ def overview_view(request):
             'There were one or more errors with your request. Please try again.'
             'If you repeatedly get this error, please contact a WebKeeper.'
         )
-    return render(request, 'library/overview.html', context)
+    return render(request, 'library/overview.html', overview.get_context())
 
 
 @gatekeeper_required
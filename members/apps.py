@@ -1,11 +1,17 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_migrate
+from django.db.models.signals import post_migrate, post_save, post_delete, m2m_changed
 
 
 class MembersConfig(AppConfig):
     name = 'members'
 
     def ready(self):
-        from .signals import populate_ranks, populate_groups_and_permissions
+        from django.contrib.auth.models import User
+        from .models import RankAssignments
+        from .signals import populate_ranks, populate_groups_and_permissions, rank_assignment_changed, \
+            user_groups_changed
         post_migrate.connect(populate_ranks, sender=self)
-        post_migrate.connect(populate_groups_and_permissions, sender=self)
\ No newline at end of file
+        post_migrate.connect(populate_groups_and_permissions, sender=self)
+        post_save.connect(rank_assignment_changed, sender=RankAssignments)
+        post_delete.connect(rank_assignment_changed, sender=RankAssignments)
+        m2m_changed.connect(user_groups_changed, sender=User.groups.through)
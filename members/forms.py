@@ -13,7 +13,7 @@ from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Fieldset, HTML, Div, Submit
 from crispy_forms.bootstrap import FieldWithButtons, StrictButton, PrependedText
 from .models import MemberFlag, UnigamesUser
-from phylactery.tasks import send_single_email_task, compose_html_email
+from phylactery.tasks import send_templated_email
 
 number_validator = RegexValidator(regex=r"^[0-9]+$")
 no_student_number = RegexValidator(
@@ -344,13 +344,11 @@ class MyPasswordResetForm(PasswordResetForm):
     def send_mail(self, subject_template_name, email_template_name,
                   context, from_email, to_email, html_email_template_name=None):
 
-        message, html_message = compose_html_email(email_template_name, context)
-
         subject = loader.render_to_string(subject_template_name, context)
         # Email subject *must not* contain newlines
         subject = ''.join(subject.splitlines())
 
-        send_single_email_task.delay(to_email, subject, message, html_message=html_message)
+        send_templated_email(to_email, subject, email_template_name, context)
 
     @staticmethod
     def get_user_by_username(username):
@@ -0,0 +1,37 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+# The member autocomplete compares UPPER() of each name with LIKE and the pg_trgm operators, which these indexes serve.
+# Only PostgreSQL has pg_trgm, so the indexes are skipped elsewhere.
+INDEXES = (
+    ('members_member_first_name_trgm_idx', 'members_member', 'first_name'),
+    ('members_member_last_name_trgm_idx', 'members_member', 'last_name'),
+    ('members_member_preferred_name_trgm_idx', 'members_member', 'preferred_name'),
+)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name, table, column in INDEXES:
+            schema_editor.execute('CREATE INDEX {0} ON {1} USING gin (UPPER({2}) gin_trgm_ops)'.format(
+                name, table, column
+            ))
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name, table, column in INDEXES:
+            schema_editor.execute('DROP INDEX IF EXISTS {0}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('members', '0035_alter_member_options'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -1,10 +1,13 @@
 import datetime
-from django.db import models
+import time
+from django.db import models, transaction
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator
-from django.db.models import Q
+from django.db.models import Q, Exists, OuterRef, Prefetch
+from django.conf import settings
+from django.core.cache import cache
 
 
 # Create your models here.
@@ -38,6 +41,30 @@ class UnigamesUser(User):
 			return member.has_rank("COMMITTEE")
 		return False
 
+	@staticmethod
+	def get_group_cache_key(user_pk):
+		return 'members:groups:{0}'.format(user_pk)
+
+	def get_group_names(self):
+		"""
+		Returns a list of the names of this user's groups.
+		Like the ranks of a member, these are kept on the user for the rest of the request,
+		and in the cache for MEMBERS_RANK_CACHE_TIMEOUT seconds if that is set.
+		"""
+		group_names = getattr(self, '_group_names', None)
+		if group_names is None and settings.MEMBERS_RANK_CACHE_TIMEOUT:
+			group_names = cache.get(self.get_group_cache_key(self.pk))
+		if group_names is None:
+			group_names = list(self.groups.values_list('name', flat=True))
+			if settings.MEMBERS_RANK_CACHE_TIMEOUT:
+				cache.set(self.get_group_cache_key(self.pk), group_names, settings.MEMBERS_RANK_CACHE_TIMEOUT)
+		self._group_names = group_names
+		return group_names
+
+	def clear_group_cache(self):
+		self._group_names = None
+		cache.delete(self.get_group_cache_key(self.pk))
+
 
 def switch_to_proxy(user):
 	"""
@@ -48,6 +75,23 @@ def switch_to_proxy(user):
 	return user
 
 
+class MemberQuerySet(models.QuerySet):
+	def with_status(self):
+		"""
+		Annotates each member with is_financial, and prefetches their active rank assignments
+		into active_rank_assignments, which has_rank() and is_gatekeeper read instead of querying.
+		This lets lists of members show their status with a fixed number of queries.
+		"""
+		today = datetime.date.today()
+		return self \
+			.annotate(is_financial=Exists(Membership.objects.filter(member=OuterRef('pk'), expired=False))) \
+			.prefetch_related(Prefetch(
+				'ranks',
+				queryset=RankAssignments.objects.exclude(expired_date__lte=today).select_related('rank'),
+				to_attr='active_rank_assignments'
+			))
+
+
 class Member(models.Model):
 	first_name = models.CharField(max_length=200)
 	last_name = models.CharField(max_length=200)
@@ -60,6 +104,8 @@ class Member(models.Model):
 	user = models.OneToOneField(UnigamesUser, blank=True, null=True, on_delete=models.SET_NULL, related_name='member')
 	receive_emails = models.BooleanField(default=True)
 
+	objects = MemberQuerySet.as_manager()
+
 	def clean(self):
 		if not self.email_address and not self.student_number:
 			raise ValidationError({'email_address': 'One of email address and student number must be filled out.'})
@@ -89,14 +135,7 @@ class Member(models.Model):
 		return self.join_date.year == timezone.now().year
 
 	def has_rank(self, rank_name):
-		today = datetime.date.today()
-		if RankAssignments.objects \
-			.exclude(expired_date__lte=today) \
-			.filter(rank__rank_name__iexact=rank_name, member=self) \
-			.exists():
-			return True
-		else:
-			return False
+		return rank_name.upper() in self.get_active_rank_names()
 
 	def get_recent_rank(self, rank_name):
 		# Returns the most recent, non-expired rank of the provided type that this member has.
@@ -145,12 +184,53 @@ class Member(models.Model):
 		return False
 
 	def get_active_ranks(self):
+		return sorted(self.get_active_rank_names())
+
+	@staticmethod
+	def get_rank_cache_key(member_pk):
+		return 'members:ranks:{0}'.format(member_pk)
+
+	def get_active_rank_names(self):
+		"""
+		Returns a frozenset of the (upper case) names of this member's active ranks.
+		They are loaded with one query, then kept on this instance (which usually lasts for one request),
+		and in the cache for MEMBERS_RANK_CACHE_TIMEOUT seconds if that is set.
+		Saving or deleting a RankAssignments clears them (see members/signals.py),
+		and they are loaded again once the earliest expiry date among them has passed.
+		"""
 		today = datetime.date.today()
-		ranks_qs = RankAssignments.objects \
-			.exclude(expired_date__lte=today) \
-			.filter(member=self) \
-			.values_list('rank__rank_name', flat=True)
-		return ranks_qs
+		active_ranks = getattr(self, '_active_ranks', None)
+		if active_ranks is None and hasattr(self, 'active_rank_assignments'):
+			# Prefetched by MemberQuerySet.with_status()
+			active_ranks = self.get_rank_info(
+				(assignment.rank.rank_name, assignment.expired_date) for assignment in self.active_rank_assignments
+			)
+		if active_ranks is None and settings.MEMBERS_RANK_CACHE_TIMEOUT:
+			active_ranks = cache.get(self.get_rank_cache_key(self.pk))
+		if active_ranks is None or (active_ranks[1] is not None and active_ranks[1] <= today):
+			active_ranks = self.get_rank_info(
+				RankAssignments.objects
+				.exclude(expired_date__lte=today)
+				.filter(member=self)
+				.values_list('rank__rank_name', 'expired_date')
+			)
+			if settings.MEMBERS_RANK_CACHE_TIMEOUT:
+				cache.set(self.get_rank_cache_key(self.pk), active_ranks, settings.MEMBERS_RANK_CACHE_TIMEOUT)
+		self._active_ranks = active_ranks
+		return active_ranks[0]
+
+	@staticmethod
+	def get_rank_info(assignments):
+		# Returns the rank names and earliest expiry date of some (rank name, expiry date) pairs
+		assignments = list(assignments)
+		rank_names = frozenset(rank_name.upper() for rank_name, expired_date in assignments)
+		expiry_dates = [expired_date for rank_name, expired_date in assignments if expired_date is not None]
+		return rank_names, min(expiry_dates, default=None)
+
+	def clear_rank_cache(self):
+		self._active_ranks = None
+		self.__dict__.pop('active_rank_assignments', None)
+		cache.delete(self.get_rank_cache_key(self.pk))
 
 	def sync_permissions(self):
 		# Updates the groups of the associated user object depending on current ranks
@@ -179,6 +259,63 @@ class Member(models.Model):
 			self.user.save()
 			return True
 
+	@classmethod
+	def sync_all_permissions(cls):
+		"""
+		Does what sync_permissions() does for every member with a user, but with a fixed number of queries,
+		and only writes the group memberships and is_staff flags that need to change.
+		Returns a dict of how many users changed, how many group memberships were added and removed,
+		how many is_staff flags changed, and how long it took.
+		"""
+		from django.contrib.auth.models import Group
+		from .signals import GROUPS_TO_CREATE
+		started = time.perf_counter()
+		today = datetime.date.today()
+		user_groups = User.groups.through
+
+		groups = {name.upper(): (pk, name) for pk, name in Group.objects.values_list('pk', 'name')}
+		staff_groups = set(pk for pk, name in groups.values() if GROUPS_TO_CREATE.get(name, [False])[0] is True)
+		# Every user with a member should be in exactly the groups matching their active ranks
+		wanted = set()
+		for user_pk, rank_name in RankAssignments.objects \
+				.exclude(expired_date__lte=today) \
+				.filter(member__user__isnull=False) \
+				.values_list('member__user', 'rank__rank_name'):
+			if rank_name.upper() in groups:
+				wanted.add((user_pk, groups[rank_name.upper()][0]))
+		existing = {
+			(user_pk, group_pk): pk
+			for pk, user_pk, group_pk in user_groups.objects
+				.filter(user__member__isnull=False)
+				.values_list('pk', 'user', 'group')
+		}
+		to_remove = [existing[pair] for pair in set(existing) - wanted]
+		to_add = [user_groups(user_id=user_pk, group_id=group_pk) for user_pk, group_pk in wanted - set(existing)]
+
+		staff_users = set(user_pk for user_pk, group_pk in wanted if group_pk in staff_groups)
+		staff_changes = [
+			User(pk=user_pk, is_staff=user_pk in staff_users)
+			for user_pk, is_staff in User.objects.filter(member__isnull=False).values_list('pk', 'is_staff')
+			if is_staff != (user_pk in staff_users)
+		]
+
+		with transaction.atomic():
+			user_groups.objects.filter(pk__in=to_remove).delete()
+			user_groups.objects.bulk_create(to_add)
+			User.objects.bulk_update(staff_changes, ['is_staff'])
+
+		# Writing to the through table directly skips m2m_changed, so clear the cached groups here
+		changed_users = set(user_pk for user_pk, group_pk in wanted.symmetric_difference(existing))
+		changed_users.update(user.pk for user in staff_changes)
+		cache.delete_many([UnigamesUser.get_group_cache_key(user_pk) for user_pk in changed_users])
+		return {
+			'users': len(changed_users),
+			'added': len(to_add),
+			'removed': len(to_remove),
+			'staff': len(staff_changes),
+			'seconds': time.perf_counter() - started,
+		}
+
 
 	class Meta:
 		ordering = ['preferred_name', 'last_name']
@@ -1,3 +1,6 @@
+from django.core.cache import cache
+
+
 # A dict of groups to create, keyed to a list
 # List is in the format (
 #  - (bool) is_staff,
@@ -61,3 +64,32 @@ def populate_groups_and_permissions(sender, **kwargs):
         group.permissions.add(*permissions_to_add)
     for group in Group.objects.exclude(name__in=GROUPS_TO_CREATE):
         group.delete()
+
+
+def rank_assignment_changed(sender, instance, **kwargs):
+    # Clears the cached ranks of the member whose rank was assigned, changed or removed
+    from .models import Member, RankAssignments
+    if RankAssignments.member.is_cached(instance):
+        instance.member.clear_rank_cache()
+    else:
+        cache.delete(Member.get_rank_cache_key(instance.member_id))
+
+
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Clears the cached group names of the users whose groups were changed
+    from .models import UnigamesUser
+    if reverse and action == 'pre_clear':
+        # instance is a Group that is about to lose all of its users, so remember who they were
+        instance._cleared_user_pks = list(instance.user_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        if hasattr(instance, 'clear_group_cache'):
+            instance.clear_group_cache()
+        else:
+            cache.delete(UnigamesUser.get_group_cache_key(instance.pk))
+    else:
+        # instance is a Group, and pk_set holds the users that were added or removed
+        user_pks = pk_set if action != 'post_clear' else getattr(instance, '_cleared_user_pks', [])
+        cache.delete_many([UnigamesUser.get_group_cache_key(user_pk) for user_pk in user_pks])
@@ -12,8 +12,9 @@ def cleanup_permissions_task():
         Intended to be run every day.
     """
     from .models import Member
-    successful = 0
-    for member in Member.objects.all():
-        if member.sync_permissions():
-            successful += 1
-    logger.info('Verified the permissions of {0} users.'.format(successful))
+    stats = Member.sync_all_permissions()
+    logger.info(
+        'Updated the permissions of {users} users ({added} groups added, {removed} groups removed, '
+        '{staff} staff statuses changed) in {seconds:.2f}s.'.format(**stats)
+    )
+    return stats
@@ -1,4 +1,27 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.cache import cache
+from django.contrib.auth.models import Group
+from django.core import mail
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from freezegun import freeze_time
+from phylactery.tasks import send_templated_email_task
+from unittest import mock
+from .models import Member, Membership, RankAssignments, UnigamesUser
+from .tokens import account_activation_token
+from .views import send_activation_email
+import datetime
+import json
+import re
+
+
+def create_member(user=None):
+    return Member.objects.create(
+        first_name='Donald', last_name='Sutherland', email_address='donald@sutherland.id.au', user=user
+    )
 
 
 class MemberModelTests(TestCase):
@@ -14,7 +37,175 @@ class MembershipModelTests(TestCase):
 
 
 class RankModelTests(TestCase):
-    pass
+
+    def setUp(self):
+        cache.clear()
+
+    def test_ranks_are_loaded_once(self):
+        member = create_member()
+        member.add_rank('GATEKEEPER')
+        member = Member.objects.get(pk=member.pk)
+        with self.assertNumQueries(1):
+            self.assertTrue(member.is_gatekeeper)
+            self.assertFalse(member.is_committee)
+            self.assertTrue(member.has_rank('gatekeeper'))
+            self.assertEqual(member.get_active_ranks(), ['GATEKEEPER'])
+
+    @override_settings(MEMBERS_RANK_CACHE_TIMEOUT=60)
+    def test_rank_changes_clear_the_cache(self):
+        member = create_member()
+        self.assertFalse(member.is_committee)
+        assignment = member.add_rank('COMMITTEE')
+        self.assertTrue(member.is_committee)
+        # Another instance of the member reads the ranks from the cache
+        other_member = Member.objects.get(pk=member.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(other_member.is_committee)
+
+        RankAssignments.objects.filter(pk=assignment.pk).delete()
+        self.assertFalse(Member.objects.get(pk=member.pk).is_committee)
+
+    @override_settings(MEMBERS_RANK_CACHE_TIMEOUT=60)
+    def test_expired_ranks_are_reloaded(self):
+        with freeze_time('1st October 2020'):
+            member = create_member()
+            assignment = member.add_rank('GATEKEEPER')
+            assignment.expired_date = datetime.date(2020, 10, 3)
+            assignment.save()
+            self.assertTrue(member.is_gatekeeper)
+        with freeze_time('2nd October 2020'):
+            self.assertTrue(member.is_gatekeeper)
+        with freeze_time('3rd October 2020'):
+            self.assertFalse(member.is_gatekeeper)
+            self.assertFalse(Member.objects.get(pk=member.pk).is_gatekeeper)
+
+    def test_sync_all_permissions(self):
+        president = UnigamesUser.objects.create_user('president', 'president@example.com', 'password')
+        Member.objects.create(first_name='P', last_name='P', email_address='p@example.com', user=president)
+        president.member.add_rank('PRESIDENT')
+        president.member.add_rank('GATEKEEPER')
+        webkeeper = UnigamesUser.objects.create_user('webkeeper', 'webkeeper@example.com', 'password')
+        Member.objects.create(first_name='W', last_name='W', email_address='w@example.com', user=webkeeper)
+        webkeeper.member.add_rank('WEBKEEPER')
+        admin = UnigamesUser.objects.create_user('admin', 'admin@example.com', 'password')
+        admin.groups.add(Group.objects.get(name='Admin'))
+
+        # Change ranks and groups without going through sync_permissions()
+        RankAssignments.objects.filter(member__user=webkeeper).update(expired_date=datetime.date.today())
+        RankAssignments.objects.filter(member__user=president, rank__rank_name='GATEKEEPER').delete()
+        president.groups.add(Group.objects.get(name='Admin'))
+        self.assertEqual(admin.get_group_names(), ['Admin'])
+
+        stats = Member.sync_all_permissions()
+        self.assertEqual((stats['users'], stats['added'], stats['removed'], stats['staff']), (2, 0, 3, 1))
+        president = UnigamesUser.objects.get(pk=president.pk)
+        self.assertEqual(president.get_group_names(), ['President'])
+        self.assertTrue(president.is_staff)
+        webkeeper = UnigamesUser.objects.get(pk=webkeeper.pk)
+        self.assertEqual(webkeeper.get_group_names(), [])
+        self.assertFalse(webkeeper.is_staff)
+        # Users without a member are left alone
+        self.assertEqual(UnigamesUser.objects.get(pk=admin.pk).get_group_names(), ['Admin'])
+
+        self.assertEqual(Member.sync_all_permissions()['users'], 0)
+
+    def test_gatekeeper_page_loads_ranks_once(self):
+        user = UnigamesUser.objects.create_user('gatekeeper', 'gatekeeper@example.com', 'password')
+        create_member(user=user).add_rank('COMMITTEE')
+        user.member.add_rank('GATEKEEPER')
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('library:overview'))
+        self.assertEqual(response.status_code, 200)
+        rank_queries = [query for query in queries if 'members_rankassignments' in query['sql']]
+        self.assertEqual(len(rank_queries), 1)
+
+
+class MemberListTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(UnigamesUser.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def create_members(self, count):
+        for number in range(Member.objects.count(), Member.objects.count() + count):
+            member = Member.objects.create(
+                first_name='Member', last_name=str(number), email_address='member{0}@example.com'.format(number)
+            )
+            if number % 2:
+                member.add_rank('GATEKEEPER')
+                Membership.objects.create(member=member, guild_member=False, amount_paid=5)
+
+    def get_member_list(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('members:member-list'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_member_list_queries(self):
+        self.get_member_list()
+        self.create_members(2)
+        response, few_queries = self.get_member_list()
+        self.create_members(20)
+        response, many_queries = self.get_member_list()
+        self.assertEqual(few_queries, many_queries)
+
+        members = {member.last_name: member for member in response.context['page_obj']}
+        self.assertTrue(members['1'].is_financial)
+        self.assertTrue(members['1'].is_gatekeeper)
+        self.assertFalse(members['2'].is_financial)
+        self.assertFalse(members['2'].is_gatekeeper)
+
+
+class SignupTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def sign_up(self, email_address):
+        with mock.patch.object(send_templated_email_task, 'delay') as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('account:signup'), {
+                'username': 'gatekeeper', 'email': email_address,
+                'password1': 'a very secret password', 'password2': 'a very secret password',
+            })
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        return delay
+
+    def test_gatekeepers_are_sent_an_activation_email(self):
+        create_member().add_rank('GATEKEEPER')
+        delay = self.sign_up('donald@sutherland.id.au')
+        user = UnigamesUser.objects.get(username='gatekeeper')
+        self.assertFalse(user.is_active)
+        self.assertEqual(Member.objects.get().user, user)
+
+        # The task gets everything it needs through the broker
+        email_address, subject, template_name, context = json.loads(json.dumps(delay.call_args.args))
+        send_templated_email_task(email_address, subject, template_name, context, **delay.call_args.kwargs)
+        self.assertEqual(mail.outbox[0].to, ['donald@sutherland.id.au'])
+        activation_url = re.search(r'/account/activate/[^/]+/[^/]+/', mail.outbox[0].body).group()
+        self.assertEqual(activation_url, reverse('account:activate', kwargs={
+            'uidb64': urlsafe_base64_encode(force_bytes(user.pk)),
+            'token': account_activation_token.make_token(user),
+        }))
+
+        self.client.get(activation_url)
+        self.assertTrue(UnigamesUser.objects.get(pk=user.pk).is_active)
+
+    def test_activation_email_is_queued_once_committed(self):
+        user = UnigamesUser.objects.create_user('gatekeeper', 'donald@sutherland.id.au', 'password')
+        with mock.patch.object(send_templated_email_task, 'delay') as delay:
+            with self.captureOnCommitCallbacks() as callbacks:
+                send_activation_email('donald@sutherland.id.au', user, 'uid', 'token')
+            delay.assert_not_called()
+            callbacks[0]()
+        self.assertEqual(delay.call_args.args[:3], (
+            'donald@sutherland.id.au', 'Activate your Unigames account', 'account/acc_active_email.html'
+        ))
+
+    def test_other_members_are_not_sent_an_activation_email(self):
+        create_member()
+        self.sign_up('donald@sutherland.id.au').assert_not_called()
+        self.assertFalse(UnigamesUser.objects.filter(username='gatekeeper').exists())
 
 
 class InterestModelTests(TestCase):
@@ -15,7 +15,7 @@ from django.utils.encoding import force_bytes, force_str
 from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from django.template.loader import render_to_string
 from .tokens import account_activation_token, email_preference_token
-from phylactery.tasks import send_single_email_task, compose_html_email
+from phylactery.tasks import send_templated_email
 from django.contrib.auth.models import User
 from django.core.paginator import Paginator
 from .models import Member, Membership, MemberFlag, switch_to_proxy
@@ -27,27 +27,21 @@ from django.contrib.admin import AdminSite
 from django.views.generic import TemplateView, DetailView
 from django.contrib import messages
 from dal import autocomplete
-from django.db.models import Q
+from phylactery.autocomplete import TrigramAutocompleteMixin
 from library.models import BorrowRecord
 import datetime
 from django.utils.html import strip_tags
 from premailer import transform
 
 
-def send_activation_email(email_address, user, uid, token, request):
+def send_activation_email(email_address, user, uid, token):
 	subject = 'Activate your Unigames account'
 	context = {
 		'user': user,
 		'uid': uid,
 		'token': token,
 	}
-	plaintext_message, html_message = compose_html_email('account/acc_active_email.html', context, request=request)
-	send_single_email_task.delay(
-		email_address,
-		subject,
-		message=plaintext_message,
-		html_message=html_message,
-	)
+	send_templated_email(email_address, subject, 'account/acc_active_email.html', context)
 
 
 def signup_view(request):
@@ -70,7 +64,7 @@ def signup_view(request):
 				uid = urlsafe_base64_encode(force_bytes(user.pk))
 				token = account_activation_token.make_token(user)
 
-				send_activation_email(to_email, user, uid, token, request)
+				send_activation_email(to_email, user, uid, token)
 			else:
 				# The form is valid, but the member either doesn't exist or is not a gatekeeper.
 				# We give them the same response, but don't do anything with the data to prevent leaking.
@@ -205,7 +199,8 @@ class MemberListView(ListView):
 		# Apply search results
 		qs, search_use_distinct = self.changelist.model_admin.get_search_results(self.request, qs, self.changelist.query)
 
-		return qs
+		# Fetch the membership and rank status shown for each member along with them
+		return qs.with_status()
 
 
 @gatekeeper_required
@@ -392,26 +387,17 @@ class MemberProfileView(DetailView):
 		return context
 
 
-class MemberAutocomplete(autocomplete.Select2QuerySetView):
-	def get_queryset(self):
+class MemberAutocomplete(TrigramAutocompleteMixin, autocomplete.Select2QuerySetView):
+	search_fields = ('first_name', 'last_name', 'preferred_name')
+	ordering = ('last_name', 'first_name')
+	# Every search term has to match one of the names
+	split_terms = True
+
+	def get_base_queryset(self):
 		u = switch_to_proxy(self.request.user)
 		if u.is_authenticated and u.is_gatekeeper:
-			qs = Member.objects.all()
-		else:
-			qs = Member.objects.none()
-			return qs
-		if self.q:
-			terms = self.q.split()
-			q_objects = []
-
-			for search_term in terms:
-				q_objects.append(
-					Q(first_name__icontains=search_term)
-					| Q(last_name__icontains=search_term)
-					| Q(preferred_name__icontains=search_term)
-				)
-			qs = qs.filter(*q_objects)
-		return qs
+			return Member.objects.all()
+		return Member.objects.none()
 
 
 def email_preferences_view(request, uidb64=None, token=None):
@@ -470,12 +456,11 @@ def email_preferences_view(request, uidb64=None, token=None):
 						'token': email_preference_token.make_token(member)
 					}
 					email_subject = 'Change your Email Preferences'
-					body, html_body = compose_html_email('members/email_preferences_change_email.html', context)
-					send_single_email_task.delay(
+					send_templated_email(
 						member.email_address,
 						email_subject,
-						body,
-						html_message=html_body,
+						'members/email_preferences_change_email.html',
+						context,
 						log=False
 					)
 				messages.info(request, 'Request submitted successfully. Please check your email for further instructions.')
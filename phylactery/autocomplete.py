@@ -0,0 +1,95 @@
+from django.conf import settings
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Greatest, Upper
+from functools import reduce
+import hashlib
+import operator
+
+
+class TrigramAutocompleteMixin:
+    """
+        Shared searching for the select2 autocomplete views.
+
+        On PostgreSQL the search_fields are matched with pg_trgm, against the
+        trigram indexes on UPPER(field), so partial words and small typos still match,
+        and the results are ranked by how similar they are to the query.
+        Other databases fall back to icontains, ordered by the view's ordering.
+
+        At most AUTOCOMPLETE_MAX_RESULTS are returned, and the primary keys of the
+        results are cached for AUTOCOMPLETE_CACHE_TIMEOUT seconds, since the same
+        prefixes get typed over and over at the borrow desk.
+    """
+    # The fields to search, and the ordering used for ties and when there is no query
+    search_fields = ('name',)
+    ordering = ('name',)
+    # If True, each word of the query has to match one of the search_fields.
+    # Otherwise the whole query is matched as a single term.
+    split_terms = False
+
+    def get_base_queryset(self):
+        """
+            Returns the queryset that the visitor is allowed to search through.
+        """
+        raise NotImplementedError
+
+    def get_search_queryset(self, model):
+        """
+            Returns the queryset whose search results are cached, which is shared by every visitor.
+            The results are then limited to the base queryset of each visitor.
+        """
+        return model._default_manager.all()
+
+    def get_queryset(self):
+        qs = self.get_base_queryset()
+        query = ' '.join(self.q.split()) if self.q else ''
+        if not query:
+            return qs.order_by(*self.ordering)
+        if qs.query.is_empty():
+            return []
+
+        cache_key = 'autocomplete:{0}:{1}'.format(
+            qs.model._meta.label_lower, hashlib.md5(query.lower().encode()).hexdigest()
+        )
+        pks = cache.get(cache_key)
+        if pks is None:
+            # The search isn't limited to what this visitor can see, so the cached results are the same for everyone
+            results = self.search(self.get_search_queryset(qs.model), query)[:settings.AUTOCOMPLETE_MAX_RESULTS]
+            pks = [result.pk for result in results]
+            cache.set(cache_key, pks, settings.AUTOCOMPLETE_CACHE_TIMEOUT)
+        # Fetching the results by primary key is much cheaper than searching again,
+        # and limits them to what this visitor is allowed to see.
+        results = qs.in_bulk(pks)
+        return [results[pk] for pk in pks if pk in results]
+
+    def get_terms(self, query):
+        return query.split() if self.split_terms else [query]
+
+    def search(self, qs, query):
+        if connection.vendor != 'postgresql':
+            for term in self.get_terms(query):
+                qs = qs.filter(reduce(operator.or_, [
+                    Q(**{'{0}__icontains'.format(field): term}) for field in self.search_fields
+                ]))
+            return qs.order_by(*self.ordering)
+
+        # Everything is compared in upper case, so both the LIKE and the trigram operators can use the same index
+        qs = qs.alias(**{'upper_{0}'.format(field): Upper(field) for field in self.search_fields})
+        similarities = []
+        for term in self.get_terms(query):
+            term = term.upper()
+            qs = qs.filter(reduce(operator.or_, [
+                Q(**{'upper_{0}__contains'.format(field): term})
+                | Q(**{'upper_{0}__trigram_word_similar'.format(field): term})
+                for field in self.search_fields
+            ]))
+            field_similarities = [TrigramWordSimilarity(term, Upper(field)) for field in self.search_fields]
+            if len(field_similarities) == 1:
+                similarities.append(field_similarities[0])
+            else:
+                similarities.append(Greatest(*field_similarities))
+        return qs \
+            .annotate(similarity=reduce(operator.add, similarities)) \
+            .order_by('-similarity', *self.ordering)
@@ -19,7 +19,7 @@ def unigames_user_processor(request):
         new_user = switch_to_proxy(request.user)
         context = {
             'user': new_user,
-            'user_groups': list(new_user.groups.values_list('name', flat=True))
+            'user_groups': new_user.get_group_names()
         }
         context['librarian_permissions'] = any(
             x in ['Librarian', 'President', 'Vice-President'] for x in context['user_groups']
@@ -0,0 +1,53 @@
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+import time
+
+# The cache (in CACHES) that holds the cached parts of the public pages
+FRAGMENT_CACHE = 'fragments'
+GENERATION_KEY = 'fragments:generation'
+
+
+def get_generation(cache):
+    # Every fragment key includes the current generation, so bumping it invalidates all of them at once.
+    # It starts from the current time, so that a generation that was evicted can't bring back old fragments.
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, int(time.time()), None)
+        generation = cache.get(GENERATION_KEY, 0)
+    return generation
+
+
+def get_fragment(name, compute, timeout=DEFAULT_TIMEOUT):
+    """
+        Returns the cached value of a fragment of a public page, or computes and caches it.
+        Fragments are kept until invalidate_fragments() is called, which the signals do
+        whenever something that the public pages show changes, or until the timeout.
+        The timeout can also be a function, which is given the computed value and returns the timeout.
+    """
+    cache = caches[FRAGMENT_CACHE]
+    key = 'fragments:{0}:{1}'.format(get_generation(cache), name)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout(value) if callable(timeout) else timeout)
+    return value
+
+
+def invalidate_fragments():
+    """
+        Invalidates every cached fragment, once the current transaction (if any) commits,
+        so that a request can't cache the old data again in between.
+    """
+    def bump_generation():
+        cache = caches[FRAGMENT_CACHE]
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            get_generation(cache)
+    transaction.on_commit(bump_generation)
+
+
+def fragments_changed(sender, **kwargs):
+    # Connected to the signals of every model that the cached fragments depend on
+    invalidate_fragments()
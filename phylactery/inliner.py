@@ -0,0 +1,80 @@
+from django.core.cache import cache
+from premailer import Premailer
+import premailer
+import hashlib
+
+
+# How long a processed stylesheet is cached for. The cache keys are made from everything that goes into them,
+# so a deploy that changes a stylesheet or premailer starts on new keys, and this just clears out the old ones.
+CSS_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+CSS_CACHE_HITS_KEY = 'email_css:hits'
+CSS_CACHE_MISSES_KEY = 'email_css:misses'
+
+
+class LeftoverCSS(str):
+    """
+        The css of a stylesheet that can't be inlined (like media queries), already turned back into a string.
+    """
+
+
+class CachedPremailer(Premailer):
+    """
+        A Premailer that processes each stylesheet once, rather than once for every email.
+        Parsing the stylesheet into the rules to inline, and writing the css that can't be inlined back out,
+        is most of the cost of transforming an email, and neither depends on anything but the stylesheet.
+        So both are cached, keyed by the template name and a hash of the stylesheet,
+        which leaves only applying the rules to the html of each email.
+    """
+    def __init__(self, template_name, **kwargs):
+        super().__init__(**kwargs)
+        self.template_name = template_name
+
+    def get_cache_key(self, css_body, ruleset_index):
+        return 'email_css:{0}:{1}:{2}:{3}'.format(
+            premailer.__version__, self.template_name, hashlib.md5(css_body.encode()).hexdigest(), ruleset_index
+        )
+
+    def _parse_style_rules(self, css_body, ruleset_index):
+        if not css_body:
+            return super()._parse_style_rules(css_body, ruleset_index)
+        cache_key = self.get_cache_key(css_body, ruleset_index)
+        processed = cache.get(cache_key)
+        if processed is None:
+            count_css_cache(CSS_CACHE_MISSES_KEY)
+            rules, leftover = super()._parse_style_rules(css_body, ruleset_index)
+            processed = (rules, super()._css_rules_to_string(leftover) if leftover else '')
+            cache.set(cache_key, processed, CSS_CACHE_TIMEOUT)
+        else:
+            count_css_cache(CSS_CACHE_HITS_KEY)
+        rules, leftover = processed
+        return rules, [LeftoverCSS(leftover)] if leftover else []
+
+    def _css_rules_to_string(self, rules):
+        if len(rules) == 1 and isinstance(rules[0], LeftoverCSS):
+            return str(rules[0])
+        return super()._css_rules_to_string(rules)
+
+
+def inline_css(html, template_name):
+    """
+        Returns the html with its css inlined, the same as premailer.transform().
+    """
+    return CachedPremailer(template_name).transform(html, pretty_print=False)
+
+
+def count_css_cache(key):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The counter was evicted in between
+        pass
+
+
+def get_css_cache_stats():
+    """
+        Returns how many times a processed stylesheet was found in the cache, and how many times it wasn't.
+    """
+    counts = cache.get_many([CSS_CACHE_HITS_KEY, CSS_CACHE_MISSES_KEY])
+    return {'hits': counts.get(CSS_CACHE_HITS_KEY, 0), 'misses': counts.get(CSS_CACHE_MISSES_KEY, 0)}
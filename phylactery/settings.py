@@ -98,6 +98,22 @@ DATABASES = {
     }
 }
 
+# Caches
+# 'fragments' holds the cached parts of the public pages, like the featured items and recent blog posts.
+# It can be shared between processes by using, for example:
+#   {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/var/tmp/phylactery_cache'}
+#   {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379/1'}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+        'TIMEOUT': 60 * 60,
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -156,6 +172,26 @@ EMAIL_PORT = 25
 EMAIL_USE_TLS = False
 DEFAULT_FROM_EMAIL = 'webmaster@localhost'
 
+# Bulk email settings:
+# EMAIL_BATCH_SIZE: How many emails of an email order are sent by each task, over a single connection.
+# EMAIL_BATCH_RATE_LIMIT: The celery rate limit of those tasks, per worker.
+# EMAIL_MAX_RETRIES: How many times the emails that couldn't be sent are retried, before giving up on them.
+# EMAIL_RETRY_BACKOFF: How many seconds to wait before the first retry. This doubles with every retry.
+EMAIL_BATCH_SIZE = 50
+EMAIL_BATCH_RATE_LIMIT = '6/m'
+EMAIL_MAX_RETRIES = 3
+EMAIL_RETRY_BACKOFF = 60
+
+# Email outbox settings:
+# EMAIL_OUTBOX: If True, email orders and emails sent with send_templated_email() are put in the outbox table,
+# instead of being sent by their tasks. The dispatch_outbox_task has to be scheduled to send them.
+# EMAIL_OUTBOX_MAX_BATCHES: The most batches of EMAIL_BATCH_SIZE emails each run of the dispatch_outbox_task sends.
+# EMAIL_OUTBOX_LEASE: How many seconds a dispatcher has to send a batch it has claimed,
+# before the emails in it can be claimed (and sent) again by another dispatcher.
+EMAIL_OUTBOX = False
+EMAIL_OUTBOX_MAX_BATCHES = 10
+EMAIL_OUTBOX_LEASE = 10 * 60
+
 LOGIN_URL = 'account:login'
 
 LOGIN_REDIRECT_URL = '/'
@@ -173,6 +209,46 @@ NAVBAR_COLOUR = '#662c2c'
 
 TAGGIT_CASE_INSENSITIVE = True
 
+# Library tag computation settings:
+# LIBRARY_DEFER_TAG_COMPUTATION: If True, saving an Item or TagParent only marks it as pending,
+# and the tags are recomputed by a celery task instead of during the request.
+# LIBRARY_TAG_COMPUTATION_COUNTDOWN: How many seconds to wait before running that task,
+# so that a burst of edits gets coalesced into a single recomputation.
+LIBRARY_DEFER_TAG_COMPUTATION = False
+LIBRARY_TAG_COMPUTATION_COUNTDOWN = 10
+
+# LIBRARY_SEARCH_BACKEND: The dotted path of the search backend used by the library search,
+# e.g. 'library.search.BasicSearchBackend'. If None, the backend for the database in use is picked.
+LIBRARY_SEARCH_BACKEND = None
+
+# LIBRARY_REMINDER_OFFSETS: When due date reminders are sent, in days after the due date.
+# Negative offsets are before the due date (-1 is the day before), 0 is the due date, and positive offsets are overdue.
+LIBRARY_REMINDER_OFFSETS = [-1, 0]
+
+# Items API settings:
+# LIBRARY_API_PAGE_SIZE: How many items each page of /api/items/all returns, when it's paginated (with ?cursor=).
+# Clients can ask for up to LIBRARY_API_MAX_PAGE_SIZE with ?page_size=
+# LIBRARY_API_STREAM_CHUNK_SIZE: How many items are fetched (and have their availability computed) at a time
+# when the items are streamed with ?stream=true
+# LIBRARY_API_MAX_RANDOM_COUNT: The most random items that can be asked for at once with ?count=
+# LIBRARY_RANDOM_PICK_CACHE_TIMEOUT: How many seconds the lists of items to pick randomly from are cached for.
+# They're cleared when an item is saved or deleted, but only in that process's cache (unless the cache is shared).
+LIBRARY_API_PAGE_SIZE = 100
+LIBRARY_API_MAX_PAGE_SIZE = 1000
+LIBRARY_API_STREAM_CHUNK_SIZE = 500
+LIBRARY_API_MAX_RANDOM_COUNT = 20
+LIBRARY_RANDOM_PICK_CACHE_TIMEOUT = 5 * 60
+
+# Autocomplete settings:
+# AUTOCOMPLETE_MAX_RESULTS: The most results an autocomplete search will return.
+# AUTOCOMPLETE_CACHE_TIMEOUT: How many seconds the results of each autocomplete search are cached for.
+AUTOCOMPLETE_MAX_RESULTS = 20
+AUTOCOMPLETE_CACHE_TIMEOUT = 30
+
+# MEMBERS_RANK_CACHE_TIMEOUT: Ranks and groups are always cached for the rest of a request once they are loaded.
+# If this is set, they are also kept in the cache for this many seconds, to be shared between requests.
+MEMBERS_RANK_CACHE_TIMEOUT = None
+
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 MESSAGE_TAGS = {
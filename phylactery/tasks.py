@@ -2,20 +2,25 @@ from celery import shared_task
 from celery.utils.log import get_task_logger
 
 from django.core.mail import get_connection
-from django.core.mail import send_mail, send_mass_mail
+from django.core.mail import send_mail, send_mass_mail, EmailMultiAlternatives
 
 from django.template.loader import render_to_string
 
-from django.utils.html import strip_tags
+from django.utils.html import strip_tags, escape
 
-from premailer import transform
+from .inliner import inline_css
 
 from logging import CRITICAL as CRITICAL_LOG
 from cssutils import log as css_log
 
 from django.contrib.sites.models import Site
 
+from django.apps import apps
+from django.conf import settings
+from django.db import models, transaction
+
 from smtplib import SMTPException
+import datetime
 
 logger = get_task_logger(__name__)
 
@@ -28,13 +33,85 @@ def compose_html_email(template_name, context, request=None):
     context['protocol'] = 'https://'
     context['domain'] = Site.objects.get_current().domain
     html_message = render_to_string(template_name, context, request=request)
-    html_message = transform(html_message)
+    html_message = inline_css(html_message, template_name)
     context['override_base'] = 'phylactery/email_base.txt'
     plaintext_message = render_to_string(template_name, context, request=request)
     plaintext_message = strip_tags(plaintext_message)
     return plaintext_message, html_message
 
 
+class CompiledEmail:
+    """
+        An email that is composed once and then personalised for each recipient, instead of being composed
+        again for every one of them. The personal values are rendered as placeholders, which are then
+        substituted in each copy, so they have to make it into the email unchanged (like the uid and token
+        in a link). Only plain strings are kept, so it can be cached.
+    """
+    def __init__(self, template_name, context, personal_keys, request=None):
+        self.personal_keys = list(personal_keys)
+        context = dict(context)
+        for key in self.personal_keys:
+            context[key] = self.get_placeholder(key)
+        self.plaintext_message, self.html_message = compose_html_email(template_name, context, request=request)
+
+    @staticmethod
+    def get_placeholder(key):
+        return 'PHYLACTERY{0}PLACEHOLDER'.format(key.upper())
+
+    @classmethod
+    def fill_placeholders(cls, plaintext_message, html_message, personal_context):
+        """
+            Returns the plaintext and html messages with their placeholders replaced by the personal values.
+        """
+        for key, value in personal_context.items():
+            placeholder = cls.get_placeholder(key)
+            plaintext_message = plaintext_message.replace(placeholder, str(value))
+            html_message = html_message.replace(placeholder, escape(value))
+        return plaintext_message, html_message
+
+    def personalise(self, **personal_context):
+        """
+            Returns the email in both plaintext and html form, for the given personal values.
+        """
+        return self.fill_placeholders(
+            self.plaintext_message, self.html_message, {key: personal_context[key] for key in self.personal_keys}
+        )
+
+
+def compose_email_message(email_address, subject, message, html_message=None):
+    """
+        Returns an EmailMessage ready to be sent to a single email address, with the html alternative attached.
+    """
+    email_message = EmailMultiAlternatives(subject, message, None, [email_address])
+    if html_message is not None:
+        email_message.attach_alternative(html_message, 'text/html')
+    return email_message
+
+
+def send_messages_over_connection(email_messages, connection=None):
+    """
+        Sends each of the EmailMessages over one connection, so that the cost of connecting
+        is only paid once for the lot. Each message is sent by itself so that a failure only
+        affects that message, and if the connection breaks, a new one is opened for the rest.
+        Returns a list of the messages that couldn't be sent.
+    """
+    if connection is None:
+        connection = get_connection()
+    failed = []
+    try:
+        for email_message in email_messages:
+            try:
+                connection.open()
+                connection.send_messages([email_message])
+            except (SMTPException, OSError):
+                failed.append(email_message)
+                # Start over with a fresh connection, in case this one was the problem
+                connection.close()
+    finally:
+        connection.close()
+    return failed
+
+
 @shared_task(name="send_single_email_task", rate_limit="1/s")
 def send_single_email_task(email_address, subject, message, html_message=None, connection=None, log=True):
     """
@@ -55,6 +132,72 @@ def send_single_email_task(email_address, subject, message, html_message=None, c
         logger.info("Sent email to "+email_address)
 
 
+def serialise_email_context(value):
+    """
+        Returns the context of an email in a form that can be passed to a task.
+        Model instances are replaced with references to their primary keys, and dates with strings,
+        which are turned back by deserialise_email_context().
+    """
+    if isinstance(value, models.Model):
+        return {'__model__': value._meta.label_lower, 'pk': value.pk}
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, dict):
+        return {key: serialise_email_context(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [serialise_email_context(item) for item in value]
+    return value
+
+
+def deserialise_email_context(value):
+    """
+        Returns the context of an email that was serialised by serialise_email_context(),
+        fetching each model instance it refers to.
+    """
+    if isinstance(value, dict):
+        if '__model__' in value:
+            return apps.get_model(value['__model__'])._default_manager.get(pk=value['pk'])
+        if '__datetime__' in value:
+            return datetime.datetime.fromisoformat(value['__datetime__'])
+        if '__date__' in value:
+            return datetime.date.fromisoformat(value['__date__'])
+        return {key: deserialise_email_context(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [deserialise_email_context(item) for item in value]
+    return value
+
+
+@shared_task(name="send_templated_email_task", rate_limit="1/s")
+def send_templated_email_task(email_address, subject, template_name, context, log=True):
+    """
+        Composes an email from a template and sends it to a single email address, both in the worker,
+        so that rendering the email and inlining its css doesn't hold up the request that sent it.
+        The context has to have been serialised by serialise_email_context().
+        If EMAIL_OUTBOX is set, the email is put in the outbox instead of being sent.
+    """
+    message, html_message = compose_html_email(template_name, deserialise_email_context(context))
+    if settings.EMAIL_OUTBOX:
+        from blog.models import OutboxMessage
+        OutboxMessage.queue(subject, message, html_message, [email_address])
+        return
+    send_single_email_task(email_address, subject, message, html_message=html_message, log=log)
+
+
+def send_templated_email(email_address, subject, template_name, context, log=True):
+    """
+        Sends an email composed from a template asynchronously. Model instances and dates in the context
+        are fine, but everything else in it has to be JSON serialisable.
+        The task is only queued once the current transaction commits, so that the worker can see the
+        instances in the context, and no email is sent if the transaction is rolled back.
+    """
+    context = serialise_email_context(context)
+    transaction.on_commit(
+        lambda: send_templated_email_task.delay(email_address, subject, template_name, context, log=log)
+    )
+
+
 @shared_task(name="send_mass_email_task")
 def send_mass_email_task(email_addresses, subject, message, html_message=None):
     """
@@ -64,7 +207,9 @@ def send_mass_email_task(email_addresses, subject, message, html_message=None):
     connection = get_connection()
     connection.open()
     for email_address in email_addresses:
-        send_single_email_task(email_address, subject, message, html_message=html_message, log=False)
+        send_single_email_task(
+            email_address, subject, message, html_message=html_message, connection=connection, log=False
+        )
     connection.close()
 
     logger.info('Sent emails to {0} recipients.'.format(len(email_addresses)))
@@ -9,6 +9,8 @@ from django.views.generic import TemplateView
 from blog.models import BlogPost
 from library.models import Item
 from django.utils import timezone
+from django.core.cache import caches
+from .fragments import get_fragment, FRAGMENT_CACHE
 
 
 CONTROL_PANEL_FORMS = [
@@ -98,19 +100,41 @@ class HomeView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        featured_items = Item.objects.filter(
-            Q(base_tags__base_tags__name__in=[self.featured_tag_name])
-        ).distinct().order_by('name')
+        featured_items = get_fragment(
+            'featured_items:{0}'.format(self.featured_tag_name),
+            lambda: list(Item.objects.featured(self.featured_tag_name))
+        )
 
-        most_recent_blogposts = BlogPost.objects.filter(
-            publish_on__lte=timezone.now()
-        ).order_by('-publish_on')[:3]
+        most_recent_blogposts, next_publish_on = get_fragment(
+            'home:recent_blogposts', self.get_recent_blogposts, timeout=self.get_recent_blogposts_timeout
+        )
 
         context['featured_items'] = featured_items
         context['recent_blogposts'] = most_recent_blogposts
 
         return context
 
+    @staticmethod
+    def get_recent_blogposts():
+        # Returns the most recent blog posts, and when the next scheduled post will be published (if there is one)
+        now = timezone.now()
+        most_recent_blogposts = list(BlogPost.objects.filter(
+            publish_on__lte=now
+        ).order_by('-publish_on')[:3])
+        next_publish_on = BlogPost.objects.filter(
+            publish_on__gt=now
+        ).order_by('publish_on').values_list('publish_on', flat=True).first()
+        return most_recent_blogposts, next_publish_on
+
+    @staticmethod
+    def get_recent_blogposts_timeout(value):
+        # Scheduled posts are published without being saved again, so the cached posts expire when the next one is
+        most_recent_blogposts, next_publish_on = value
+        timeout = caches[FRAGMENT_CACHE].default_timeout
+        if next_publish_on is not None:
+            timeout = min(timeout, max((next_publish_on - timezone.now()).total_seconds(), 1))
+        return timeout
+
 
 class CommitteeView(TemplateView):
     template_name = "phylactery/committee.html"